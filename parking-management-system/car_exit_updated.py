@@ -1,47 +1,43 @@
 import platform
 import cv2
-from ultralytics import YOLO
-import pytesseract
-import os
 import time
 import serial
 import serial.tools.list_ports
-import csv
-from collections import Counter
 from datetime import datetime
 
-# Configure Tesseract
-pytesseract.pytesseract.tesseract_cmd = r'C:\Users\user\AppData\Local\Programs\Tesseract-OCR\tesseract.exe'
-
-# Load YOLOv8 model
-model = YOLO('./brain/best3.pt')
-
-# CSV log file for main parking data
-csv_file = 'testdb.csv'
+import config
+from event_log import get_logger
+from distance_filter import DistanceFilter, EVENT_ARRIVING
+from event_bus import AccessDenied, ExitGranted, SensorState, open_bus, record_attempt
+from exit_auth import ExitAuthCache
+from gate_startup import start_gate, stop_gate
+from plate_quality import QualityGate
+from plate_reader import detect_plates, preprocess_plate
+from plate_match import PlateIndex
+from plate_tracker import PlateTracker, draw_tracks
+from preview import PreviewPublisher
+from storage import open_store
+
+log = get_logger('exit')
+
+# Parking sessions and unauthorized attempts (CSV or SQLite, see config.py), shared with the other processes
+store = open_store()
+# Exits, denials and lane state go out to the dashboard (see event_bus.py)
+bus = open_bus('exit')
+# Parked plates, used to resolve one- or two-character misreads (see plate_match.py)
+plate_index = PlateIndex(store) if config.FUZZY_MATCHING else None
 MAX_DISTANCE = 50  # cm - Max distance to trigger car detection
 MIN_DISTANCE = 5  # cm - Min distance to avoid false positives from sensor too close
 
-# --- NEW: Log File for Unauthorized Attempts ---
-UNAUTHORIZED_ATTEMPTS_LOG_FILE = 'unauthorized_attempts_log.csv'
-
 # ===== Helper function to log unauthorized attempts =====
 def log_unauthorized_attempt(plate, attempt_type, reason, details=""):
     """
-    Logs an unauthorized attempt to a separate CSV file.
+    Logs the attempt to the store and publishes it as an AccessDenied event.
     """
-    header = ['timestamp', 'car_plate', 'attempt_type', 'reason', 'details']
-    
-    # Check if file exists and has a header, if not, create it
-    if not os.path.exists(UNAUTHORIZED_ATTEMPTS_LOG_FILE) or os.path.getsize(UNAUTHORIZED_ATTEMPTS_LOG_FILE) == 0:
-        with open(UNAUTHORIZED_ATTEMPTS_LOG_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
-
-    with open(UNAUTHORIZED_ATTEMPTS_LOG_FILE, 'a', newline='') as f:
-        writer = csv.writer(f)
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        writer.writerow([timestamp, plate, attempt_type, reason, details])
-    print(f"[LOG] Unauthorized attempt logged: Plate={plate}, Type={attempt_type}, Reason='{reason}'")
+    record_attempt(bus, store, AccessDenied(plate=plate, lane='exit', attempt_type=attempt_type, reason=reason,
+                                            details=details))
+    log.info('LOG', f"Unauthorized attempt logged: Plate={plate}, Type={attempt_type}, Reason='{reason}'",
+             plate=plate, attempt_type=attempt_type, reason=reason)
 
 
 # --- Auto-detect Arduino Serial Port ---
@@ -54,74 +50,66 @@ def detect_arduino_port():
         elif platform.system() != 'Windows':
             if "ttyUSB" in port.device or "ttyACM" in port.device or "wchusbserial" in port.device:
                 return port.device
-    print("[WARN] No typical Arduino/ESP serial port found.")
+    log.warning('SERIAL', "No typical Arduino/ESP serial port found.")
     return None
 
-# --- Read distance from Arduino (Parses "DIST:XX.YY" format) ---
+# --- Newest distance from the Arduino (see serial_protocol.GateLink) ---
 def read_distance(arduino_serial):
-    if arduino_serial and arduino_serial.in_waiting > 0:
-        try:
-            line = arduino_serial.readline().decode('utf-8').strip()
-            if line.startswith("DIST:"):
-                try:
-                    distance_str = line.replace("DIST:", "")
-                    return float(distance_str)
-                except ValueError:
-                    return None
-            elif line.startswith("MSG:"):
-                pass
-            return None
-        except UnicodeDecodeError:
-            return None
-        except serial.SerialException as e:
-            return None
-    return None
-
-# Initialize Arduino serial communication
-arduino_port = detect_arduino_port()
-if arduino_port:
-    print(f"[CONNECTED] Attempting to connect to Arduino on {arduino_port}")
-    try:
-        arduino = serial.Serial(arduino_port, 9600, timeout=1)
-        time.sleep(2)
-        print(f"[SUCCESS] Arduino connected on {arduino_port}")
-    except serial.SerialException as e:
-        print(f"[ERROR] Could not open serial port {arduino_port}: {e}")
-        arduino = None
-else:
-    print("[ERROR] Arduino serial port not detected. Check connections and port name.")
-    arduino = None
+    return arduino_serial.read_distance() if arduino_serial else None
 
 # --- Check and update exit record ---
-def handle_exit(plate_number, arduino_serial):
-    if not os.path.exists(csv_file):
-        print("[ERROR] CSV file not found. Cannot process exit.")
+def handle_exit(plate_number, arduino_serial, exit_auth=None):
+    """
+    Decides on the car read as `plate_number`: True opens the gate, False denies it
+    (alarm and unauthorized attempt), None means the read is too uncertain to decide
+    on and the plate should be read again.
+    """
+    # Paid cars: the payment station already pushed the answer, so no store lookup is needed
+    authorization = exit_auth.lookup(plate_number) if exit_auth else None
+    if authorization:
+        remaining = (authorization['expires'] - time.time()) / 60
+        log.info('ACCESS GRANTED', f"Pre-authorized exit for {plate_number} (session {authorization['no']}, "
+                 f"valid {remaining:.2f} more min).", plate=plate_number, no=authorization['no'], via='exit_auth')
+        exit_auth.revoke(plate_number)  # one exit per payment
+        if bus:
+            bus.publish(ExitGranted(plate=plate_number, no=authorization['no'], via='exit_auth'))
+        return True
+
+    if not store.exists():
+        log.error('STORE', "Session store not found. Cannot process exit.")
         return False
 
-    rows = []
-    with open(csv_file, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            rows.append(r)
-
-    latest_entry_for_plate = None
-    for row in reversed(rows):
-        if row['car_plate'] == plate_number:
-            latest_entry_for_plate = row
-            break
+    latest_entry_for_plate = store.latest_session(plate_number)
+
+    if latest_entry_for_plate is None and plate_index:
+        # Probably a misread: resolve it to a parked car before raising the alarm
+        match = plate_index.resolve(plate_number)
+        session = store.latest_session(match.plate) if match else None  # the index may predate a payment
+        if session:
+            if match.confidence < config.FUZZY_EXIT_MIN_CONFIDENCE:
+                # Most likely that car, but not sure enough to open the gate or sound the alarm: read it again
+                log.info('FUZZY', f"Read {plate_number} is close to parked car {match.plate} "
+                         f"(confidence {match.confidence:.2f}); reading again.", read=plate_number,
+                         plate=match.plate, confidence=round(match.confidence, 3))
+                return None
+            log.info('FUZZY', f"Read {plate_number} resolved to parked car {match.plate} "
+                     f"(confidence {match.confidence:.2f}).", read=plate_number, plate=match.plate,
+                     confidence=round(match.confidence, 3))
+            plate_number, latest_entry_for_plate = match.plate, session
 
     if latest_entry_for_plate:
         # Scenario 1: Car is currently in parking and UNPAID
         if latest_entry_for_plate['payment_status'] == '0' and latest_entry_for_plate['exit_time'] == '':
-            print(f"[ACCESS DENIED] Car {plate_number} has not paid. Triggering alert.")
+            log.warning('ACCESS DENIED', f"Car {plate_number} has not paid. Triggering alert.", plate=plate_number,
+                        reason='unpaid')
             # --- NEW: Log unauthorized exit attempt (unpaid) ---
             log_unauthorized_attempt(plate_number, "EXIT_DENIED", "Payment not made", f"Due: {latest_entry_for_plate['due_payment']}")
             if arduino_serial:
                 arduino_serial.write(b'2')
-                print("[ALERT] Sent '2' to Arduino (Payment Pending/Denied Exit).")
+                log.warning('ALERT', "Sent '2' to Arduino (Payment Pending/Denied Exit).")
                 time.sleep(10)
                 arduino_serial.write(b'S')
-                print("[ALERT] Sent 'S' to Arduino to stop alert after initial burst.")
+                log.warning('ALERT', "Sent 'S' to Arduino to stop alert after initial burst.")
             return False
 
         # Scenario 2: Car has paid and is attempting to exit (check if it's the valid paid entry)
@@ -130,21 +118,28 @@ def handle_exit(plate_number, arduino_serial):
                 csv_exit_time = datetime.strptime(latest_entry_for_plate['exit_time'], '%Y-%m-%d %H:%M:%S')
                 time_diff_since_payment = (datetime.now() - csv_exit_time).total_seconds() / 60
 
-                if time_diff_since_payment <= 5:
-                    print(f"[ACCESS GRANTED] Latest paid exit found for {plate_number}. Time since payment: {time_diff_since_payment:.2f} min.")
+                if time_diff_since_payment <= config.EXIT_GRACE_MINUTES:
+                    log.info('ACCESS GRANTED', f"Latest paid exit found for {plate_number}. Time since payment: {time_diff_since_payment:.2f} min.",
+                             plate=plate_number, no=latest_entry_for_plate['no'], via='store')
+                    if exit_auth:
+                        exit_auth.revoke(plate_number)  # an authorization for the same payment is used up too
+                    if bus:
+                        bus.publish(ExitGranted(plate=plate_number, no=latest_entry_for_plate['no'], via='store'))
                     return True
                 else:
-                    print(f"[ACCESS DENIED] Paid record for {plate_number} is too old ({time_diff_since_payment:.2f} min ago). Triggering alert.")
+                    log.warning('ACCESS DENIED', f"Paid record for {plate_number} is too old ({time_diff_since_payment:.2f} min ago). Triggering alert.",
+                                plate=plate_number, reason='payment_too_old')
                     # --- NEW: Log unauthorized exit attempt (old payment) ---
                     log_unauthorized_attempt(plate_number, "EXIT_DENIED", "Previous payment too old", f"Paid {time_diff_since_payment:.2f} min ago")
                     if arduino_serial:
                         arduino_serial.write(b'3')
-                        print("[ALERT] Sent '3' to Arduino (Old Payment / Denied Exit).")
+                        log.warning('ALERT', "Sent '3' to Arduino (Old Payment / Denied Exit).")
                         time.sleep(3)
                         arduino_serial.write(b'S')
                     return False
             except ValueError:
-                print(f"[ERROR] Invalid 'exit_time' format in CSV for {plate_number}: {latest_entry_for_plate['exit_time']}. Triggering alert.")
+                log.error('STORE', f"Invalid 'exit_time' format in the store for {plate_number}: {latest_entry_for_plate['exit_time']}. Triggering alert.",
+                          plate=plate_number)
                 # --- NEW: Log unauthorized exit attempt (invalid data) ---
                 log_unauthorized_attempt(plate_number, "EXIT_DENIED", "Invalid record data", f"Invalid exit_time format: {latest_entry_for_plate['exit_time']}")
                 if arduino_serial:
@@ -154,7 +149,8 @@ def handle_exit(plate_number, arduino_serial):
                 return False
         # Scenario 3: Car is in parking but in an unhandled state
         else:
-            print(f"[ACCESS DENIED] Unhandled status for {plate_number}: Payment_status={latest_entry_for_plate['payment_status']}, Exit_time='{latest_entry_for_plate['exit_time']}'. Triggering alert.")
+            log.warning('ACCESS DENIED', f"Unhandled status for {plate_number}: Payment_status={latest_entry_for_plate['payment_status']}, Exit_time='{latest_entry_for_plate['exit_time']}'. Triggering alert.",
+                        plate=plate_number, reason='unhandled_status')
             # --- NEW: Log unauthorized exit attempt (unhandled status) ---
             log_unauthorized_attempt(plate_number, "EXIT_DENIED", "Unhandled status", f"Status: {latest_entry_for_plate['payment_status']}, Exit Time: '{latest_entry_for_plate['exit_time']}'")
             if arduino_serial:
@@ -163,7 +159,8 @@ def handle_exit(plate_number, arduino_serial):
                 arduino_serial.write(b'S')
             return False
     else:
-        print(f"[ACCESS DENIED] No entry record found for {plate_number}. Triggering alert.")
+        log.warning('ACCESS DENIED', f"No entry record found for {plate_number}. Triggering alert.", plate=plate_number,
+                    reason='no_record')
         # --- NEW: Log unauthorized exit attempt (no record) ---
         log_unauthorized_attempt(plate_number, "EXIT_DENIED", "No entry record found")
         if arduino_serial:
@@ -172,105 +169,128 @@ def handle_exit(plate_number, arduino_serial):
             arduino_serial.write(b'S')
         return False
 
-# --- Webcam and Main Loop ---
-cap = cv2.VideoCapture(0)
 
-plate_buffer = []
-last_plate_detection_time = 0
+# --- Main Loop ---
+def main():
+    # Model, serial link, webcam and OCR are brought up in parallel
+    gate = start_gate('EXIT', detect_arduino_port)
+    model, arduino, cap, ocr = gate.model, gate.arduino, gate.cap, gate.ocr
+    quality_gate = QualityGate()
+    # PaymentCompleted events from payment.py; handle_exit falls back to the store for anything else
+    exit_auth = ExitAuthCache() if config.EXIT_AUTH_ENABLED and config.BUS_ENABLED else None
+    if exit_auth and not exit_auth.start():
+        exit_auth = None
 
-print("[EXIT SYSTEM] Ready. Press 'q' to quit.")
+    tracker = PlateTracker()
+    sensor = DistanceFilter(max_distance=MAX_DISTANCE, min_distance=MIN_DISTANCE)
+    preview = PreviewPublisher('EXIT')  # shown on the dashboard at /api/preview/exit.mjpg
 
-is_gate_controlled_open = False
-gate_open_time = 0
+    log.info('EXIT SYSTEM', "Ready. Press Ctrl+C to quit." if config.HEADLESS else "Ready. Press 'q' to quit.")
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("[ERROR] Failed to grab frame from webcam. Exiting.")
-        break
+    is_gate_controlled_open = False
+    gate_open_time = 0
 
-    distance = read_distance(arduino)
-    if distance is None:
-        distance_for_check = MAX_DISTANCE + 1
-    else:
-        distance_for_check = distance
-
-    if is_gate_controlled_open and (time.time() - gate_open_time) > 15:
-        if arduino:
-            arduino.write(b'0')
-            print("[GATE] Auto-closing gate (sent '0').")
-        is_gate_controlled_open = False
-
-    plates_detected_in_frame = False
-    annotated_frame = frame
-
-    if MIN_DISTANCE <= distance_for_check <= MAX_DISTANCE:
-        results = model(frame)
-        annotated_frame = results[0].plot()
-
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                plate_img = frame[y1:y2, x1:x2]
-
-                gray = cv2.cvtColor(plate_img, cv2.COLOR_BGR2GRAY)
-                blur = cv2.GaussianBlur(gray, (5, 5), 0)
-                thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
-
-                plate_text = pytesseract.image_to_string(
-                    thresh, config='--psm 8 --oem 3 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
-                ).strip().replace(" ", "")
-
-                if "RA" in plate_text:
-                    start_idx = plate_text.find("RA")
-                    plate_candidate = plate_text[start_idx:]
-                    if len(plate_candidate) >= 7:
-                        plate_candidate = plate_candidate[:7]
-                        prefix, digits, suffix = plate_candidate[:3], plate_candidate[3:6], plate_candidate[6]
-                        if (prefix.isalpha() and prefix.isupper() and
-                            digits.isdigit() and suffix.isalpha() and suffix.isupper()):
-                            print(f"[VALID] Plate detected: {plate_candidate}")
-                            plate_buffer.append(plate_candidate)
-                            plates_detected_in_frame = True
-                            last_plate_detection_time = time.time()
-
-                            if len(plate_buffer) >= 3:
-                                most_common_plate = Counter(plate_buffer).most_common(1)[0][0]
-                                plate_buffer.clear()
-
-                                if not is_gate_controlled_open:
-                                    if handle_exit(most_common_plate, arduino):
-                                        print(f"[ACCESS GRANTED] Opening gate for {most_common_plate}")
-                                        if arduino:
-                                            arduino.write(b'1')
-                                            print("[GATE] Sent '1' to Arduino (Open Gate).")
-                                            is_gate_controlled_open = True
-                                            gate_open_time = time.time()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            log.error('CAMERA', "Failed to grab frame from webcam. Exiting.")
+            break
+
+        reading = sensor.update(read_distance(arduino))
+        if reading.event == EVENT_ARRIVING:
+            log.info('SENSOR', f"Car arriving ({reading.distance:.0f} cm, {-reading.velocity:.0f} cm/s), reading ahead.",
+                     distance=round(reading.distance, 1), velocity=round(reading.velocity, 1))
+        if reading.event and bus:
+            bus.publish(SensorState.of('exit', reading))
+
+        if is_gate_controlled_open and (time.time() - gate_open_time) > 15:
+            if arduino:
+                arduino.write(b'0')
+                log.info('GATE', "Auto-closing gate (sent '0').")
+            is_gate_controlled_open = False
+
+        tracks = None
+
+        if reading.active:
+            _, plate_boxes = detect_plates(model, frame)
+            tracks = tracker.update(plate_boxes)
+
+            # Every car in view has its own track and votes; decided tracks are not read again
+            for track in tracks:
+                if track.decision:
+                    continue
+                # Only a crop that passes the blur/exposure/size checks, and is near the best
+                # this track has had, goes to OCR
+                for x1, y1, x2, y2 in quality_gate.select(frame, [track.box], track):
+                    # Rectified (deskewed, frontal) crop and its adaptive binarization
+                    plate_img, thresh = preprocess_plate(frame, (x1, y1, x2, y2))
+
+                    plate_text = ocr.read(thresh)
+
+                    if "RA" in plate_text:
+                        start_idx = plate_text.find("RA")
+                        plate_candidate = plate_text[start_idx:]
+                        if len(plate_candidate) >= 7:
+                            plate_candidate = plate_candidate[:7]
+                            prefix, digits, suffix = plate_candidate[:3], plate_candidate[3:6], plate_candidate[6]
+                            if (prefix.isalpha() and prefix.isupper() and
+                                digits.isdigit() and suffix.isalpha() and suffix.isupper()):
+                                log.debug('VALID', f"Plate detected: {plate_candidate} (track #{track.id})",
+                                          plate=plate_candidate, track=track.id)
+                                most_common_plate = track.vote(plate_candidate)
+
+                                # Votes collected while the car approaches; act once it is at the barrier
+                                if most_common_plate and reading.present:
+                                    if not is_gate_controlled_open:
+                                        granted = handle_exit(most_common_plate, arduino, exit_auth)
+                                        if granted is None:
+                                            track.reset_votes()  # uncertain near match: read the plate again
                                         else:
-                                            print("[GATE] Gate opening skipped: Arduino not connected.")
-                                else:
-                                    print(f"[INFO] Gate already open, skipping re-check for {most_common_plate}.")
-
-                                cv2.imshow("Plate", plate_img)
-                                cv2.imshow("Processed", thresh)
-                                time.sleep(0.1)
-
-        if not plates_detected_in_frame and len(plate_buffer) > 0:
-            if time.time() - last_plate_detection_time > 2:
-                plate_buffer.clear()
-                print("[INFO] Plate buffer cleared due to no recent detections.")
-    else:
-        if len(plate_buffer) > 0:
-            plate_buffer.clear()
+                                            track.decide(most_common_plate)
+                                        if granted:
+                                            log.info('ACCESS GRANTED', f"Opening gate for {most_common_plate}")
+                                            if arduino:
+                                                arduino.write(b'1')
+                                                log.info('GATE', "Sent '1' to Arduino (Open Gate).")
+                                                is_gate_controlled_open = True
+                                                gate_open_time = time.time()
+                                            else:
+                                                log.info('GATE', "Gate opening skipped: Arduino not connected.")
+                                    else:
+                                        # Queued behind the car going out: read it again once the gate is free
+                                        track.reset_votes()
+                                        log.info('GATE', f"Gate already open, skipping re-check for {most_common_plate}.",
+                                                 plate=most_common_plate)
+
+                                    if not config.HEADLESS:
+                                        cv2.imshow("Plate", plate_img)
+                                        cv2.imshow("Processed", thresh)
+                                        time.sleep(0.1)
+        else:
+            tracker.clear()
+
+        if config.HEADLESS:
+            # No local window: the annotated frame is only drawn when a preview is due
+            preview.maybe_publish(lambda: draw_tracks(frame.copy(), tracks) if tracks is not None else frame)
+        else:
+            annotated_frame = draw_tracks(frame.copy(), tracks) if tracks is not None else frame
+            cv2.imshow("Exit Webcam Feed", annotated_frame)
+            preview.maybe_publish(lambda: annotated_frame)
+
+        quality_gate.maybe_report()
+
+        if gate.stop.is_set() or (not config.HEADLESS and cv2.waitKey(1) & 0xFF == ord('q')):
+            break
 
-    cv2.imshow("Exit Webcam Feed", annotated_frame)
+    log.info('QUALITY', quality_gate.summary(), **quality_gate.counters)
+    if exit_auth:
+        exit_auth.stop()
+    preview.close()
+    stop_gate(gate)
+    if not config.HEADLESS:
+        cv2.destroyAllWindows()
+    log.info('EXIT SYSTEM', "Shutting down.")
 
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
 
-cap.release()
-if arduino:
-    arduino.close()
-    print("[INFO] Arduino serial connection closed.")
-cv2.destroyAllWindows()
-print("[EXIT SYSTEM] Shutting down.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
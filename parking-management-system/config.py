@@ -0,0 +1,164 @@
+"""
+Shared settings for the gate, payment and dashboard processes.
+
+Every value can be overridden with a PMS_* environment variable, so each lane
+can be tuned on the gate PC without editing the scripts.
+"""
+import os
+
+
+def _env(name, default, cast=str):
+    """Returns the environment variable `name` converted with `cast`, or `default`."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    if cast is bool:
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return cast(value)
+
+
+# --- Detector / OCR ---
+MODEL_PATH = _env('PMS_MODEL_PATH', './brain/best3.pt')
+OCR_ENGINE = _env('PMS_OCR_ENGINE', 'tesseract')  # 'tesseract' or 'segment' (in-process, see plate_ocr.py)
+OCR_MODEL_PATH = _env('PMS_OCR_MODEL_PATH', './brain/plate_chars.npz')  # .npz (NumPy) or .onnx - 'segment' engine only
+TESSERACT_CMD = _env('PMS_TESSERACT_CMD', '')  # empty = tesseract on PATH, else the default Windows install
+WARMUP_IMAGE_SIZE = _env('PMS_WARMUP_IMGSZ', 640, int)  # px - size of the blank frame used to warm up the detector
+
+# --- Detector hot swap (see model_swap.py) ---
+MODEL_HOT_SWAP = _env('PMS_MODEL_HOT_SWAP', True, bool)  # False = the startup weights stay until the gate restarts
+MODEL_DIR = _env('PMS_MODEL_DIR', os.path.dirname(MODEL_PATH) or '.')  # new or replaced *.pt files here are swapped in
+MODEL_WATCH_INTERVAL = _env('PMS_MODEL_WATCH_INTERVAL', 10.0, float)  # s between looks at MODEL_DIR
+MODEL_REFERENCE_DIR = _env('PMS_MODEL_REFERENCE_DIR', 'dataset/val/images')  # self-test images, each with a plate
+MODEL_REFERENCE_IMAGES = _env('PMS_MODEL_REFERENCE_IMAGES', 8, int)  # how many of them the self-test runs
+MODEL_MIN_DETECTION_RATE = _env('PMS_MODEL_MIN_DETECTION_RATE', 0.75, float)  # share of them new weights must find a plate on
+MODEL_MAX_DETECTION_DROP = _env('PMS_MODEL_MAX_DETECTION_DROP', 0.1, float)  # detection rate new weights may lose (absolute)
+MODEL_MAX_SLOWDOWN = _env('PMS_MODEL_MAX_SLOWDOWN', 0.25, float)  # median inference time new weights may add (share)
+MODEL_PROBATION_FRAMES = _env('PMS_MODEL_PROBATION_FRAMES', 200, int)  # live frames before new weights are kept or rolled back
+
+# --- Camera ---
+CAMERA_INDEX = _env('PMS_CAMERA_INDEX', 0, int)
+
+# --- Arduino serial link ---
+SERIAL_PROTOCOL = _env('PMS_SERIAL_PROTOCOL', 'binary')  # 'binary' (framed, see serial_protocol.py) or 'text'
+SERIAL_BAUD = _env('PMS_SERIAL_BAUD', 115200 if SERIAL_PROTOCOL == 'binary' else 9600, int)  # must match the sketch
+ARDUINO_RESET_DELAY = _env('PMS_ARDUINO_RESET_DELAY', 2.0, float)  # s - the board resets when the port opens
+
+# --- Startup ---
+READY_DIR = _env('PMS_READY_DIR', 'run')  # <lane>.ready files are written here once a gate is up
+
+# --- Storage ---
+STORAGE_BACKEND = _env('PMS_STORAGE', 'csv')  # 'csv' or 'sqlite'
+SQLITE_PATH = _env('PMS_SQLITE_PATH', 'parking.db')
+SESSIONS_CSV = _env('PMS_SESSIONS_CSV', 'testdb.csv')
+ATTEMPTS_CSV = _env('PMS_ATTEMPTS_CSV', 'unauthorized_attempts_log.csv')
+
+# --- Tariff ---
+TARIFF_FILE = _env('PMS_TARIFF_FILE', 'tariff.json')  # falls back to the flat 8.33/min rate if missing
+
+# --- Payment station ---
+PAYMENT_READY_TIMEOUT = _env('PMS_PAYMENT_READY_TIMEOUT', 5.0, float)  # s - card read -> reader's READY
+PAYMENT_DONE_TIMEOUT = _env('PMS_PAYMENT_DONE_TIMEOUT', 10.0, float)  # s - balance sent -> reader's DONE
+PAYMENT_POLL_INTERVAL = _env('PMS_PAYMENT_POLL_INTERVAL', 0.005, float)  # s - sleep between serial polls
+
+# --- Detection ---
+DETECT_SIZE = _env('PMS_DETECT_SIZE', 640, int)  # px - long side of the frame the detector sees (0 = native frame)
+DETECT_LETTERBOX = _env('PMS_DETECT_LETTERBOX', False, bool)  # pad to a square canvas once instead of per call
+
+# --- Plate quality gate (before OCR) ---
+QUALITY_MIN_WIDTH = _env('PMS_QUALITY_MIN_WIDTH', 60, int)  # px - in native frame resolution
+QUALITY_MIN_HEIGHT = _env('PMS_QUALITY_MIN_HEIGHT', 15, int)  # px
+QUALITY_MIN_ASPECT = _env('PMS_QUALITY_MIN_ASPECT', 1.5, float)  # width / height
+QUALITY_MAX_ASPECT = _env('PMS_QUALITY_MAX_ASPECT', 8.0, float)
+QUALITY_MIN_SHARPNESS = _env('PMS_QUALITY_MIN_SHARPNESS', 60.0, float)  # Laplacian variance at 48 px height
+QUALITY_MIN_BRIGHTNESS = _env('PMS_QUALITY_MIN_BRIGHTNESS', 40.0, float)  # mean grey level
+QUALITY_MAX_BRIGHTNESS = _env('PMS_QUALITY_MAX_BRIGHTNESS', 220.0, float)
+QUALITY_MAX_CLIPPED = _env('PMS_QUALITY_MAX_CLIPPED', 0.35, float)  # share of near black/white pixels
+QUALITY_REPORT_INTERVAL = _env('PMS_QUALITY_REPORT_INTERVAL', 60.0, float)  # s - 0 disables the periodic report
+QUALITY_TRACK_SHARE = _env('PMS_QUALITY_TRACK_SHARE', 0.8, float)  # share of its track's best score a crop needs for OCR
+
+# --- Plate rectification ---
+RECTIFY_PLATES = _env('PMS_RECTIFY_PLATES', True, bool)  # False = axis-aligned crop + global Otsu (old behaviour)
+RECTIFIED_SIZE = (_env('PMS_RECTIFIED_WIDTH', 320, int), _env('PMS_RECTIFIED_HEIGHT', 68, int))  # px - frontal plate view
+RECTIFY_MARGIN = _env('PMS_RECTIFY_MARGIN', 0.1, float)  # box is enlarged by this share on each side to catch the plate edge
+
+# --- Plate tracking (one vote buffer per car) ---
+TRACK_IOU = _env('PMS_TRACK_IOU', 0.3, float)  # min box overlap to continue a track
+TRACK_MAX_MISSED = _env('PMS_TRACK_MAX_MISSED', 15, int)  # detector frames a track may go unmatched
+TRACK_MAX_IDLE = _env('PMS_TRACK_MAX_IDLE', 2.0, float)  # s - a track unseen this long is dropped
+TRACK_VOTES = _env('PMS_TRACK_VOTES', 3, int)  # valid reads a track needs before the gate decides
+
+# --- Exit authorizations (PaymentCompleted events -> exit lane) ---
+EXIT_GRACE_MINUTES = _env('PMS_EXIT_GRACE_MINUTES', 5, float)  # min - how long after paying a car may leave
+EXIT_AUTH_ENABLED = _env('PMS_EXIT_AUTH', True, bool)  # False = exit lane always reads the store
+
+# --- Fuzzy plate matching (exit and payment) ---
+FUZZY_MATCHING = _env('PMS_FUZZY_MATCHING', True, bool)  # resolve near-miss reads to a parked plate
+FUZZY_MAX_EDITS = _env('PMS_FUZZY_MAX_EDITS', 2, int)  # Levenshtein radius searched in the BK-tree
+FUZZY_MIN_CONFIDENCE = _env('PMS_FUZZY_MIN_CONFIDENCE', 0.35, float)  # 0..1 - below this a read stays unmatched
+FUZZY_EXIT_MIN_CONFIDENCE = _env('PMS_FUZZY_EXIT_MIN_CONFIDENCE', 0.5, float)  # exit acts on a near match (gate or alarm); below it reads again
+FUZZY_REFRESH_INTERVAL = _env('PMS_FUZZY_REFRESH_INTERVAL', 10.0, float)  # s - parked plates are re-read this often
+
+# --- Operator plate search (dashboard, see plate_search.py) ---
+SEARCH_MAX_COST = _env('PMS_SEARCH_MAX_COST', 2.0, float)  # OCR-aware edits a match may be away from the query
+SEARCH_CANDIDATES = _env('PMS_SEARCH_CANDIDATES', 1000, int)  # plates sharing the most trigrams that get scored
+SEARCH_REBUILD_INTERVAL = _env('PMS_SEARCH_REBUILD_INTERVAL', 600.0, float)  # s - full re-read (0 = only at start)
+
+# --- Stale session sweeper (dashboard, see session_sweeper.py) ---
+SWEEP_INTERVAL = _env('PMS_SWEEP_INTERVAL', 3600.0, float)  # s between sweeps (0 = only when run by hand)
+SWEEP_MAX_OPEN_HOURS = _env('PMS_SWEEP_MAX_OPEN_HOURS', 72.0, float)  # h - an unpaid session open longer is abandoned
+SWEEP_FUTURE_TOLERANCE = _env('PMS_SWEEP_FUTURE_TOLERANCE', 3600.0, float)  # s - entry times further ahead are anomalous
+# What each rule does with the sessions it finds: 'close', 'flag' (alert only) or 'off'
+SWEEP_SUPERSEDED = _env('PMS_SWEEP_SUPERSEDED', 'close')  # open, but the plate has a newer session since
+SWEEP_ABANDONED = _env('PMS_SWEEP_ABANDONED', 'flag')  # open for more than SWEEP_MAX_OPEN_HOURS (may be a long stay)
+SWEEP_BAD_ENTRY_TIME = _env('PMS_SWEEP_BAD_ENTRY_TIME', 'flag')  # open with an unreadable or future entry_time
+SWEEP_UNPAID_FARE = _env('PMS_SWEEP_UNPAID_FARE', 'flag')  # priced but never paid, older than SWEEP_MAX_OPEN_HOURS
+SWEEP_ARCHIVE_AFTER_HOURS = _env('PMS_SWEEP_ARCHIVE_AFTER_HOURS', 24.0, float)  # h - CSV: settled sessions move to the archive (0 = never)
+
+# --- Headless operation / preview stream ---
+HEADLESS = _env('PMS_HEADLESS', False, bool)  # no local windows; watch the dashboard's MJPEG preview instead
+PREVIEW_FPS = _env('PMS_PREVIEW_FPS', 2.0, float)  # previews per second (0 disables publishing)
+PREVIEW_WIDTH = _env('PMS_PREVIEW_WIDTH', 640, int)  # px - previews are scaled down to this width
+PREVIEW_JPEG_QUALITY = _env('PMS_PREVIEW_JPEG_QUALITY', 70, int)  # 0-100
+PREVIEW_DIR = _env('PMS_PREVIEW_DIR', READY_DIR)  # <lane>.jpg is written here
+
+# --- Distance sensor filtering / early arrival ---
+SENSOR_MEDIAN_WINDOW = _env('PMS_SENSOR_MEDIAN_WINDOW', 5, int)  # samples - removes single-sample spikes and dropouts
+SENSOR_MEASUREMENT_NOISE = _env('PMS_SENSOR_MEASUREMENT_NOISE', 3.0, float)  # cm - std of one ultrasonic sample
+SENSOR_PROCESS_NOISE = _env('PMS_SENSOR_PROCESS_NOISE', 150.0, float)  # cm/s^2 - how hard a car may brake or pull up
+SENSOR_MAX_RANGE = _env('PMS_SENSOR_MAX_RANGE', 400.0, float)  # cm - no echo counts as a reading this far away
+SENSOR_STALE = _env('PMS_SENSOR_STALE', 1.0, float)  # s - without a sample for this long the lane counts as empty
+SENSOR_HYSTERESIS = _env('PMS_SENSOR_HYSTERESIS', 10.0, float)  # cm - a present car leaves at trigger distance + this
+ARRIVAL_RANGE = _env('PMS_ARRIVAL_RANGE', 250.0, float)  # cm - approaches are only watched inside this distance
+ARRIVAL_MIN_SPEED = _env('PMS_ARRIVAL_MIN_SPEED', 10.0, float)  # cm/s - slower than this is not an approach
+ARRIVAL_MAX_SPEED = _env('PMS_ARRIVAL_MAX_SPEED', 400.0, float)  # cm/s - faster is a jump (passer-by), not a car
+ARRIVAL_LEAD = _env('PMS_ARRIVAL_LEAD', 2.0, float)  # s - 'arriving' fires this long before the car reaches the trigger
+ARRIVAL_TIMEOUT = _env('PMS_ARRIVAL_TIMEOUT', 6.0, float)  # s - an arrival that never reaches the trigger is dropped
+
+# --- Event log ---
+LOG_DIR = _env('PMS_LOG_DIR', 'logs')  # <lane>.jsonl and its rotated .gz files
+LOG_LEVEL = _env('PMS_LOG_LEVEL', 'INFO')
+LOG_LEVELS = _env('PMS_LOG_LEVELS', '')  # per-lane overrides, e.g. "entry=DEBUG,payment=WARNING"
+LOG_CONSOLE = _env('PMS_LOG_CONSOLE', True, bool)  # also print "[TAG] message" lines to the console
+LOG_MAX_BYTES = _env('PMS_LOG_MAX_BYTES', 10 * 1024 * 1024, int)  # rotate at this size (0 = never)
+LOG_ROTATE_INTERVAL = _env('PMS_LOG_ROTATE_INTERVAL', 86400.0, float)  # s - rotate once the file is this old (0 = never)
+LOG_BACKUPS = _env('PMS_LOG_BACKUPS', 30, int)  # compressed files kept per lane
+LOG_QUEUE_SIZE = _env('PMS_LOG_QUEUE_SIZE', 10000, int)  # records waiting for the writer; beyond this they are dropped
+
+# --- Event bus (see event_bus.py) ---
+BUS_ENABLED = _env('PMS_BUS', True, bool)  # False = processes only share the store, as before
+BUS_DIR = _env('PMS_BUS_DIR', os.path.join(READY_DIR, 'bus'))  # subscribers register their UDP port here
+BUS_REFRESH_INTERVAL = _env('PMS_BUS_REFRESH_INTERVAL', 1.0, float)  # s - publishers re-list subscribers this often
+BUS_HEARTBEAT = _env('PMS_BUS_HEARTBEAT', 2.0, float)  # s - subscribers touch their registration this often
+BUS_STALE = _env('PMS_BUS_STALE', 6.0, float)  # s - a registration not touched this long is a dead process
+
+# --- Dashboard server (system_ui/backend/app.py) ---
+DASHBOARD_SERVER = _env('PMS_DASHBOARD_SERVER', 'waitress')  # 'waitress' (production) or 'dev' (Flask debug server)
+DASHBOARD_HOST = _env('PMS_DASHBOARD_HOST', '127.0.0.1')  # 0.0.0.0 to serve other PCs on the network
+DASHBOARD_PORT = _env('PMS_DASHBOARD_PORT', 5000, int)
+DASHBOARD_THREADS = _env('PMS_DASHBOARD_THREADS', 32, int)  # request threads; each open preview/event stream holds one
+DASHBOARD_MAX_STREAMS = _env('PMS_DASHBOARD_MAX_STREAMS', max(1, DASHBOARD_THREADS - 8), int)  # open streams; more get 503
+DASHBOARD_CONNECTION_LIMIT = _env('PMS_DASHBOARD_CONNECTION_LIMIT', 1000, int)  # open (keep-alive) connections
+DASHBOARD_KEEPALIVE = _env('PMS_DASHBOARD_KEEPALIVE', 120, int)  # s - idle keep-alive connections are closed after this
+DASHBOARD_GZIP_MIN = _env('PMS_DASHBOARD_GZIP_MIN', 1024, int)  # bytes - smaller responses are sent uncompressed
+DASHBOARD_CACHE_ENTRIES = _env('PMS_DASHBOARD_CACHE_ENTRIES', 32, int)  # distinct query results kept in memory
+DASHBOARD_EXPORT_SPOOLS = _env('PMS_DASHBOARD_EXPORT_SPOOLS', 4, int)  # exports kept in temp files for resumed downloads
@@ -0,0 +1,188 @@
+"""
+Filtered ultrasonic distance and early detection of approaching cars.
+
+The gates used to act on single raw samples: one noisy echo under 50 cm ran
+the detector on an empty lane, and a real car only started the detector once
+it had already stopped at the barrier. DistanceFilter turns the raw samples
+into a lane state:
+
+- a running median over SENSOR_MEDIAN_WINDOW samples removes spikes and
+  no-echo dropouts (no echo counts as SENSOR_MAX_RANGE);
+- a constant-velocity Kalman filter smooths the median and estimates the
+  approach speed (negative = towards the barrier);
+- the lane is IDLE, ARRIVING (a car inside ARRIVAL_RANGE, approaching at
+  ARRIVAL_MIN_SPEED or more, that will reach the trigger distance within
+  ARRIVAL_LEAD seconds; a jump faster than ARRIVAL_MAX_SPEED is someone
+  stepping in front of the sensor, not a car) or PRESENT (filtered distance
+  inside the trigger range, left again only SENSOR_HYSTERESIS cm beyond it).
+
+The gates run the detector and OCR while the lane is ARRIVING, so the votes
+for the plate are already in when the car reaches the barrier, and act on
+them only once it is PRESENT. An arrival that never reaches the trigger
+within ARRIVAL_TIMEOUT seconds (a car passing by, a pedestrian) is dropped.
+
+test_files/eval_distance_filter.py replays recorded DIST traces through the
+filter and compares it with the raw threshold.
+"""
+import time
+from collections import deque
+
+import config
+
+IDLE = 'idle'
+ARRIVING = 'arriving'
+PRESENT = 'present'
+
+# Events reported on the sample that caused them
+EVENT_ARRIVING = 'arriving'
+EVENT_PRESENT = 'present'
+EVENT_LEFT = 'left'
+EVENT_CANCELLED = 'cancelled'
+
+
+class DistanceReading:
+    """The lane as of the latest sample."""
+
+    def __init__(self, raw, distance, velocity, state, event=None, eta=None):
+        self.raw = raw  # cm - the sample as received (None if no new sample)
+        self.distance = distance  # cm - filtered, None before the first sample
+        self.velocity = velocity  # cm/s - negative while approaching
+        self.state = state
+        self.event = event  # set on the sample that changed the state
+        self.eta = eta  # s - until the trigger distance is reached, while approaching
+
+    @property
+    def active(self):
+        """True while the detector should run: a car is arriving or at the barrier."""
+        return self.state != IDLE
+
+    @property
+    def present(self):
+        return self.state == PRESENT
+
+    def __repr__(self):
+        return (f"DistanceReading({self.state}, distance={self.distance}, velocity={self.velocity}, "
+                f"event={self.event})")
+
+
+class KalmanDistance:
+    """Constant-velocity Kalman filter over distance samples; state is (distance, velocity)."""
+
+    def __init__(self, measurement_noise=config.SENSOR_MEASUREMENT_NOISE,
+                 process_noise=config.SENSOR_PROCESS_NOISE):
+        self.r = measurement_noise ** 2
+        self.q = process_noise ** 2
+        self.distance = None
+        self.velocity = 0.0
+        self.p = None  # covariance [[p00, p01], [p01, p11]]
+
+    def update(self, measurement, dt):
+        if self.distance is None:
+            self.distance, self.velocity = measurement, 0.0
+            self.p = [self.r, 0.0, 100.0 ** 2]
+            return self.distance, self.velocity
+
+        # Predict
+        p00, p01, p11 = self.p
+        self.distance += self.velocity * dt
+        p00 += dt * (2 * p01 + dt * p11) + self.q * dt ** 4 / 4
+        p01 += dt * p11 + self.q * dt ** 3 / 2
+        p11 += self.q * dt ** 2
+
+        # Correct
+        s = p00 + self.r
+        k0, k1 = p00 / s, p01 / s
+        innovation = measurement - self.distance
+        self.distance += k0 * innovation
+        self.velocity += k1 * innovation
+        self.p = [(1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01]
+        return self.distance, self.velocity
+
+
+class DistanceFilter:
+    """Raw samples in, DistanceReading (filtered distance, speed, lane state and events) out."""
+
+    def __init__(self, max_distance, min_distance=0.0, window=config.SENSOR_MEDIAN_WINDOW,
+                 max_range=config.SENSOR_MAX_RANGE, stale=config.SENSOR_STALE,
+                 hysteresis=config.SENSOR_HYSTERESIS, arrival_range=config.ARRIVAL_RANGE,
+                 min_speed=config.ARRIVAL_MIN_SPEED, max_speed=config.ARRIVAL_MAX_SPEED, lead=config.ARRIVAL_LEAD,
+                 timeout=config.ARRIVAL_TIMEOUT):
+        self.max_distance = max_distance
+        self.min_distance = min_distance
+        self.window = window
+        self.max_range = max_range
+        self.stale = stale
+        self.hysteresis = hysteresis
+        self.arrival_range = arrival_range
+        self.min_speed = min_speed
+        self.max_speed = max_speed
+        self.lead = lead
+        self.timeout = timeout
+        self.reset()
+
+    def reset(self):
+        self.samples = deque(maxlen=self.window)
+        self.kalman = KalmanDistance()
+        self.state = IDLE
+        self.last_sample = None
+        self.arriving_since = None
+        self.reading = DistanceReading(None, None, 0.0, IDLE)
+
+    def update(self, raw, now=None):
+        """Feeds one sample (cm, or None when none came in) taken at `now` (monotonic s)."""
+        now = time.monotonic() if now is None else now
+        if raw is None:
+            if self.last_sample is not None and now - self.last_sample > self.stale:
+                # The sensor went quiet: forget the car rather than act on an old distance
+                event = EVENT_LEFT if self.state == PRESENT else EVENT_CANCELLED if self.state == ARRIVING else None
+                self.reset()
+                self.reading.event = event
+                return self.reading
+            self.reading = DistanceReading(None, self.reading.distance, self.reading.velocity, self.state,
+                                           eta=self.reading.eta)
+            return self.reading
+
+        dt = now - self.last_sample if self.last_sample is not None else 0.0
+        if dt > self.stale:
+            self.samples.clear()
+            self.kalman = KalmanDistance()
+        self.last_sample = now
+        self.samples.append(min(raw, self.max_range))
+        distance, velocity = self.kalman.update(sorted(self.samples)[len(self.samples) // 2], dt)
+
+        eta = None
+        if velocity <= -self.min_speed:
+            eta = max(0.0, (distance - self.max_distance) / -velocity)
+        event = self._advance(distance, velocity, eta, now)
+        if event in (EVENT_LEFT, EVENT_CANCELLED):
+            # Restart the estimate from the next sample instead of swinging back from the old car's distance
+            self.kalman = KalmanDistance()
+        self.reading = DistanceReading(raw, distance, velocity, self.state, event, eta)
+        return self.reading
+
+    def _advance(self, distance, velocity, eta, now):
+        """Moves the lane state on; returns the event, if any."""
+        if self.state == PRESENT:
+            if self.min_distance - self.hysteresis <= distance <= self.max_distance + self.hysteresis:
+                return None
+            self.state = IDLE
+            return EVENT_LEFT
+
+        if self.min_distance <= distance <= self.max_distance:
+            self.state = PRESENT
+            self.arriving_since = None
+            return EVENT_PRESENT
+
+        approaching = (eta is not None and -velocity <= self.max_speed and distance <= self.arrival_range
+                       and eta <= self.lead)
+        if self.state == IDLE and approaching:
+            self.state = ARRIVING
+            self.arriving_since = now
+            return EVENT_ARRIVING
+        if self.state == ARRIVING and (now - self.arriving_since > self.timeout or distance > self.arrival_range
+                                       or velocity >= self.min_speed):
+            # Passed by, turned away or reversed without reaching the barrier
+            self.state = IDLE
+            self.arriving_since = None
+            return EVENT_CANCELLED
+        return None
@@ -0,0 +1,313 @@
+"""
+Local event bus between the entry and exit gates, the payment station and the dashboard.
+
+The processes used to learn about each other only through the session and
+attempt files: the dashboard re-read them every few seconds and the exit
+lane re-read them for every car. Now whoever causes something publishes a
+typed event, and every interested process gets it within milliseconds:
+
+    CarEntered        entry gate opened a session      plate, no, entry_time
+    PaymentCompleted  payment station confirmed a card plate, no, amount, paid_at, expires, card_plate
+    ExitGranted       exit gate let a car out          plate, no, via
+    AccessDenied      a gate refused a car             plate, lane, attempt_type, reason, details
+    SensorState       a lane's distance state changed  lane, state, distance, velocity
+
+Every event also carries ts (time.time() at publishing), source and seq.
+
+There is no broker to start or to crash. A subscriber binds an ephemeral
+UDP port on 127.0.0.1 and announces it in BUS_DIR/<name>.<pid>.bus, which
+it touches every BUS_HEARTBEAT seconds. A publisher lists that directory at
+most every BUS_REFRESH_INTERVAL seconds and sends each event to every live
+subscriber as one JSON datagram (the same localhost UDP the exit
+authorizations used to travel over, so it works on the Windows gate PCs
+too). Publishing never blocks: with nobody listening it costs a directory
+listing per second.
+
+The bus only carries notifications; the store stays the record. Datagrams
+are not acknowledged, so a subscriber that stores what it receives would
+lose the audit record with every dropped datagram or restart: the process
+that causes something writes it to the store itself (record_attempt()
+writes an AccessDenied attempt, stamped with the event's ts, before
+publishing it), and sessions are written by the gate or station that
+changes them, because the next decision reads them straight back.
+
+    python event_bus.py watch            # print every event
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+import config
+from event_log import get_logger
+
+log = get_logger('event_bus')
+
+_MAX_DATAGRAM = 8192  # bytes - an event is well under this
+_HOST = '127.0.0.1'
+
+
+class Event:
+    """Base of the typed events; FIELDS are the payload, ts/source/seq the envelope."""
+    FIELDS = ()
+
+    def __init__(self, ts=None, source=None, seq=None, **values):
+        missing = [name for name in self.FIELDS if name not in values]
+        unknown = [name for name in values if name not in self.FIELDS]
+        if missing or unknown:
+            raise TypeError(f"{type(self).__name__}: missing {missing}, unknown {unknown}")
+        self.__dict__.update(values)
+        self.ts = time.time() if ts is None else ts
+        self.source = source
+        self.seq = seq
+
+    @property
+    def type(self):
+        return type(self).__name__
+
+    def to_dict(self):
+        entry = {'type': self.type, 'ts': self.ts, 'source': self.source, 'seq': self.seq}
+        entry.update((name, getattr(self, name)) for name in self.FIELDS)
+        return entry
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{self.type}({fields})"
+
+
+class CarEntered(Event):
+    FIELDS = ('plate', 'no', 'entry_time')
+
+
+class PaymentCompleted(Event):
+    # expires: epoch s, end of the exit grace period; card_plate: the card's plate, differs from the session's
+    # plate when the card was matched to a misread entry (see payment.price_card)
+    FIELDS = ('plate', 'no', 'amount', 'paid_at', 'expires', 'card_plate')
+
+
+class ExitGranted(Event):
+    FIELDS = ('plate', 'no', 'via')
+
+
+class AccessDenied(Event):
+    FIELDS = ('plate', 'lane', 'attempt_type', 'reason', 'details')
+
+
+class SensorState(Event):
+    FIELDS = ('lane', 'state', 'distance', 'velocity')
+
+    @classmethod
+    def of(cls, lane, reading):
+        """The event for a distance_filter.DistanceReading."""
+        distance = round(reading.distance, 1) if reading.distance is not None else None
+        return cls(lane=lane, state=reading.state, distance=distance, velocity=round(reading.velocity, 1))
+
+
+EVENT_TYPES = {cls.__name__: cls for cls in (CarEntered, PaymentCompleted, ExitGranted, AccessDenied, SensorState)}
+
+
+def encode(event):
+    return json.dumps(event.to_dict(), default=str).encode('utf-8')
+
+
+def decode(data):
+    """The Event in a datagram. Raises ValueError for anything that is not one."""
+    try:
+        entry = json.loads(data.decode('utf-8'))
+        cls = EVENT_TYPES[entry.pop('type')]
+        return cls(**entry)
+    except (UnicodeDecodeError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"not an event: {e}") from None
+
+
+def _registrations(bus_dir, stale):
+    """{file name: port} of the subscribers that touched their file within `stale` seconds."""
+    now = time.time()
+    found = {}
+    for path in glob.glob(os.path.join(glob.escape(bus_dir), '*.bus')):
+        try:
+            if now - os.path.getmtime(path) > stale:
+                continue  # its process died without removing the file
+            with open(path, encoding='utf-8') as f:
+                found[os.path.basename(path)] = int(json.load(f)['port'])
+        except (OSError, ValueError, KeyError, TypeError):
+            continue  # removed or half-written meanwhile
+    return found
+
+
+class EventPublisher:
+    """Sends events to every registered subscriber; never blocks the caller's loop."""
+
+    def __init__(self, source, bus_dir=config.BUS_DIR, refresh=config.BUS_REFRESH_INTERVAL, stale=config.BUS_STALE):
+        self.source = source
+        self.bus_dir = bus_dir
+        self.refresh = refresh
+        self.stale = stale
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.seq = itertools.count(1)
+        self.subscribers = {}
+        self.scanned = None
+        self.lock = threading.Lock()
+
+    def _current(self):
+        now = time.monotonic()
+        if self.scanned is None or now - self.scanned >= self.refresh:
+            self.subscribers = _registrations(self.bus_dir, self.stale)
+            self.scanned = now
+        return self.subscribers
+
+    def has_subscriber(self, name):
+        """True if a subscriber registered as `name` is alive."""
+        with self.lock:
+            return any(entry.startswith(name + '.') for entry in self._current())
+
+    def publish(self, event):
+        """Stamps `event` with this source and the next seq and sends it. Returns how many subscribers it went to."""
+        with self.lock:
+            event.source = self.source
+            event.seq = next(self.seq)
+            data = encode(event)
+            sent = 0
+            for entry, port in self._current().items():
+                try:
+                    self.sock.sendto(data, (_HOST, port))
+                    sent += 1
+                except OSError as e:
+                    log.debug('BUS', f"Could not send {event.type} to {entry}: {e}", subscriber=entry)
+        return sent
+
+    def close(self):
+        self.sock.close()
+
+
+class EventSubscriber:
+    """Receives events on a background thread and calls the handlers registered with on()."""
+
+    def __init__(self, name, bus_dir=config.BUS_DIR, heartbeat=config.BUS_HEARTBEAT):
+        self.name = name
+        self.bus_dir = bus_dir
+        self.heartbeat = heartbeat
+        self.handlers = []  # (event class or None for all, handler)
+        self.path = os.path.join(bus_dir, f"{name}.{os.getpid()}.bus")
+        self.sock = None
+        self.thread = None
+        self.running = False
+        self.received = 0
+        self.latency = 0.0  # s - publish to receive, of the last event
+
+    def on(self, event_type, handler):
+        """Calls handler(event) for every `event_type` event (every event if None). Returns the handler."""
+        self.handlers.append((event_type, handler))
+        return handler
+
+    def start(self):
+        """Binds, registers and starts receiving. Returns False (no events will arrive) if that fails."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind((_HOST, 0))
+            os.makedirs(self.bus_dir, exist_ok=True)
+            self._register(sock.getsockname()[1])
+        except OSError as e:
+            sock.close()
+            log.warning('BUS', f"Cannot subscribe as {self.name} ({e}); events will not arrive.")
+            return False
+        sock.settimeout(self.heartbeat)
+        self.sock = sock
+        self.running = True
+        self.thread = threading.Thread(target=self._receive, name=f"bus-{self.name}", daemon=True)
+        self.thread.start()
+        log.info('BUS', f"Subscribed as {self.name} on port {sock.getsockname()[1]}.", subscriber=self.name)
+        return True
+
+    def _register(self, port):
+        # Written aside and renamed, so a publisher never reads half a file
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'port': port, 'pid': os.getpid()}, f)
+        os.replace(tmp, self.path)
+
+    def _receive(self):
+        beat = time.monotonic()
+        while self.running:
+            if time.monotonic() - beat >= self.heartbeat:
+                beat = time.monotonic()
+                try:
+                    os.utime(self.path)
+                except OSError:
+                    self._register(self.sock.getsockname()[1])  # the bus directory was cleaned up
+            try:
+                data, _ = self.sock.recvfrom(_MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.running:
+                    break  # socket closed by stop()
+                continue  # Windows reports an earlier send to a closed port here
+            try:
+                event = decode(data)
+            except ValueError as e:
+                log.warning('BUS', f"Ignoring malformed datagram ({e}): {data[:80]!r}")
+                continue
+            self.received += 1
+            self.latency = time.time() - event.ts
+            self.dispatch(event)
+
+    def dispatch(self, event):
+        for event_type, handler in self.handlers:
+            if event_type is None or isinstance(event, event_type):
+                try:
+                    handler(event)
+                except Exception:
+                    log.exception('BUS', f"{self.name} handler failed on {event!r}", subscriber=self.name)
+
+    def stop(self):
+        self.running = False
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        if self.sock:
+            self.sock.close()
+        if self.thread:
+            self.thread.join(timeout=2.0)
+
+
+def record_attempt(bus, store, event):
+    """Stores an AccessDenied, then publishes it, so the write never depends on a datagram arriving."""
+    store.log_attempt(event.plate, event.attempt_type, event.reason, event.details or "",
+                      timestamp=datetime.fromtimestamp(event.ts))
+    if bus is not None:
+        bus.publish(event)
+
+
+def open_bus(source):
+    """The publisher for this process, or None with the bus disabled."""
+    return EventPublisher(source) if config.BUS_ENABLED else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch the event bus.")
+    parser.add_argument('command', choices=('watch',))
+    parser.add_argument('--bus-dir', default=config.BUS_DIR)
+    args = parser.parse_args()
+
+    runner = EventSubscriber('watch', args.bus_dir)
+    runner.on(None, lambda event: print(json.dumps(event.to_dict(), default=str), flush=True))
+    if not runner.start():
+        raise SystemExit(1)
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Structured event log for the gate, payment and dashboard processes.
+
+The loops used to print every diagnostic to the console, and payment.py
+opened parking_system_log.txt for each message it logged. Now every module
+logs through an EventLogger:
+
+    log = get_logger('exit_auth')
+    log.info('EXIT AUTH', f"{plate} authorized to exit", plate=plate, no=session_no)
+
+The call only puts the record on a bounded in-memory queue; a background
+thread formats and writes it, so the capture and payment loops never wait
+for the console or the disk. If the queue is full (the disk stalled) the
+record is dropped and counted instead of blocking the loop.
+
+The writer thread keeps the console output as before ("[TAG] message") and
+appends one JSON object per record to <LOG_DIR>/<lane>.jsonl:
+
+    {"ts": 1718000000.123, "time": "2024-06-10T08:13:20.123", "level": "INFO",
+     "lane": "exit", "source": "exit_auth", "tag": "EXIT AUTH", "msg": "...", "plate": "RAB123C", "no": 42}
+
+The file is rotated when it reaches LOG_MAX_BYTES or its first record is
+LOG_ROTATE_INTERVAL seconds old. The rotated file is gzip-compressed and
+only the newest LOG_BACKUPS are kept. Each process is a lane ('entry',
+'exit', 'payment', 'dashboard') with its own file and level: LOG_LEVEL,
+overridden per lane by LOG_LEVELS, e.g. PMS_LOG_LEVELS="entry=DEBUG,payment=WARNING".
+
+    python event_log.py query exit --tag "ACCESS DENIED" --since 2024-06-10
+"""
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import config
+
+_ROOT = 'pms'
+_lane = None
+_listener = None
+_queue_handler = None
+
+
+def lane_level(lane, default=config.LOG_LEVEL, overrides=config.LOG_LEVELS):
+    """The level name configured for `lane`."""
+    for item in overrides.split(','):
+        name, _, level = item.partition('=')
+        if name.strip().lower() == lane and level.strip():
+            return level.strip().upper()
+    return default.upper()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; the record's fields become top-level keys."""
+
+    def format(self, record):
+        entry = {'ts': round(record.created, 3),
+                 'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'lane': _lane, 'source': record.name[len(_ROOT) + 1:],
+                 'tag': getattr(record, 'tag', None), 'msg': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """The "[TAG] message" lines the processes always printed."""
+
+    def format(self, record):
+        tag = getattr(record, 'tag', None)
+        text = f"[{tag}] {record.getMessage()}" if tag else record.getMessage()
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+class _Batched:
+    """
+    Handler mixin: emit() does not flush on every record; the writer thread
+    calls flush_now() whenever the queue runs empty, so a burst costs one
+    flush instead of one per record.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_now(self):
+        super().flush()
+
+
+class ConsoleHandler(_Batched, logging.StreamHandler):
+    pass
+
+
+class CompressingRotatingHandler(_Batched, logging.handlers.BaseRotatingHandler):
+    """Appends to `path`; rotates by size or age into gzip files next to it, keeping `backups` of them."""
+
+    def __init__(self, path, max_bytes=config.LOG_MAX_BYTES, interval=config.LOG_ROTATE_INTERVAL,
+                 backups=config.LOG_BACKUPS):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        super().__init__(path, 'a', encoding='utf-8')
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backups = backups
+        self.started = self._first_timestamp()
+
+    def _first_timestamp(self):
+        """Time of the first record already in the file (so a restart does not reset its age)."""
+        try:
+            with open(self.baseFilename, encoding='utf-8') as f:
+                return json.loads(f.readline())['ts']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.max_bytes and self.stream.tell() >= self.max_bytes:
+            return True
+        return bool(self.interval and self.started is not None and record.created - self.started >= self.interval)
+
+    def emit(self, record):
+        super().emit(record)
+        if self.started is None:
+            self.started = record.created
+
+    def doRollover(self):
+        if self.stream:
+            self.flush_now()
+            self.stream.close()
+            self.stream = None
+        stem, ext = os.path.splitext(self.baseFilename)
+        stamp = datetime.fromtimestamp(self.started or time.time()).strftime('%Y%m%d-%H%M%S')
+        n = 0
+        while os.path.exists(f"{stem}-{stamp}-{n:03d}{ext}.gz"):
+            n += 1  # several rotations within one second (size limit under a burst): names still sort in order
+        rotated = f"{stem}-{stamp}-{n:03d}{ext}"
+        os.replace(self.baseFilename, rotated)
+        with open(rotated, 'rb') as src, gzip.open(rotated + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        for old in sorted(glob.glob(f"{glob.escape(stem)}-*{ext}.gz"))[:-self.backups or None]:
+            os.remove(old)
+        self.stream = self._open()
+        self.started = None
+
+
+class _Writer(logging.handlers.QueueListener):
+    """The background thread: writes records as they come, flushes when it has caught up."""
+
+    def dequeue(self, block):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            for handler in self.handlers:
+                handler.flush_now()
+            return self.queue.get(block)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; never blocks, drops (and counts) when the queue is full."""
+
+    def __init__(self, record_queue):
+        super().__init__(record_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record  # formatted on the writer thread, not in the caller's loop
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(lane, log_dir=config.LOG_DIR, console=config.LOG_CONSOLE, queue_size=config.LOG_QUEUE_SIZE):
+    """Starts the background writer for this process's `lane`. Call once, at the start of main()."""
+    global _lane, _listener, _queue_handler
+    if _listener is not None:
+        return
+    _lane = lane
+    handlers = [CompressingRotatingHandler(os.path.join(log_dir, f"{lane}.jsonl"))]
+    handlers[0].setFormatter(JsonFormatter())
+    if console:
+        handlers.append(ConsoleHandler(sys.stdout))
+        handlers[-1].setFormatter(ConsoleFormatter())
+
+    root = logging.getLogger(_ROOT)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)  # the console fallback of get_logger()
+    _queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    root.addHandler(_queue_handler)
+    root.setLevel(lane_level(lane))
+    root.propagate = False
+    _listener = _Writer(_queue_handler.queue, *handlers)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Writes out what is still queued and stops the writer thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.flush_now()
+        handler.close()
+    if _queue_handler.dropped:
+        print(f"[LOG] {_queue_handler.dropped} records dropped while the log writer was behind")
+    _listener = None
+
+
+def _console_fallback():
+    """Until setup_logging() runs (tools, test scripts), records simply go to the console."""
+    root = logging.getLogger(_ROOT)
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(ConsoleFormatter())
+        root.addHandler(handler)
+        root.setLevel(config.LOG_LEVEL.upper())
+        root.propagate = False
+
+
+class EventLogger:
+    """Logger for one module: every call takes a tag, a message and any structured fields."""
+
+    def __init__(self, name):
+        _console_fallback()
+        self.logger = logging.getLogger(f"{_ROOT}.{name}")
+
+    def log(self, level, tag, message, exc_info=None, **fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message, exc_info=exc_info, extra={'tag': tag, 'fields': fields})
+
+    def debug(self, tag, message, **fields):
+        self.log(logging.DEBUG, tag, message, **fields)
+
+    def info(self, tag, message, **fields):
+        self.log(logging.INFO, tag, message, **fields)
+
+    def warning(self, tag, message, **fields):
+        self.log(logging.WARNING, tag, message, **fields)
+
+    def error(self, tag, message, **fields):
+        self.log(logging.ERROR, tag, message, **fields)
+
+    def exception(self, tag, message, **fields):
+        """error() with the current exception's traceback."""
+        self.log(logging.ERROR, tag, message, exc_info=True, **fields)
+
+
+def get_logger(name):
+    return EventLogger(name)
+
+
+# --- Query ---
+def read_events(lane, log_dir=config.LOG_DIR, since=None, until=None, level=None, tag=None, **fields):
+    """
+    Yields the records of `lane` (rotated files included, oldest first) matching
+    the filters: since/until are datetimes, level a minimum level name, tag
+    exact, and every other keyword an exact field value.
+    """
+    stem = os.path.join(log_dir, lane)
+    paths = sorted(glob.glob(f"{glob.escape(stem)}-*.jsonl.gz")) + [f"{stem}.jsonl"]
+    min_level = logging.getLevelName(level.upper()) if level else None
+    since_ts = since.timestamp() if since else None
+    until_ts = until.timestamp() if until else None
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # a line cut off by a crash
+                if since_ts and entry['ts'] < since_ts or until_ts and entry['ts'] >= until_ts:
+                    continue
+                if min_level and logging.getLevelName(entry['level']) < min_level:
+                    continue
+                if tag and entry.get('tag') != tag:
+                    continue
+                if any(str(entry.get(key)) != str(value) for key, value in fields.items()):
+                    continue
+                yield entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the structured event logs.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    query = sub.add_parser('query', help="Print the matching records as JSON lines")
+    query.add_argument('lane', help="entry, exit, payment or dashboard")
+    query.add_argument('--since', type=datetime.fromisoformat, help="ISO date/time")
+    query.add_argument('--until', type=datetime.fromisoformat, help="ISO date/time")
+    query.add_argument('--level', help="Minimum level, e.g. WARNING")
+    query.add_argument('--tag', help="Exact tag, e.g. 'ACCESS DENIED'")
+    query.add_argument('--field', action='append', default=[], metavar='KEY=VALUE', help="e.g. plate=RAB123C")
+    query.add_argument('--log-dir', default=config.LOG_DIR)
+    args = parser.parse_args()
+
+    fields = dict(item.split('=', 1) for item in args.field)
+    for entry in read_events(args.lane, args.log_dir, args.since, args.until, args.level, args.tag, **fields):
+        print(json.dumps(entry))
+
+
+if __name__ == "__main__":
+    main()
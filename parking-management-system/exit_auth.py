@@ -0,0 +1,95 @@
+"""
+Exit authorizations from the payment station, cached by the exit lane.
+
+When a payment is confirmed, payment.py already knows the car may leave
+within EXIT_GRACE_MINUTES, and publishes that as a PaymentCompleted event
+on the event bus (see event_bus.py):
+
+    PaymentCompleted(plate='RAB123C', no=42, amount=1500, paid_at=..., expires=1718000000.0, card_plate='RAB123C')
+
+The exit lane's ExitAuthCache subscribes to those events and keeps the
+authorizations in memory, evicting them once they expire. The card's plate
+is authorized too: when the entry gate misread the car and the payment
+station matched the card to that session, the exit lane will most likely
+read the plate the card has, not the one stored.
+
+An authorization is used once: handle_exit() revokes it when it lets the
+car out, and a CarEntered event for the plate revokes it too, so a car that
+paid, left and came back within the grace period is judged by its new,
+unpaid session. handle_exit()
+asks the cache first, so letting a paid car out is a dictionary lookup; the
+session store is only read for cars the cache does not know (unpaid cars,
+or payments made while the exit lane was not running).
+
+Events are fire-and-forget: if the exit lane is down nothing waits, and the
+store still holds the payment.
+"""
+import threading
+import time
+
+from event_bus import CarEntered, EventSubscriber, PaymentCompleted
+from event_log import get_logger
+
+log = get_logger('exit_auth')
+
+
+class ExitAuthCache:
+    """Exit lane side: receives authorizations from the bus and answers lookups from memory."""
+
+    def __init__(self, subscriber=None):
+        self.entries = {}  # plate -> {'no': ..., 'expires': ...}
+        self.lock = threading.Lock()
+        self.subscriber = subscriber or EventSubscriber('exit_auth')
+        self.subscriber.on(PaymentCompleted, self.authorize)
+        self.subscriber.on(CarEntered, lambda event: self.revoke(event.plate, reason='entered again'))
+
+    def start(self):
+        """Subscribes to the bus. Returns False (cache stays empty) if that fails."""
+        if not self.subscriber.start():
+            log.warning('EXIT AUTH', "Not on the event bus; using the store only.")
+            return False
+        return True
+
+    def authorize(self, event):
+        try:
+            expires = float(event.expires)
+        except (TypeError, ValueError):
+            log.warning('EXIT AUTH', f"Ignoring authorization without expiry: {event!r}")
+            return
+        self.evict()
+        with self.lock:
+            for plate in {event.plate, event.card_plate or event.plate}:
+                self.entries[plate] = {'no': event.no, 'expires': expires}
+        log.info('EXIT AUTH', f"{event.plate} authorized to exit for {max(0.0, expires - time.time()) / 60:.1f} min.",
+                 plate=event.plate, no=event.no, expires=expires)
+
+    def revoke(self, plate, reason='used'):
+        """Drops the authorization for `plate` and any other plate authorized for the same session."""
+        with self.lock:
+            entry = self.entries.pop(plate, None)
+            if entry is None:
+                return
+            for other in [other for other, e in self.entries.items() if e['no'] == entry['no']]:
+                del self.entries[other]
+        log.info('EXIT AUTH', f"Authorization for {plate} revoked ({reason}).", plate=plate, no=entry['no'],
+                 reason=reason)
+
+    def evict(self, now=None):
+        """Drops expired authorizations."""
+        now = time.time() if now is None else now
+        with self.lock:
+            for plate in [plate for plate, entry in self.entries.items() if entry['expires'] <= now]:
+                del self.entries[plate]
+
+    def lookup(self, plate, now=None):
+        """Returns the live authorization for `plate` ({'no', 'expires'}), or None."""
+        now = time.time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(plate)
+            if entry and entry['expires'] <= now:
+                del self.entries[plate]
+                entry = None
+        return entry
+
+    def stop(self):
+        self.subscriber.stop()
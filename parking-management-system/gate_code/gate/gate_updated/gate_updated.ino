@@ -1,4 +1,5 @@
 #include <Servo.h>
+#include "pms_protocol.h"  // framed serial protocol, see serial_protocol.py on the PC
 
 // Pin Definitions
 #define TRIGGER_PIN 2
@@ -34,7 +35,8 @@ unsigned long lastBeepTime = 0;
 
 // Distance Sensor Variables
 unsigned long lastDistanceSendTime = 0;
-#define DISTANCE_SEND_INTERVAL 200
+#define DISTANCE_SEND_INTERVAL 50
+#define SERIAL_BAUD 115200 // must match SERIAL_BAUD on the PC
 
 Servo barrierServo;
 bool isGateOpen = false;
@@ -48,11 +50,12 @@ void closeGateAction();
 void handleAlerts();
 float getDistanceCm();
 void sendDistanceData();
+void sendGateStatus();
 // --- End Function Prototypes ---
 
 void setup()
 {
-  Serial.begin(9600);
+  Serial.begin(SERIAL_BAUD);
   pinMode(TRIGGER_PIN, OUTPUT);
   pinMode(ECHO_PIN, INPUT);
   pinMode(RED_LED_PIN, OUTPUT);
@@ -63,8 +66,10 @@ void setup()
   closeGateAction();             // Ensure gate is closed and lights are set correctly at startup
   digitalWrite(BUZZER_PIN, LOW); // Ensure buzzer is off at startup
 
-  Serial.println("MSG:Gate Controller Ready.");
-  Serial.println("MSG:Commands: '0'-Close, '1'-Open, '2'-PaymentAlert, '3'-TamperAlert, 'S'-StopAlert");
+  uint8_t device = PMS_DEVICE_GATE;
+  pmsSend(PMS_HELLO, &device, 1);
+  pmsSendMessage("Gate Controller Ready.");
+  sendGateStatus();
 }
 
 void loop()
@@ -76,11 +81,13 @@ void loop()
 
 void handleSerialCommands()
 {
-  if (Serial.available() > 0)
+  PmsFrame frame;
+  while (pmsPoll(frame))
   {
-    char cmd = Serial.read();
-    Serial.print("MSG:Received command: ");
-    Serial.println(cmd);
+    if (frame.type != PMS_COMMAND || frame.length != 1)
+      continue;
+    char cmd = (char)frame.payload[0];
+    uint8_t ack[2] = {frame.seq, 0};
 
     switch (cmd)
     {
@@ -113,9 +120,11 @@ void handleSerialCommands()
       }
       break;
     default:
-      Serial.println("MSG:Unknown command.");
+      ack[1] = 1; // unknown command
       break;
     }
+    pmsSend(PMS_ACK, ack, 2);
+    sendGateStatus();
   }
 }
 
@@ -128,12 +137,9 @@ void openGateAction()
   {
     digitalWrite(BLUE_LED_PIN, HIGH);
     digitalWrite(RED_LED_PIN, LOW);
-    tone(BUZZER_PIN, 3000); // Try 3000 Hz
-    delay(1000);
-    noTone(BUZZER_PIN);
-    delay(1000);
+    tone(BUZZER_PIN, 3000, 1000); // 1 s beep without blocking, so distance frames keep flowing
   }
-  Serial.println("MSG:Gate Opened");
+  pmsSendMessage("Gate Opened");
 }
 
 void closeGateAction()
@@ -145,13 +151,9 @@ void closeGateAction()
   {
     digitalWrite(RED_LED_PIN, HIGH);
     digitalWrite(BLUE_LED_PIN, LOW);
-    tone(BUZZER_PIN, 3000); // Try 3000 Hz
-    delay(1000);
-    noTone(BUZZER_PIN);
-    delay(1000);
+    tone(BUZZER_PIN, 3000, 1000); // 1 s beep without blocking, so distance frames keep flowing
   }
-  
-  Serial.println("MSG:Gate Closed");
+  pmsSendMessage("Gate Closed");
 }
 
 // Function to start an alert
@@ -168,11 +170,10 @@ void startAlert(AlertType type)
   digitalWrite(RED_LED_PIN, LOW);
   digitalWrite(BLUE_LED_PIN, LOW);
 
-  Serial.print("MSG:ALERT STARTED: ");
   if (type == PAYMENT_PENDING)
-    Serial.println("Payment Pending");
+    pmsSendMessage("ALERT STARTED: Payment Pending");
   if (type == TAMPERING)
-    Serial.println("Tampering Detected");
+    pmsSendMessage("ALERT STARTED: Tampering Detected");
 }
 
 void stopAlertAction()
@@ -192,7 +193,7 @@ void stopAlertAction()
       digitalWrite(RED_LED_PIN, HIGH);
       digitalWrite(BLUE_LED_PIN, LOW);
     }
-    Serial.println("MSG:Alert Stopped.");
+    pmsSendMessage("Alert Stopped.");
   }
 }
 
@@ -277,7 +278,20 @@ void sendDistanceData()
   {
     lastDistanceSendTime = millis();
     float distance = getDistanceCm();
-    Serial.print("DIST:");
-    Serial.println(distance, 2); // Print distance with 2 decimal places
+    unsigned long now = millis();
+    uint16_t distanceMm = distance >= 999.0 ? PMS_NO_ECHO : (uint16_t)(distance * 10.0 + 0.5);
+    uint8_t payload[6];
+    memcpy(payload, &now, 4);
+    memcpy(payload + 4, &distanceMm, 2);
+    pmsSend(PMS_DISTANCE, payload, 6);
   }
 }
+
+void sendGateStatus()
+{
+  uint8_t alert = currentAlert == PAYMENT_PENDING ? PMS_ALERT_PAYMENT
+                  : currentAlert == TAMPERING     ? PMS_ALERT_TAMPERING
+                                                  : PMS_ALERT_NONE;
+  uint8_t payload[2] = {isGateOpen ? 1 : 0, alert};
+  pmsSend(PMS_GATE_STATUS, payload, 2);
+}
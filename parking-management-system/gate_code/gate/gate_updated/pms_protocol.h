@@ -0,0 +1,128 @@
+// Framed serial protocol shared with the PC (serial_protocol.py).
+// Keep this file identical in every sketch folder that uses it.
+//
+//   A5 5A | version | type | seq | length | payload | CRC-16 (LE)
+//
+// The CRC is CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) over
+// version..payload. Multi-byte payload fields are little-endian, which is
+// the AVR's native order, so they are copied with memcpy.
+#ifndef PMS_PROTOCOL_H
+#define PMS_PROTOCOL_H
+
+#include <Arduino.h>
+
+#define PMS_SYNC1 0xA5
+#define PMS_SYNC2 0x5A
+#define PMS_VERSION 1
+#define PMS_MAX_PAYLOAD 48
+
+// Board -> PC
+#define PMS_HELLO 0x01        // uint8 device kind
+#define PMS_DISTANCE 0x02     // uint32 millis, uint16 distance in mm (PMS_NO_ECHO if none)
+#define PMS_GATE_STATUS 0x03  // uint8 gate open, uint8 alert
+#define PMS_ACK 0x04          // uint8 command seq, uint8 status (0 done, 1 unknown)
+#define PMS_MESSAGE 0x05      // text
+#define PMS_CARD 0x10         // uint8 plate length, plate, int32 balance
+#define PMS_READY 0x11
+#define PMS_DONE 0x12         // int32 balance written
+#define PMS_TIMEOUT 0x13
+// PC -> board
+#define PMS_COMMAND 0x20      // one command character
+#define PMS_REPLY 0x21        // uint8 code ('I', 'A', 'N', 'B'), int32 balance
+
+#define PMS_DEVICE_GATE 1
+#define PMS_DEVICE_PAYMENT 2
+#define PMS_ALERT_NONE 0
+#define PMS_ALERT_PAYMENT 1
+#define PMS_ALERT_TAMPERING 2
+#define PMS_NO_ECHO 0xFFFF
+
+struct PmsFrame {
+  uint8_t type;
+  uint8_t seq;
+  uint8_t length;
+  uint8_t payload[PMS_MAX_PAYLOAD];
+};
+
+static uint8_t pmsTxSeq = 0;
+
+static uint16_t pmsCrcUpdate(uint16_t crc, uint8_t data) {
+  crc ^= (uint16_t)data << 8;
+  for (uint8_t i = 0; i < 8; i++) {
+    crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+  }
+  return crc;
+}
+
+// Sends one frame and returns its sequence number.
+static uint8_t pmsSend(uint8_t type, const uint8_t *payload, uint8_t length) {
+  uint8_t header[4] = {PMS_VERSION, type, ++pmsTxSeq, length};
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < 4; i++) crc = pmsCrcUpdate(crc, header[i]);
+  for (uint8_t i = 0; i < length; i++) crc = pmsCrcUpdate(crc, payload[i]);
+  Serial.write(PMS_SYNC1);
+  Serial.write(PMS_SYNC2);
+  Serial.write(header, 4);
+  if (length) Serial.write(payload, length);
+  Serial.write((uint8_t)(crc & 0xFF));
+  Serial.write((uint8_t)(crc >> 8));
+  return header[2];
+}
+
+static void pmsSendMessage(const char *text) {
+  size_t length = strlen(text);
+  pmsSend(PMS_MESSAGE, (const uint8_t *)text, length > PMS_MAX_PAYLOAD ? PMS_MAX_PAYLOAD : length);
+}
+
+// Reads whatever is in the serial buffer without blocking. Returns true once
+// `frame` holds a complete frame with a good CRC; bad frames are dropped and
+// the parser waits for the next A5 5A.
+static bool pmsPoll(PmsFrame &frame) {
+  static uint8_t state = 0;
+  static uint8_t header[4];
+  static uint8_t received = 0;
+  static uint16_t crc = 0xFFFF;
+  static uint8_t crcLow = 0;
+
+  while (Serial.available()) {
+    uint8_t b = Serial.read();
+    switch (state) {
+      case 0:  // first sync byte
+        if (b == PMS_SYNC1) state = 1;
+        break;
+      case 1:  // second sync byte
+        state = (b == PMS_SYNC2) ? 2 : (b == PMS_SYNC1 ? 1 : 0);
+        received = 0;
+        crc = 0xFFFF;
+        break;
+      case 2:  // version, type, seq, length
+        header[received++] = b;
+        crc = pmsCrcUpdate(crc, b);
+        if (received == 4) {
+          if (header[0] != PMS_VERSION || header[3] > PMS_MAX_PAYLOAD) { state = 0; break; }
+          frame.type = header[1];
+          frame.seq = header[2];
+          frame.length = header[3];
+          received = 0;
+          state = frame.length ? 3 : 4;
+        }
+        break;
+      case 3:  // payload
+        frame.payload[received++] = b;
+        crc = pmsCrcUpdate(crc, b);
+        if (received == frame.length) state = 4;
+        break;
+      case 4:  // CRC low byte
+        crcLow = b;
+        state = 5;
+        break;
+      case 5:  // CRC high byte
+        state = 0;
+        if ((uint16_t)(crcLow | ((uint16_t)b << 8)) == crc) return true;
+        break;
+    }
+  }
+  return false;
+}
+
+#endif
@@ -0,0 +1,175 @@
+"""
+Parallel startup for the entry and exit gate processes.
+
+Loading the YOLO weights, opening the Arduino serial port (the board resets
+when the port opens and needs ARDUINO_RESET_DELAY seconds before it accepts
+commands), opening the webcam and loading the OCR engine are independent of
+each other, so they run on worker threads instead of one after another.
+ultralytics/torch are only imported inside the model loader.
+
+With MODEL_HOT_SWAP on, the model is wrapped in a HotSwapModel (see
+model_swap.py): its self-test on the reference images runs during startup,
+alongside the serial reset, and new weights dropped into MODEL_DIR are
+swapped in later without restarting the lane.
+
+Once everything is up the gate logs a timing breakdown and writes
+<READY_DIR>/<lane>.ready (JSON with the timings) so a supervisor can tell
+the lane is accepting cars. The file is removed again on shutdown. In
+headless mode, Ctrl+C and SIGTERM set GateResources.stop so the loop can
+shut down cleanly.
+"""
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from event_log import get_logger, setup_logging
+
+log = get_logger('gate_startup')
+
+
+class GateResources:
+    """Everything a gate loop needs, plus how long each piece took to start."""
+
+    def __init__(self, lane):
+        self.lane = lane
+        self.model = None
+        self.arduino = None
+        self.cap = None
+        self.ocr = None
+        self.timings = {}
+        self.ready_file = None
+        self.stop = threading.Event()  # set by Ctrl+C / SIGTERM in headless mode; the loop exits cleanly
+
+
+def load_model(weights_path=config.MODEL_PATH):
+    """Imports ultralytics on first use and loads the detector weights."""
+    from ultralytics import YOLO
+    return YOLO(weights_path)
+
+
+def warm_up_model(model, image_size=config.WARMUP_IMAGE_SIZE):
+    """Runs one inference on a blank frame so the first real car does not pay for lazy init."""
+    import numpy as np
+    model(np.zeros((image_size, image_size, 3), dtype=np.uint8), verbose=False)
+
+
+def load_ocr(engine=config.OCR_ENGINE):
+    """Loads the configured OCR engine (see plate_ocr.py)."""
+    from plate_ocr import open_reader
+    return open_reader(engine)
+
+
+def open_arduino(port_detector, baud=config.SERIAL_BAUD, reset_delay=config.ARDUINO_RESET_DELAY):
+    """
+    Opens the Arduino found by `port_detector`, waits out its reset and returns
+    it as a GateLink (see serial_protocol.py). Returns None if unavailable.
+    """
+    import serial
+    from serial_protocol import GateLink
+    port = port_detector()
+    if not port:
+        log.error('SERIAL', "Arduino serial port not detected. Check connections and port name.")
+        return None
+    try:
+        arduino = serial.Serial(port, baud, timeout=1)
+    except serial.SerialException as e:
+        log.error('SERIAL', f"Could not open serial port {port}: {e}", port=port)
+        return None
+    time.sleep(reset_delay)
+    log.info('CONNECTED', f"Arduino on {port} ({config.SERIAL_PROTOCOL} protocol, {baud} baud)", port=port)
+    return GateLink(arduino)
+
+
+def open_camera(index=config.CAMERA_INDEX):
+    """Opens the webcam and grabs one frame so the driver is fully initialised."""
+    import cv2
+    cap = cv2.VideoCapture(index)
+    if not cap.isOpened():
+        log.error('CAMERA', f"Could not open camera {index}.")
+        return cap
+    cap.read()
+    return cap
+
+
+def _timed(timings, name, func, *args):
+    start = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def _load_and_warm_up(timings, lane):
+    model = _timed(timings, 'model', load_model)
+    _timed(timings, 'warmup', warm_up_model, model)
+    if not config.MODEL_HOT_SWAP:
+        return model
+    from model_swap import HotSwapModel
+    model = HotSwapModel(model, config.MODEL_PATH, lane)
+    # The baseline new weights are compared with; it must run before the gate loop uses the model
+    result = _timed(timings, 'selftest', model.test_active)
+    if result:
+        log.info('MODEL', f"{lane} {model.active.name}: plates on {result['detection_rate']:.0%} of "
+                 f"{result['images']} reference images.", **result)
+    model.start()
+    return model
+
+
+def write_ready_file(lane, timings, ready_dir=config.READY_DIR):
+    """Writes the readiness marker for `lane` and returns its path."""
+    os.makedirs(ready_dir, exist_ok=True)
+    path = os.path.join(ready_dir, f"{lane.lower()}.ready")
+    with open(path, 'w') as f:
+        json.dump({'lane': lane, 'pid': os.getpid(), 'ready_at': time.time(),
+                   'timings': {k: round(v, 3) for k, v in timings.items()}}, f)
+    return path
+
+
+def start_gate(lane, port_detector):
+    """
+    Brings up the model, serial link, camera and OCR for `lane` in parallel.
+    Returns a GateResources once all of them are ready.
+    """
+    setup_logging(lane.lower())
+    gate = GateResources(lane)
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=4, thread_name_prefix=f"{lane.lower()}-startup") as pool:
+        model_future = pool.submit(_load_and_warm_up, gate.timings, lane)
+        arduino_future = pool.submit(_timed, gate.timings, 'serial', open_arduino, port_detector)
+        cap_future = pool.submit(_timed, gate.timings, 'camera', open_camera)
+        ocr_future = pool.submit(_timed, gate.timings, 'ocr', load_ocr)
+
+        gate.arduino = arduino_future.result()
+        gate.cap = cap_future.result()
+        gate.ocr = ocr_future.result()
+        gate.model = model_future.result()
+
+    gate.timings['total'] = time.perf_counter() - start
+    breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in gate.timings.items() if name != 'total')
+    log.info('STARTUP', f"{lane} ready in {gate.timings['total']:.2f}s ({breakdown})",
+             **{name: round(seconds, 3) for name, seconds in gate.timings.items()})
+    gate.ready_file = write_ready_file(lane, gate.timings)
+    if config.HEADLESS:
+        # Without a window there is no 'q' key: stop on Ctrl+C or a service manager's SIGTERM instead
+        for signum in (signal.SIGINT, getattr(signal, 'SIGTERM', None)):
+            if signum is not None:
+                signal.signal(signum, lambda *_: gate.stop.set())
+    return gate
+
+
+def stop_gate(gate):
+    """Releases the camera and serial port and clears the readiness marker."""
+    if hasattr(gate.model, 'stop'):
+        gate.model.stop()  # HotSwapModel's watcher
+    if gate.ready_file and os.path.exists(gate.ready_file):
+        os.remove(gate.ready_file)
+    if gate.cap is not None:
+        gate.cap.release()
+    if gate.arduino:
+        gate.arduino.close()
+        log.info('SERIAL', "Arduino serial connection closed.")
@@ -0,0 +1,265 @@
+"""
+Detector weights that can be replaced while a gate keeps running.
+
+HotSwapModel stands in for the YOLO model in the gate loops and is called
+exactly like one. A background thread looks at MODEL_DIR every
+MODEL_WATCH_INTERVAL seconds; a *.pt file that appears or changes there
+after the gate started (and has stopped changing, so a half-copied file is
+never read) is loaded, warmed up and self-tested on MODEL_REFERENCE_IMAGES
+images of MODEL_REFERENCE_DIR, all on that thread. It passes if it finds a
+plate on at least MODEL_MIN_DETECTION_RATE of them, and at most
+MODEL_MAX_DETECTION_DROP less often than the weights in use did in their
+self-test at startup.
+
+Passed weights are swapped in by the gate thread itself at the start of
+its next detector call, so a frame is always detected by one model from
+start to finish and no lock is needed. The old weights stay loaded for
+MODEL_PROBATION_FRAMES frames; then the new ones' live median inference
+time and detection rate (share of frames with a plate, detection only runs
+while a car is at the gate) are compared with the old ones' last frames.
+More than MODEL_MAX_SLOWDOWN slower, or more than MODEL_MAX_DETECTION_DROP
+fewer detections, rolls back to the old weights between two frames; that
+file version is not tried again. Rejected and rolled-back weights are
+logged with the reason, so a failed update shows in the lane's event log.
+
+Copy new weights into MODEL_DIR under a new name (best4.pt) or over the
+old one; either is picked up. Latency is only judged live: a self-test
+running next to the gate loop shares the CPU with it and would be slower
+for reasons that have nothing to do with the weights.
+"""
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+import config
+from event_log import get_logger
+
+log = get_logger('model_swap')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def load_reference_images(reference_dir=config.MODEL_REFERENCE_DIR, count=config.MODEL_REFERENCE_IMAGES):
+    """Up to `count` images spread evenly over `reference_dir` (name order), decoded once."""
+    import cv2
+    if not os.path.isdir(reference_dir):
+        return []
+    names = sorted(name for name in os.listdir(reference_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+    if len(names) > count:
+        names = [names[i * len(names) // count] for i in range(count)]
+    images = (cv2.imread(os.path.join(reference_dir, name)) for name in names)
+    return [image for image in images if image is not None]
+
+
+def self_test(model, images):
+    """Runs `model` on `images`; returns {'images', 'detection_rate', 'latency' (median s)}."""
+    from plate_reader import detect_plates
+    latencies, found = [], 0
+    for image in images:
+        start = time.perf_counter()
+        # No letterbox: its canvas is shared with the gate loop, which may be detecting right now
+        _, boxes = detect_plates(model, image, letterbox=False)
+        latencies.append(time.perf_counter() - start)
+        found += bool(boxes)
+    return {'images': len(images), 'detection_rate': found / len(images) if images else 0.0,
+            'latency': statistics.median(latencies) if latencies else 0.0}
+
+
+def regression(candidate, baseline, max_slowdown=config.MODEL_MAX_SLOWDOWN,
+               max_drop=config.MODEL_MAX_DETECTION_DROP):
+    """Why `candidate` metrics are worse than `baseline` ({'latency', 'detection_rate'}), or None."""
+    if 'latency' in candidate and candidate['latency'] > baseline['latency'] * (1 + max_slowdown):
+        return f"median inference {candidate['latency'] * 1000:.0f} ms vs {baseline['latency'] * 1000:.0f} ms"
+    if candidate['detection_rate'] < baseline['detection_rate'] - max_drop:
+        return f"detection rate {candidate['detection_rate']:.0%} vs {baseline['detection_rate']:.0%}"
+    return None
+
+
+def _version(path):
+    """What identifies one version of a weights file: (path, mtime, size)."""
+    stat = os.stat(path)
+    return path, stat.st_mtime_ns, stat.st_size
+
+
+class _Weights:
+    """One loaded model, with its self-test result and its latest live frames."""
+
+    def __init__(self, model, version, selftest=None, frames=config.MODEL_PROBATION_FRAMES):
+        self.model = model
+        self.version = version
+        self.selftest = selftest
+        self.frames = deque(maxlen=frames)  # (inference s, found a plate) of the latest frames
+
+    @property
+    def name(self):
+        return os.path.basename(self.version[0])
+
+    def live(self):
+        """{'frames', 'latency', 'detection_rate'} over the latest frames."""
+        frames = list(self.frames)
+        return {'frames': len(frames), 'latency': statistics.median(f[0] for f in frames),
+                'detection_rate': sum(f[1] for f in frames) / len(frames)}
+
+
+class HotSwapModel:
+    """Callable stand-in for the detector that swaps in new weights between frames."""
+
+    def __init__(self, model, weights_path=config.MODEL_PATH, lane='', watch_dir=config.MODEL_DIR,
+                 interval=config.MODEL_WATCH_INTERVAL, probation=config.MODEL_PROBATION_FRAMES,
+                 min_detection_rate=config.MODEL_MIN_DETECTION_RATE):
+        self.lane = lane
+        self.watch_dir = watch_dir
+        self.interval = interval
+        self.probation = probation
+        self.min_detection_rate = min_detection_rate
+        version = _version(weights_path) if os.path.exists(weights_path) else (weights_path, 0, 0)
+        self.active = _Weights(model, version, frames=probation)
+        self.previous = None  # the weights before the last swap, until the new ones pass probation
+        self.staged = None  # passed the self-test; swapped in by the next call
+        self.rejected = set()  # file versions that failed, never tried again
+        self.references = None
+        self.swaps = self.rollbacks = 0
+        self._stop = threading.Event()
+
+    @property
+    def model(self):
+        return self.active.model
+
+    def __getattr__(self, name):
+        # Anything but calling (names, predictor, ...) goes to the weights in use
+        active = self.__dict__.get('active')
+        if active is None:
+            raise AttributeError(name)
+        return getattr(active.model, name)
+
+    # --- Gate thread ---
+    def __call__(self, image, *args, **kwargs):
+        if self.staged is not None:
+            self._swap_in()
+        weights = self.active
+        start = time.perf_counter()
+        results = weights.model(image, *args, **kwargs)
+        weights.frames.append((time.perf_counter() - start, any(len(result.boxes) for result in results)))
+        if self.previous is not None and len(weights.frames) >= self.probation:
+            self._end_probation()
+        return results
+
+    def _swap_in(self):
+        # The watcher stages nothing while weights are on probation, so there is no `previous` to lose
+        staged, self.staged = self.staged, None
+        self.previous, self.active = self.active, staged
+        self.swaps += 1
+        log.info('MODEL', f"{self.lane} switched to {staged.name} (was {self.previous.name}); "
+                 f"on probation for {self.probation} frames.", weights=staged.version[0],
+                 previous=self.previous.version[0])
+
+    def _end_probation(self):
+        new, old = self.active, self.previous
+        self.previous = None
+        if not new.frames or len(old.frames) < self.probation // 4:
+            log.info('MODEL', f"{self.lane} keeps {new.name} (too few frames on {old.name} to compare).",
+                     weights=new.version[0])
+            return
+        new_live, old_live = new.live(), old.live()
+        reason = regression(new_live, old_live)
+        if reason:
+            self.active = old
+            self.rejected.add(new.version)
+            self.rollbacks += 1
+            log.warning('MODEL', f"{self.lane} rolled back from {new.name} to {old.name}: {reason} "
+                        f"over {new_live['frames']} frames.", weights=new.version[0], restored=old.version[0],
+                        reason=reason)
+        else:
+            log.info('MODEL', f"{self.lane} keeps {new.name}: {new_live['latency'] * 1000:.0f} ms, "
+                     f"{new_live['detection_rate']:.0%} detections over {new_live['frames']} frames "
+                     f"(was {old_live['latency'] * 1000:.0f} ms, {old_live['detection_rate']:.0%}).",
+                     weights=new.version[0], **{f"new_{k}": round(v, 4) for k, v in new_live.items()},
+                     **{f"old_{k}": round(v, 4) for k, v in old_live.items()})
+
+    # --- Watcher thread ---
+    def test_active(self):
+        """Self-tests the weights in use, as the baseline for new ones. Call before the gate loop starts."""
+        self.references = load_reference_images()
+        if self.references:
+            self.active.selftest = self_test(self.active.model, self.references)
+        return self.active.selftest
+
+    def _files(self):
+        try:
+            names = [name for name in os.listdir(self.watch_dir) if name.endswith('.pt')]
+        except OSError:
+            return {}
+        versions = {}
+        for name in names:
+            try:
+                version = _version(os.path.join(self.watch_dir, name))
+                versions[version[0]] = version
+            except OSError:
+                pass
+        return versions
+
+    def _load(self, version):
+        """Loads, warms up and self-tests `version`; returns its _Weights, or None (rejected)."""
+        from gate_startup import load_model, warm_up_model
+        name = os.path.basename(version[0])
+        log.info('MODEL', f"{self.lane} loading new weights {name} in the background.", weights=version[0])
+        started = time.perf_counter()
+        try:
+            model = load_model(version[0])
+            warm_up_model(model)
+            if self.references is None:
+                self.references = load_reference_images()
+            if not self.references:
+                raise RuntimeError(f"no reference images in {config.MODEL_REFERENCE_DIR} to self-test on")
+            result = self_test(model, self.references)
+        except Exception as e:
+            self.rejected.add(version)
+            log.error('MODEL', f"{self.lane} rejected {name}: {e}", weights=version[0])
+            return None
+
+        reason = None
+        if result['detection_rate'] < self.min_detection_rate:
+            reason = f"found plates on {result['detection_rate']:.0%} of the reference images"
+        elif self.active.selftest:
+            reason = regression({'detection_rate': result['detection_rate']}, self.active.selftest)
+        if reason:
+            self.rejected.add(version)
+            log.warning('MODEL', f"{self.lane} rejected {name}: self-test {reason}.", weights=version[0],
+                        reason=reason, **result)
+            return None
+        log.info('MODEL', f"{self.lane} {name} passed its self-test in {time.perf_counter() - started:.1f}s "
+                 f"({result['detection_rate']:.0%} of {result['images']} reference images); swapping in.",
+                 weights=version[0], **result)
+        return _Weights(model, version, result, self.probation)
+
+    def _watch(self):
+        known = self._files()  # what is there at startup is not new
+        seen = {}
+        while not self._stop.wait(self.interval):
+            files = self._files()
+            for path, version in files.items():
+                if version == known.get(path) or version in self.rejected:
+                    continue
+                if seen.get(path) != version:
+                    seen[path] = version  # changed since the last look: may still be copying
+                    continue
+                if self.staged is not None or self.previous is not None:
+                    break  # one swap at a time; tried again once the current one is settled
+                weights = self._load(version)
+                known[path] = version
+                if weights is not None:
+                    self.staged = weights
+                break
+
+    def start(self):
+        """Watches watch_dir in the background. Returns False if it does not exist."""
+        if not os.path.isdir(self.watch_dir):
+            log.warning('MODEL', f"Model directory {self.watch_dir} not found; weights will not be hot-swapped.")
+            return False
+        threading.Thread(target=self._watch, name=f"{self.lane.lower()}-model-swap", daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stop.set()
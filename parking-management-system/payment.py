@@ -1,19 +1,35 @@
-import csv
 import serial
 import time
 import serial.tools.list_ports
 import platform
 from datetime import datetime
 import re # Import regex for more robust cleaning
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-CSV_FILE = 'testdb.csv'
-RATE_PER_MINUTE = 8.33  # Amount charged per minute
+import config
+from event_log import get_logger, setup_logging
+from event_bus import PaymentCompleted, open_bus
+from plate_match import PlateIndex
+from serial_protocol import PaymentLink
+from storage import open_store, TIME_FORMAT
+from tariff import load_tariff, format_money, to_card_units
+
+log = get_logger('payment')
+
+# Parking sessions (CSV or SQLite, see config.py), shared with the gate processes
+store = open_store()
+TARIFF = load_tariff()  # Time-of-day rates, grace period and daily cap (see tariff.py)
+# Tells the exit lane and the dashboard about paid cars straight away (see event_bus.py)
+bus = open_bus('payment')
+# Parked plates, for card plates that match no session exactly (see plate_match.py)
+plate_index = PlateIndex(store) if config.FUZZY_MATCHING else None
 
 
 def detect_arduino_port():
     ports = list(serial.tools.list_ports.comports())
     system = platform.system()
-    print(system)
+    log.debug('SERIAL', f"Looking for the reader on {system}")
     for port in ports:
         if system == "Linux":
             if "ttyUSB" in port.device or "ttyACM" in port.device:
@@ -33,208 +49,291 @@ def parse_arduino_data(line):
         cleaned_line = line.replace('\x00', '').strip()
         
         parts = cleaned_line.split(',')
-        print(f"[ARDUINO] Parsed parts (cleaned): {parts}") # Updated print
+        log.debug('ARDUINO', f"Parsed parts (cleaned): {parts}")
 
         if len(parts) != 2:
-            print(f"[ERROR] Invalid number of parts ({len(parts)}) after cleaning: '{cleaned_line}'")
+            log.error('ARDUINO', f"Invalid number of parts ({len(parts)}) after cleaning: '{cleaned_line}'")
             return None, None
 
         # Clean plate: remove any non-alphanumeric or non-dash/space characters, then strip whitespace
         # This regex keeps letters, numbers, and common plate characters. Adjust if your plates have other symbols.
         plate = re.sub(r'[^a-zA-Z0-9- ]', '', parts[0]).strip()
-        print(f"[ARDUINO] Cleaned plate: '{plate}'") # Added print for cleaned plate
+        log.debug('ARDUINO', f"Cleaned plate: '{plate}'")
 
         # Clean the balance string by removing non-digit characters and then stripping
         balance_str = ''.join(c for c in parts[1] if c.isdigit()).strip()
-        print(f"[ARDUINO] Cleaned balance: '{balance_str}'") # Updated print
+        log.debug('ARDUINO', f"Cleaned balance: '{balance_str}'")
 
         if balance_str:
             balance = int(balance_str)
             return plate, balance
         else:
-            print("[ERROR] Balance string is empty after cleaning.")
+            log.error('ARDUINO', "Balance string is empty after cleaning.")
             return None, None
     except ValueError as e:
-        print(f"[ERROR] Value error in parsing: {e}")
+        log.error('ARDUINO', f"Value error in parsing: {e}")
         return None, None
     except IndexError as e:
-        print(f"[ERROR] IndexError during parsing (likely missing comma): {e} - Line: '{line}'")
+        log.error('ARDUINO', f"IndexError during parsing (likely missing comma): {e} - Line: '{line}'")
         return None, None
 
 
-def process_payment(plate, balance, ser):
-    try:
-        with open(CSV_FILE, 'r') as f:
-            rows = list(csv.reader(f))
-
-        header = rows[0]
-        entries = rows[1:]
-
-        # --- Find the latest unpaid record for the plate ---
-        latest_unpaid_index = -1
-        # It's important to iterate backwards to find the *latest* entry if a car enters multiple times
-        for i in range(len(entries) - 1, -1, -1):
-            row = entries[i]
-            # Ensure row has enough columns and check if plate matches and status is '0'
-            if len(row) > 5 and row[3].strip() == plate and row[5].strip() == '0': # Added .strip() for robustness
-                latest_unpaid_index = i
-                break # Found the latest unpaid entry, stop searching
-
-        if latest_unpaid_index == -1:
-            print(f"[PAYMENT] Car '{plate}' not found with an outstanding payment or already paid.")
-            # Optionally, send a signal to Arduino that no payment is needed (e.g., 'A' for Already Paid)
-            # ser.write(b'A\n')
-            return # Exit the function, no payment needed or found
-
-        # Process the found latest unpaid record
-        row_to_update = entries[latest_unpaid_index]
-        entry_time_str = row_to_update[1]
-        entry_time = datetime.strptime(entry_time_str, '%Y-%m-%d %H:%M:%S')
-        exit_time = datetime.now()
-        minutes_spent = int((exit_time - entry_time).total_seconds() / 60) + 1
-        amount_due = minutes_spent * RATE_PER_MINUTE
-
-        row_to_update[2] = exit_time.strftime('%Y-%m-%d %H:%M:%S')
-        row_to_update[4] = str(amount_due)
-
-        if balance < amount_due:
-            print(f"[PAYMENT] Insufficient balance. Car: {plate}, Due: {amount_due}, Provided: {balance}")
-            ser.write(b'I\n') # Send 'I' for Insufficient
+# ===== Per-card payment state machine =====
+# CARD_READ -> PRICED -> READY -> BALANCE_SENT -> CONFIRMED
+#        \________\________\___________\______> ROLLED_BACK
+CARD_READ = 'CARD_READ'         # "plate,balance" received, fare lookup running on the prefetch thread
+PRICED = 'PRICED'               # fare known, waiting for the reader's READY
+READY = 'READY'                 # reader is ready for the new balance
+BALANCE_SENT = 'BALANCE_SENT'   # new balance written to the serial link, waiting for DONE
+CONFIRMED = 'CONFIRMED'         # card written, session marked paid
+ROLLED_BACK = 'ROLLED_BACK'     # nothing charged (no record, insufficient balance, timeout)
+
+
+def price_card(plate):
+    """
+    Looks up the latest unpaid session for `plate` and prices it as of now.
+    Returns (session, exit_time, due_minor), or (None, None, reply) where reply is
+    the code for the reader: 'A' (no outstanding payment) or 'N' (plate unknown).
+    """
+    session = store.latest_unpaid_session(plate)
+    if session is None and store.latest_session(plate) is None and plate_index:
+        # The entry gate may have stored a misread of the plate on the card
+        match = plate_index.resolve(plate)
+        if match and match.session.get('payment_status') == '0':
+            log.info('FUZZY', f"Card plate {plate} matched to parked car {match.plate} "
+                     f"(confidence {match.confidence:.2f}).", read=plate, plate=match.plate,
+                     confidence=round(match.confidence, 3))
+            session = store.latest_unpaid_session(match.plate)
+    if session is None:
+        return None, None, 'A' if store.latest_session(plate) else 'N'
+    entry_time = datetime.strptime(session['entry_time'], TIME_FORMAT)
+    exit_time = datetime.now()
+    return session, exit_time, TARIFF.fare(entry_time, exit_time) # Integer minor units, no float rounding noise
+
+
+class CardPayment:
+    """One card at the pay station, from its "plate,balance" line to CONFIRMED or ROLLED_BACK."""
+
+    def __init__(self, plate, balance, fare_future):
+        self.plate = plate
+        self.balance = balance
+        self.fare_future = fare_future
+        self.state = CARD_READ
+        self.marks = {CARD_READ: time.perf_counter()}
+        self.ready_seen = False
+        self.session = None
+        self.updates = {}
+        self.exit_time = None
+        self.amount_due = None
+        self.new_balance = None
+        self.reason = ''
+
+    def advance(self, state, reason=''):
+        self.state = state
+        self.marks[state] = time.perf_counter()
+        self.reason = reason or self.reason
+
+    def waited(self, state):
+        """Seconds since the card entered `state`."""
+        return time.perf_counter() - self.marks[state]
+
+    @property
+    def finished(self):
+        return self.state in (CONFIRMED, ROLLED_BACK)
+
+    @property
+    def elapsed(self):
+        return self.marks[self.state] - self.marks[CARD_READ]
+
+
+class PaymentStation:
+    """
+    Non-blocking payment loop. Serial lines are read as they arrive and routed to
+    the card they belong to, the fare lookup starts the moment "plate,balance"
+    is received, and READY/DONE waits are timeouts checked on every poll instead
+    of busy loops, so the next card is never held up by the previous one's reads.
+    """
+
+    def __init__(self, link, ready_timeout=config.PAYMENT_READY_TIMEOUT, done_timeout=config.PAYMENT_DONE_TIMEOUT):
+        self.link = link  # PaymentLink: the reader's frames (or text lines) as lines, see serial_protocol.py
+        self.ready_timeout = ready_timeout
+        self.done_timeout = done_timeout
+        self.cards = []
+        self.prefetch = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fare-prefetch')
+        self.outcomes = Counter()
+        self.worst_case = 0.0
+
+    # --- Serial input ---
+    def read_lines(self):
+        """Returns the complete lines received since the last call, without blocking on partial ones."""
+        return self.link.read_lines()
+
+    def _oldest(self, *states):
+        return next((card for card in self.cards if card.state in states), None)
+
+    def handle_line(self, line):
+        log.debug('SERIAL', f"Received: {line}")
+        # Check if the line is empty after stripping (e.g., if only null bytes were sent)
+        if not line:
+            log.debug('SERIAL', "Received empty line after cleaning. Skipping.")
             return
+
+        if line == "READY":
+            card = next((c for c in self.cards if c.state in (CARD_READ, PRICED) and not c.ready_seen), None)
+            if card:
+                card.ready_seen = True
+        elif "DONE" in line:
+            card = self._oldest(BALANCE_SENT)
+            if card:
+                log.debug('ARDUINO', "Write confirmed")
+                self.confirm(card)
+        elif line.startswith("[TIMEOUT]"):
+            card = self._oldest(CARD_READ, PRICED, READY, BALANCE_SENT)
+            if card:
+                self.roll_back(card, "Reader timed out waiting for the PC")
+        elif line.startswith("[") or line.startswith("="):
+            pass # Reader diagnostics ([WRITING], [UPDATED], ...)
         else:
-            new_balance = balance - amount_due
-            row_to_update[5] = '1' # Mark as paid
-
-            # Wait for Arduino to send "READY"
-            print("[WAIT] Waiting for Arduino to be READY...")
-            start_time = time.time()
-            while True:
-                if ser.in_waiting:
-                    arduino_response = ser.readline().decode('utf-8', errors='ignore').strip() # Added error handling
-                    print(f"[ARDUINO] {arduino_response}")
-                    if arduino_response == "READY":
-                        break
-                if time.time() - start_time > 5:
-                    print("[ERROR] Timeout waiting for Arduino READY")
-                    # Consider reverting payment status if communication fails here, or handling failure
-                    row_to_update[5] = '0' # Revert to unpaid if communication fails
-                    return
-
-            # Send new balance
-            ser.write(f"{new_balance}\r\n".encode())
-            print(f"[PAYMENT] Sent new balance {new_balance}")
-
-            # Wait for confirmation with timeout
-            start_time = time.time()
-            print("[WAIT] Waiting for Arduino confirmation...")
-            while True:
-                if ser.in_waiting:
-                    confirm = ser.readline().decode('utf-8', errors='ignore').strip() # Added error handling
-                    print(f"[ARDUINO] {confirm}")
-                    if "DONE" in confirm:
-                        print("[ARDUINO] Write confirmed")
-                        break # Confirmation received
-
-                # Add timeout condition
-                if time.time() - start_time > 10:
-                    print("[ERROR] Timeout waiting for confirmation from Arduino.")
-                    # IMPORTANT: If confirmation not received, it's safer to revert payment status
-                    # This ensures the car remains 'unpaid' in the DB if the Arduino didn't confirm the write.
-                    row_to_update[5] = '0'
-                    break # Break loop but payment status remains unpaid
-
-                # Small delay to avoid CPU spinning
-                time.sleep(0.05) # Slightly reduced delay for faster response
-
-        # Write the updated entries back to the CSV
-        with open(CSV_FILE, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(header)
-            writer.writerows(entries)
-        print(f"[PAYMENT] Payment successful for {plate}. Amount due: {amount_due}, New balance: {new_balance}")
+            plate, balance = parse_arduino_data(line)
+            if plate and balance is not None:
+                self.cards.append(CardPayment(plate, balance, self.prefetch.submit(price_card, plate)))
+            else:
+                log.warning('PAYMENT', f"Skipping invalid data: '{line}'")
+
+    # --- State transitions ---
+    def step(self, card):
+        if card.state == CARD_READ and card.fare_future.done():
+            try:
+                session, exit_time, due = card.fare_future.result()
+            except Exception as e:
+                self.roll_back(card, f"Fare lookup failed: {e}")
+                return
+            if session is None:
+                log.info('PAYMENT', f"Car '{card.plate}' not found with an outstanding payment or already paid.",
+                         plate=card.plate, reply=due)
+                self.link.send(due) # 'A' already paid / 'N' not found, frees the reader at once
+                self.roll_back(card, "No outstanding payment")
+                return
+            card.session = session
+            card.exit_time = exit_time
+            card.amount_due = format_money(due)
+            card.updates = {'exit_time': exit_time.strftime(TIME_FORMAT), 'due_payment': card.amount_due}
+            if card.balance < to_card_units(due):
+                log.info('PAYMENT', f"Insufficient balance. Car: {card.plate}, Due: {card.amount_due}, Provided: {card.balance}",
+                         plate=card.plate, due=card.amount_due, balance=card.balance)
+                self.link.send('I') # Send 'I' for Insufficient
+                self.roll_back(card, "Insufficient balance")
+                return
+            card.new_balance = card.balance - to_card_units(due) # Cards hold whole francs
+            card.advance(PRICED)
+
+        if card.state in (CARD_READ, PRICED):
+            if card.state == PRICED and card.ready_seen:
+                card.advance(READY)
+            elif card.waited(CARD_READ) > self.ready_timeout:
+                log.error('PAYMENT', "Timeout waiting for Arduino READY", plate=card.plate)
+                # Nothing has been written yet, so the record simply stays unpaid
+                self.roll_back(card, "Timeout waiting for READY")
+                return
+
+        if card.state == READY:
+            self.link.send(card.new_balance)
+            log.debug('PAYMENT', f"Sent new balance {card.new_balance}", plate=card.plate)
+            card.advance(BALANCE_SENT)
+
+        if card.state == BALANCE_SENT and card.waited(BALANCE_SENT) > self.done_timeout:
+            log.error('PAYMENT', "Timeout waiting for confirmation from Arduino.", plate=card.plate)
+            # The card may or may not have been written: record the fare but keep the
+            # session unpaid so the car cannot leave on an unconfirmed payment.
+            store.update_session(card.session['no'], payment_status='0', **card.updates)
+            self.roll_back(card, "Timeout waiting for DONE")
+
+    def confirm(self, card):
+        # Write the updated record back; rows the gates appended meanwhile are kept
+        store.update_session(card.session['no'], payment_status='1', **card.updates)
+        # The session's plate, not the card's: they differ when the card was matched fuzzily,
+        # and the exit lane looks the car up by the plate it was stored under
+        plate = card.session['car_plate']
+        if bus:
+            bus.publish(PaymentCompleted(plate=plate, no=card.session['no'], amount=card.amount_due,
+                                         paid_at=card.exit_time.strftime(TIME_FORMAT),
+                                         expires=card.exit_time.timestamp() + config.EXIT_GRACE_MINUTES * 60,
+                                         card_plate=card.plate))
+        card.advance(CONFIRMED)
+        log.info('PAYMENT', f"Payment successful for {plate}. Amount due: {card.amount_due}, New balance: {card.new_balance}",
+                 plate=plate, card=card.plate, no=card.session['no'], due=card.amount_due, balance=card.new_balance)
+
+    def roll_back(self, card, reason):
+        card.advance(ROLLED_BACK, reason)
+
+    # --- Reporting ---
+    def report(self, card):
+        self.outcomes[card.state] += 1
+        self.worst_case = max(self.worst_case, card.elapsed)
+        stages = ", ".join(f"{state.lower()} +{card.marks[state] - card.marks[CARD_READ]:.2f}s"
+                           for state in (PRICED, READY, BALANCE_SENT) if state in card.marks)
+        reason = f" ({card.reason})" if card.reason else ""
+        log.info('PAYMENT', f"{card.plate} {card.state}{reason} in {card.elapsed:.2f}s [{stages}] "
+                 f"| worst case {self.worst_case:.2f}s over {sum(self.outcomes.values())} cards",
+                 plate=card.plate, state=card.state, reason=card.reason, seconds=round(card.elapsed, 3))
+
+    def summary(self):
+        counts = ", ".join(f"{state.lower()} {count}" for state, count in self.outcomes.items()) or "no cards"
+        return f"{counts}; worst case per card {self.worst_case:.2f}s"
+
+    def poll(self):
+        """Handles everything that arrived on the serial link and advances every open card."""
+        for line in self.read_lines():
+            self.handle_line(line)
+        for card in list(self.cards):
+            try:
+                self.step(card)
+            except Exception as e:
+                log.exception('PAYMENT', f"Payment processing failed: {e}", plate=card.plate)
+                self.roll_back(card, f"Error: {e}")
+            if card.finished:
+                self.cards.remove(card)
+                self.report(card)
 
-    except Exception as e:
-        print(f"[ERROR] Payment processing failed: {e}")
+    def close(self):
+        self.prefetch.shutdown(wait=False)
 
 
 def main():
+    setup_logging('payment')
     port = detect_arduino_port()
     if not port:
-        print("[ERROR] Arduino not found")
-        # Log to UI if this is a separate process or write to a status file
-        try:
-            with open('parking_system_log.txt', 'a') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - [PROCESS_PAYMENT] ERROR: Arduino not found.\n")
-        except Exception as log_e:
-            print(f"Error writing to log file: {log_e}")
+        log.error('PROCESS_PAYMENT', "Arduino not found")
         return
 
     try:
-        ser = serial.Serial(port, 9600, timeout=1)
-        print(f"[CONNECTED] Listening on {port}")
-        # Log connection status
-        try:
-            with open('parking_system_log.txt', 'a') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - [PROCESS_PAYMENT] CONNECTED to Arduino on {port}.\n")
-        except Exception as log_e:
-            print(f"Error writing to log file: {log_e}")
+        ser = serial.Serial(port, config.SERIAL_BAUD, timeout=1)
+        log.info('CONNECTED', f"Listening on {port} ({config.SERIAL_PROTOCOL} protocol, {config.SERIAL_BAUD} baud)",
+                 port=port)
 
         time.sleep(2)
 
         # Flush any previous data
         ser.reset_input_buffer()
 
+        station = PaymentStation(PaymentLink(ser))
         while True:
-            if ser.in_waiting:
-                # Use errors='ignore' here as well, as this is the first point of decoding
-                line = ser.readline().decode('utf-8', errors='ignore').strip()
-                print(f"[SERIAL] Received: {line}")
-                
-                # Check if the line is empty after stripping (e.g., if only null bytes were sent)
-                if not line:
-                    print("[SERIAL] Received empty line after cleaning. Skipping.")
-                    continue
-
-                plate, balance = parse_arduino_data(line)
-                if plate and balance is not None:
-                    process_payment(plate, balance, ser)
-                else:
-                    print(f"[PAYMENT] Skipping invalid data: '{line}'")
+            station.poll()
+            time.sleep(config.PAYMENT_POLL_INTERVAL) # Avoid spinning the CPU between serial reads
 
     except KeyboardInterrupt:
-        print("[EXIT] Program terminated by user")
-        # Log exit
-        try:
-            with open('parking_system_log.txt', 'a') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - [PROCESS_PAYMENT] Program terminated by user.\n")
-        except Exception as log_e:
-            print(f"Error writing to log file: {log_e}")
+        log.info('EXIT', "Program terminated by user")
     except serial.SerialException as e:
-        print(f"[ERROR] Serial communication error: {e}")
-        # Log serial error
-        try:
-            with open('parking_system_log.txt', 'a') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - [PROCESS_PAYMENT] SERIAL ERROR: {e}.\n")
-        except Exception as log_e:
-            print(f"Error writing to log file: {log_e}")
+        log.error('PROCESS_PAYMENT', f"Serial communication error: {e}")
     except Exception as e:
-        print(f"[ERROR] An unexpected error occurred: {e}")
-        # Log unexpected error
-        try:
-            with open('parking_system_log.txt', 'a') as f:
-                f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - [PROCESS_PAYMENT] UNEXPECTED ERROR: {e}.\n")
-        except Exception as log_e:
-            print(f"Error writing to log file: {log_e}")
+        log.exception('PROCESS_PAYMENT', f"An unexpected error occurred: {e}")
     finally:
+        if 'station' in locals():
+            station.close()
+            log.info('PAYMENT', f"Session summary: {station.summary()}", **station.outcomes)
         if 'ser' in locals() and ser.is_open:
             ser.close()
-            print("[DISCONNECTED] Serial port closed.")
-            # Log disconnection
-            try:
-                with open('parking_system_log.txt', 'a') as f:
-                    f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - [PROCESS_PAYMENT] Serial port closed.\n")
-            except Exception as log_e:
-                print(f"Error writing to log file: {log_e}")
+            log.info('DISCONNECTED', "Serial port closed.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
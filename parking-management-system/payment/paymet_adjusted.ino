@@ -1,8 +1,10 @@
 #include <SPI.h>
 #include <MFRC522.h>
+#include "pms_protocol.h"  // framed serial protocol, see serial_protocol.py on the PC
 
 #define RST_PIN 9
 #define SS_PIN 10
+#define SERIAL_BAUD 115200 // must match SERIAL_BAUD on the PC
 
 MFRC522 mfrc522(SS_PIN, RST_PIN);
 MFRC522::MIFARE_Key key;
@@ -18,7 +20,7 @@ unsigned long readySentTime = 0;
 const unsigned long RESPONSE_TIMEOUT = 10000; // 10 seconds
 
 void setup() { 
-    Serial.begin(9600);
+    Serial.begin(SERIAL_BAUD);
     SPI.begin();
     mfrc522.PCD_Init();
 
@@ -26,8 +28,9 @@ void setup() {
         key.keyByte[i] = 0xFF;
     }
 
-    Serial.println(F("==== PAYMENT MODE RFID ===="));
-    Serial.println(F("Place your card near the reader..."));
+    uint8_t device = PMS_DEVICE_PAYMENT;
+    pmsSend(PMS_HELLO, &device, 1);
+    pmsSendMessage("PAYMENT MODE RFID - place a card");
 }
 
 void loop() {
@@ -39,7 +42,7 @@ void loop() {
 
         // Validate data before proceeding
         if (currentPlate.startsWith("[") || balanceStr.startsWith("[")) {
-            Serial.println(F("⚠️ Invalid card data. Try again."));
+            pmsSendMessage("Invalid card data. Try again.");
             mfrc522.PICC_HaltA();
             mfrc522.PCD_StopCrypto1();
             delay(2000);
@@ -47,16 +50,14 @@ void loop() {
         }
 
         currentBalance = balanceStr.toInt();
-        Serial.print(currentPlate);
-        Serial.print(",");
-        Serial.println(balanceStr);
+        sendCard(currentPlate, currentBalance);
 
         awaitingUpdate = true;
         sentReady = false;
     }
 
     if (awaitingUpdate && !sentReady) {
-        Serial.println("READY");
+        pmsSend(PMS_READY, NULL, 0);
         sentReady = true;
         readySentTime = millis();  // Start the timeout
     }
@@ -64,7 +65,7 @@ void loop() {
     if (awaitingUpdate && sentReady) {
         // Timeout handling
         if (millis() - readySentTime > RESPONSE_TIMEOUT) {
-            Serial.println("[TIMEOUT] No response from PC. Resetting.");
+            pmsSend(PMS_TIMEOUT, NULL, 0);
             awaitingUpdate = false;
             sentReady = false;
             mfrc522.PICC_HaltA();
@@ -73,36 +74,23 @@ void loop() {
             return;
         }
 
-        if (Serial.available()) {
-            String response = Serial.readStringUntil('\n');
-            response.trim();
-
-            Serial.print("[RECEIVED FROM PC]: ");
-            Serial.println(response);
-
-            if (response == "I") {
-                Serial.println("[DENIED] Insufficient balance.");
-            } else if (response == "A") { // <-- NEW: Handle 'Already Paid' status
-                Serial.println("[INFO] Car found, but already paid or no outstanding payment.");
-            } else if (response == "N") { // <-- NEW: Handle 'Not Found' status
-                Serial.println("[INFO] Car number plate not found in database.");
-            } else { // This block is ONLY for a new numeric balance
-                Serial.print("[DEBUG] PC response assumed to be new balance: '");
-                Serial.print(response);
-                Serial.println("'");
-                
-                long newBalance = response.toInt(); // Convert only if it's not a status code
-
-                if (newBalance >= 0) { // Check if the conversion resulted in a valid number
-                    Serial.println("[WRITING] New balance to card...");
-                    writeBlockData(4, String(newBalance));
-                    Serial.println("DONE");
-                    Serial.print("[UPDATED] New Balance: ");
-                    Serial.println(newBalance);
-                } else {
-                    // This could happen if newBalance is negative or if toInt() fails unexpectedly
-                    Serial.println("[ERROR] Invalid numeric new balance received from PC.");
-                }
+        PmsFrame frame;
+        if (pmsPoll(frame) && frame.type == PMS_REPLY && frame.length == 5) {
+            char code = (char)frame.payload[0];
+            long newBalance;
+            memcpy(&newBalance, frame.payload + 1, 4);
+
+            if (code == 'I') {
+                pmsSendMessage("[DENIED] Insufficient balance.");
+            } else if (code == 'A') {
+                pmsSendMessage("[INFO] Already paid or nothing outstanding.");
+            } else if (code == 'N') {
+                pmsSendMessage("[INFO] Plate not found in database.");
+            } else if (code == 'B' && newBalance >= 0) {
+                writeBlockData(4, String(newBalance));
+                pmsSend(PMS_DONE, frame.payload + 1, 4);
+            } else {
+                pmsSendMessage("[ERROR] Invalid reply received from PC.");
             }
 
             awaitingUpdate = false;
@@ -116,21 +104,28 @@ void loop() {
     }
 }
 
+void sendCard(String plate, long balance) {
+    uint8_t payload[1 + 16 + 4];
+    uint8_t length = plate.length() > 16 ? 16 : plate.length();
+    payload[0] = length;
+    memcpy(payload + 1, plate.c_str(), length);
+    memcpy(payload + 1 + length, &balance, 4);
+    pmsSend(PMS_CARD, payload, 1 + length + 4);
+}
+
 String readBlockData(byte blockNumber, String label){
     byte buffer[18];
     byte bufferSize = sizeof(buffer);
 
     card_status = mfrc522.PCD_Authenticate(MFRC522::PICC_CMD_MF_AUTH_KEY_A, blockNumber, &key, &(mfrc522.uid));
     if (card_status != MFRC522::STATUS_OK) {
-        Serial.print("❌ Auth failed for ");
-        Serial.println(label);
+        pmsSendMessage((String("Auth failed for ") + label).c_str());
         return "[Auth Fail]";
     }
 
     card_status = mfrc522.MIFARE_Read(blockNumber, buffer, &bufferSize);
     if (card_status != MFRC522::STATUS_OK) {
-        Serial.print("❌ Read failed for ");
-        Serial.println(label);
+        pmsSendMessage((String("Read failed for ") + label).c_str());
         return "[Read Fail]";
     }
 
@@ -150,12 +145,12 @@ void writeBlockData(byte blockNumber, String data) {
 
     card_status = mfrc522.PCD_Authenticate(MFRC522::PICC_CMD_MF_AUTH_KEY_A, blockNumber, &key, &(mfrc522.uid));
     if (card_status != MFRC522::STATUS_OK) {
-        Serial.println("❌ Auth failed on write");
+        pmsSendMessage("Auth failed on write");
         return;
     }
 
     card_status = mfrc522.MIFARE_Write(blockNumber, buffer, 16);
     if (card_status != MFRC522::STATUS_OK) {
-        Serial.println("❌ Write failed");
+        pmsSendMessage("Write failed");
     }
 }
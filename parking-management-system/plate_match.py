@@ -0,0 +1,177 @@
+"""
+Fuzzy matching of plate reads against the cars currently in the car park.
+
+One misread character at the exit used to mean "No entry record found": an
+unauthorized attempt in the log, ten seconds of buzzer and a driver asked to
+try again. PlateIndex keeps the plates of the parked cars in a BK-tree and
+resolves a read that matches no session exactly to the parked plate it is
+closest to:
+
+- candidates are the plates within FUZZY_MAX_EDITS (Levenshtein) of the read,
+  found by the BK-tree without comparing against every parked plate;
+- they are ranked by an OCR-aware cost where typical confusions (0/O, 8/B,
+  5/S, ...) cost less than an arbitrary substitution;
+- the confidence is exp(-best cost), scaled down when a second candidate is
+  nearly as close. Only a match at or above FUZZY_MIN_CONFIDENCE is used.
+
+The index is rebuilt from the store (store.parked_sessions()) every
+FUZZY_REFRESH_INTERVAL seconds, and early when a read finds no candidate,
+so plates added by the entry gate show up without any coordination between
+the processes.
+"""
+import math
+import time
+from datetime import datetime, timedelta
+
+import config
+from storage import TIME_FORMAT
+
+# Pairs OCR typically mixes up on plates; substituting one for the other costs CONFUSION_COST
+OCR_CONFUSIONS = [('0', 'O'), ('0', 'D'), ('0', 'Q'), ('1', 'I'), ('1', 'L'), ('1', 'T'), ('2', 'Z'),
+                  ('4', 'A'), ('5', 'S'), ('6', 'G'), ('7', 'T'), ('8', 'B'), ('3', 'B'), ('D', 'O'),
+                  ('M', 'N'), ('U', 'V'), ('E', 'F'), ('C', 'G')]
+CONFUSION_COST = 0.3
+_MIN_REBUILD_GAP = 1.0  # s - a miss triggers an early rebuild at most this often
+_CONFUSABLE = {frozenset(pair) for pair in OCR_CONFUSIONS}
+
+
+def levenshtein(a, b):
+    """Plain edit distance (the BK-tree metric)."""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def ocr_cost(read, plate):
+    """Edit distance where OCR-typical substitutions cost CONFUSION_COST instead of 1."""
+    previous = [float(j) for j in range(len(plate) + 1)]
+    for i, ca in enumerate(read, 1):
+        current = [float(i)]
+        for j, cb in enumerate(plate, 1):
+            if ca == cb:
+                substitution = 0.0
+            elif frozenset((ca, cb)) in _CONFUSABLE:
+                substitution = CONFUSION_COST
+            else:
+                substitution = 1.0
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + substitution))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree over plates under Levenshtein distance."""
+
+    def __init__(self, words=()):
+        self.root = None  # (word, {distance: child})
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = levenshtein(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                self.size += 1
+                return
+            node = child
+
+    def search(self, word, max_distance):
+        """Returns [(distance, plate)] for every plate within `max_distance` of `word`."""
+        if self.root is None:
+            return []
+        found, stack = [], [self.root]
+        while stack:
+            node_word, children = stack.pop()
+            distance = levenshtein(word, node_word)
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            # Triangle inequality: only subtrees at distance d +- max_distance can hold matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return found
+
+
+class PlateMatch:
+    """A read resolved to a parked plate."""
+
+    def __init__(self, plate, session, cost, confidence):
+        self.plate = plate
+        self.session = session
+        self.cost = cost
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"PlateMatch({self.plate!r}, cost={self.cost:.2f}, confidence={self.confidence:.2f})"
+
+
+class PlateIndex:
+    """Parked plates of one store, rebuilt periodically, answering near-miss reads."""
+
+    def __init__(self, store, max_edits=config.FUZZY_MAX_EDITS, min_confidence=config.FUZZY_MIN_CONFIDENCE,
+                 refresh_interval=config.FUZZY_REFRESH_INTERVAL, grace_minutes=config.EXIT_GRACE_MINUTES):
+        self.store = store
+        self.max_edits = max_edits
+        self.min_confidence = min_confidence
+        self.refresh_interval = refresh_interval
+        self.grace_minutes = grace_minutes
+        self.tree = BKTree()
+        self.sessions = {}  # plate -> latest parked session
+        self.built_at = None
+
+    def refresh(self):
+        """Rebuilds the tree from the cars in the car park: unpaid, or paid within the exit grace period."""
+        paid_since = (datetime.now() - timedelta(minutes=self.grace_minutes)).strftime(TIME_FORMAT)
+        sessions = {}
+        for row in self.store.parked_sessions(paid_since):
+            plate = (row.get('car_plate') or '').strip()
+            if plate:
+                sessions[plate] = row  # rows come oldest first, so the latest session wins
+        self.sessions = sessions
+        self.tree = BKTree(sessions)
+        self.built_at = time.monotonic()
+
+    def _fresh(self):
+        if self.built_at is None or time.monotonic() - self.built_at >= self.refresh_interval:
+            self.refresh()
+
+    def candidates(self, read):
+        """Returns [(cost, plate)] for the parked plates within max_edits of `read`, cheapest first."""
+        self._fresh()
+        found = self.tree.search(read, self.max_edits)
+        if not found and time.monotonic() - self.built_at >= _MIN_REBUILD_GAP:
+            # The car may have entered since the last rebuild
+            self.refresh()
+            found = self.tree.search(read, self.max_edits)
+        return sorted((ocr_cost(read, plate), plate) for _, plate in found)
+
+    def resolve(self, read):
+        """
+        Returns the PlateMatch for the parked plate `read` most likely is, or None if
+        there is none close enough or the best one is not clearly ahead of the rest.
+        """
+        candidates = self.candidates(read)
+        if not candidates:
+            return None
+        best_cost, plate = candidates[0]
+        confidence = math.exp(-best_cost)
+        if len(candidates) > 1:
+            # Two parked plates almost equally close: the read cannot tell them apart
+            confidence *= 1.0 - math.exp(-(candidates[1][0] - best_cost))
+        if confidence < self.min_confidence:
+            return None
+        return PlateMatch(plate, self.sessions[plate], best_cost, confidence)
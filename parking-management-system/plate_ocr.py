@@ -0,0 +1,270 @@
+"""
+OCR backends for the binarized plate images preprocess_plate() produces.
+
+Both engines expose read(thresh) -> text and are picked with PMS_OCR_ENGINE:
+
+- 'tesseract': the tesseract executable via pytesseract (the original engine).
+  The executable is taken from PMS_TESSERACT_CMD, else from PATH, else from
+  the usual Windows install locations, so no machine path is hard-coded.
+- 'segment': an in-process recognizer built for the fixed 7-character
+  Rwandan layout (RA + letter, 3 digits, letter). It cuts the plate into
+  characters with connected components, normalises each to CHAR_SIZE and
+  classifies all seven in one batched call - a NumPy linear model (.npz) or
+  any ONNX model (.onnx, needs onnxruntime) - with every position limited
+  to the character class the layout allows there.
+
+The NumPy weights are trained with
+
+    python plate_ocr.py train --out brain/plate_chars.npz [--chars DIR]
+
+from glyphs rendered with OpenCV's fonts plus, optionally, real character
+crops in DIR/<character>/*.png. test_files/bench_ocr.py compares the
+engines for latency and accuracy.
+"""
+import argparse
+import os
+import shutil
+import string
+
+import cv2
+import numpy as np
+
+import config
+
+ALPHABET = string.ascii_uppercase + string.digits
+LAYOUT = 'LLLDDDL'  # L = letter, D = digit
+CHAR_SIZE = 24  # px - characters are normalised to CHAR_SIZE x CHAR_SIZE before classification
+# Where the Windows installer puts tesseract (per-user, then all users)
+_WINDOWS_TESSERACT = [os.path.expandvars(r'%LOCALAPPDATA%\Programs\Tesseract-OCR\tesseract.exe'),
+                      r'C:\Program Files\Tesseract-OCR\tesseract.exe']
+_TESSERACT_CONFIG = '--psm 8 --oem 3 -c tessedit_char_whitelist=' + ALPHABET
+
+_LETTERS = np.array([c in string.ascii_uppercase for c in ALPHABET])
+# Allowed classes per plate position, shape (7, len(ALPHABET))
+_POSITION_MASK = np.stack([_LETTERS if kind == 'L' else ~_LETTERS for kind in LAYOUT])
+
+
+def open_reader(engine=config.OCR_ENGINE):
+    """Returns the configured OCR engine: TesseractReader ('tesseract') or SegmentReader ('segment')."""
+    if engine == 'tesseract':
+        return TesseractReader()
+    if engine == 'segment':
+        return SegmentReader()
+    raise ValueError(f"Unknown OCR engine '{engine}' (expected 'tesseract' or 'segment')")
+
+
+class TesseractReader:
+    """Reads a whole plate with the tesseract executable."""
+
+    name = 'tesseract'
+
+    def __init__(self, tesseract_cmd=config.TESSERACT_CMD):
+        import pytesseract
+        cmd = tesseract_cmd or shutil.which('tesseract')
+        if not cmd:
+            cmd = next((path for path in _WINDOWS_TESSERACT if os.path.exists(path)), None)
+        if cmd:
+            pytesseract.pytesseract.tesseract_cmd = cmd
+        # Fails here, at startup, rather than on the first car if the executable is missing
+        self.version = pytesseract.get_tesseract_version()
+        self._tesseract = pytesseract
+
+    def read(self, thresh):
+        """Returns the plate text (spaces removed), possibly with extra characters around it."""
+        return self._tesseract.image_to_string(thresh, config=_TESSERACT_CONFIG).strip().replace(" ", "")
+
+
+# ===== Segmentation =====
+def segment_characters(thresh, count=len(LAYOUT)):
+    """
+    Cuts a binarized plate (dark characters on a light background) into `count`
+    characters. Returns a (count, CHAR_SIZE, CHAR_SIZE) float32 batch in reading
+    order, or None if the plate does not split into that many characters.
+    """
+    ink = cv2.bitwise_not(thresh) if np.mean(thresh) > 127 else thresh
+    h, w = ink.shape[:2]
+    n, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+
+    # Characters are tall blobs; borders, bolts, dirt and the flag are not
+    blobs = [(x, y, cw, ch) for x, y, cw, ch, area in stats[1:n]
+             if 0.35 * h <= ch <= 0.95 * h and cw <= 0.5 * w and area >= 0.1 * cw * ch]
+    if not blobs:
+        return None
+    # Neighbouring characters touching each other come out as one wide blob: split it evenly
+    char_width = np.median([cw for _, _, cw, ch in blobs if cw <= ch] or [h * 0.6])
+    candidates = []
+    for x, y, cw, ch in blobs:
+        pieces = max(1, int(round(cw / char_width)))
+        for i in range(pieces):
+            candidates.append((x + i * cw // pieces, y, cw // pieces, ch))
+    if len(candidates) < count:
+        return None
+    if len(candidates) > count:
+        # Keep the blobs whose height is closest to the typical character height
+        median = np.median([ch for _, _, _, ch in candidates])
+        candidates = sorted(candidates, key=lambda c: abs(c[3] - median))[:count]
+    candidates.sort()
+
+    batch = np.zeros((count, CHAR_SIZE, CHAR_SIZE), dtype=np.float32)
+    for i, (x, y, cw, ch) in enumerate(candidates):
+        batch[i] = normalize_char(ink[y:y + ch, x:x + cw])
+    return batch
+
+
+def normalize_char(glyph):
+    """Centres a white-on-black glyph in a square and scales it to CHAR_SIZE (values 0..1)."""
+    gh, gw = glyph.shape[:2]
+    side = max(gh, gw) + 4
+    square = np.zeros((side, side), dtype=np.uint8)
+    oy, ox = (side - gh) // 2, (side - gw) // 2
+    square[oy:oy + gh, ox:ox + gw] = glyph
+    return cv2.resize(square, (CHAR_SIZE, CHAR_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
+
+
+# ===== Classifiers =====
+class NumpyCharClassifier:
+    """Linear softmax classifier over flattened CHAR_SIZE x CHAR_SIZE glyphs."""
+
+    def __init__(self, weights, bias):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        if ''.join(data['classes'].tolist()) != ALPHABET:
+            raise ValueError(f"{path} was trained for a different character set")
+        return cls(data['weights'], data['bias'])
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, classes=np.array(list(ALPHABET)))
+
+    def logits(self, batch):
+        return batch.reshape(len(batch), -1) @ self.weights + self.bias
+
+
+class OnnxCharClassifier:
+    """Runs an ONNX model taking (N, 1, CHAR_SIZE, CHAR_SIZE) glyphs and returning (N, len(ALPHABET)) scores."""
+
+    def __init__(self, path):
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def logits(self, batch):
+        return self.session.run(None, {self.input_name: batch[:, None, :, :]})[0]
+
+
+def load_classifier(path=config.OCR_MODEL_PATH):
+    """Loads the character classifier; the file extension selects NumPy (.npz) or ONNX (.onnx)."""
+    if path.endswith('.onnx'):
+        return OnnxCharClassifier(path)
+    return NumpyCharClassifier.load(path)
+
+
+class SegmentReader:
+    """Segments a plate into its 7 characters and classifies them in one batch."""
+
+    name = 'segment'
+
+    def __init__(self, model_path=config.OCR_MODEL_PATH, classifier=None):
+        self.classifier = classifier or load_classifier(model_path)
+        self.confidence = 0.0  # lowest per-character probability of the last read
+
+    def read(self, thresh):
+        """Returns the 7-character plate, or '' if the plate could not be segmented."""
+        batch = segment_characters(thresh)
+        if batch is None:
+            self.confidence = 0.0
+            return ''
+        logits = np.asarray(self.classifier.logits(batch), dtype=np.float32)
+        logits = np.where(_POSITION_MASK, logits, -np.inf)
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        self.confidence = float(probs[np.arange(len(best)), best].min())
+        return ''.join(ALPHABET[i] for i in best)
+
+
+# ===== Training =====
+_FONTS = [cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_COMPLEX,
+          cv2.FONT_HERSHEY_TRIPLEX, cv2.FONT_HERSHEY_PLAIN]
+
+
+def render_glyph(char, rng, font=cv2.FONT_HERSHEY_SIMPLEX):
+    """Renders `char` white on black with random thickness, shear, rotation and noise."""
+    canvas = np.zeros((64, 64), dtype=np.uint8)
+    thickness = int(rng.integers(2, 6))
+    cv2.putText(canvas, char, (10, 52), font, 1.6, 255, thickness, cv2.LINE_AA)
+    angle, shear = rng.uniform(-6, 6), rng.uniform(-0.15, 0.15)
+    matrix = cv2.getRotationMatrix2D((32, 32), angle, rng.uniform(0.9, 1.1))
+    matrix[0, 1] += shear
+    canvas = cv2.warpAffine(canvas, matrix, (64, 64))
+    canvas = cv2.threshold(cv2.GaussianBlur(canvas, (3, 3), 0), 100, 255, cv2.THRESH_BINARY)[1]
+    ys, xs = np.nonzero(canvas)
+    if len(xs) == 0:
+        return None
+    return canvas[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+
+
+def training_set(samples_per_font=40, chars_dir=None, seed=0):
+    """Returns (X, y): rendered glyphs for every character plus any real crops in chars_dir/<char>/."""
+    rng = np.random.default_rng(seed)
+    images, labels = [], []
+    for label, char in enumerate(ALPHABET):
+        for font in _FONTS:
+            for _ in range(samples_per_font):
+                glyph = render_glyph(char, rng, font)
+                if glyph is not None:
+                    images.append(normalize_char(glyph))
+                    labels.append(label)
+        folder = os.path.join(chars_dir, char) if chars_dir else None
+        if folder and os.path.isdir(folder):
+            for name in sorted(os.listdir(folder)):
+                crop = cv2.imread(os.path.join(folder, name), cv2.IMREAD_GRAYSCALE)
+                if crop is None:
+                    continue
+                ink = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+                if np.mean(ink) > 127:
+                    ink = cv2.bitwise_not(ink)
+                images.append(normalize_char(ink))
+                labels.append(label)
+    return np.stack(images).reshape(len(images), -1), np.array(labels)
+
+
+def train(X, y, epochs=300, learning_rate=0.5, l2=1e-4):
+    """Fits a NumpyCharClassifier with full-batch softmax regression."""
+    n, features = X.shape
+    weights = np.zeros((features, len(ALPHABET)), dtype=np.float32)
+    bias = np.zeros(len(ALPHABET), dtype=np.float32)
+    onehot = np.eye(len(ALPHABET), dtype=np.float32)[y]
+    for _ in range(epochs):
+        logits = X @ weights + bias
+        probs = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs /= probs.sum(axis=1, keepdims=True)
+        grad = (probs - onehot) / n
+        weights -= learning_rate * (X.T @ grad + l2 * weights)
+        bias -= learning_rate * grad.sum(axis=0)
+    return NumpyCharClassifier(weights, bias)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Character classifier for the 'segment' OCR engine.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    tr = sub.add_parser('train', help="Train the NumPy classifier.")
+    tr.add_argument('--out', default=config.OCR_MODEL_PATH)
+    tr.add_argument('--chars', help="Optional directory of real character crops, one sub-folder per character")
+    tr.add_argument('--samples', type=int, default=40, help="Rendered samples per character and font")
+    tr.add_argument('--epochs', type=int, default=300)
+    args = parser.parse_args()
+
+    X, y = training_set(args.samples, args.chars)
+    classifier = train(X.astype(np.float32), y, epochs=args.epochs)
+    accuracy = float((classifier.logits(X).argmax(axis=1) == y).mean())
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    classifier.save(args.out)
+    print(f"[OCR] Trained on {len(y)} glyphs, training accuracy {accuracy:.1%}, saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Cheap quality gate in front of OCR.
+
+Every detector box used to go through preprocessing and tesseract, including
+motion-blurred, over/under-exposed and tiny plates that never pass the RA
+format check. QualityGate scores each crop on
+
+- size and aspect ratio of the box,
+- sharpness: variance of the Laplacian on the crop scaled to a fixed height,
+- exposure: mean brightness and the share of clipped (near black/white) pixels,
+
+drops the hopeless ones and hands only the best-scoring crop on to OCR.
+Within a track (one car followed across frames) a crop is only OCR-ed if it
+scores at least QUALITY_TRACK_SHARE of the best crop that track has had, so
+the votes come from the car's sharpest frames rather than from any frame
+that clears the fixed thresholds.
+It counts every rejection by reason and prints the counters every
+QUALITY_REPORT_INTERVAL seconds, so the OCR work saved can be seen and the
+thresholds tuned from real traffic.
+"""
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+import config
+from event_log import get_logger
+
+log = get_logger('plate_quality')
+
+_NORMALIZED_HEIGHT = 48  # px - crops are scaled to this height before measuring sharpness
+
+
+class QualityGate:
+    """Scores plate crops, rejects hopeless ones and keeps the best for OCR."""
+
+    def __init__(self, min_width=config.QUALITY_MIN_WIDTH, min_height=config.QUALITY_MIN_HEIGHT,
+                 min_aspect=config.QUALITY_MIN_ASPECT, max_aspect=config.QUALITY_MAX_ASPECT,
+                 min_sharpness=config.QUALITY_MIN_SHARPNESS, min_brightness=config.QUALITY_MIN_BRIGHTNESS,
+                 max_brightness=config.QUALITY_MAX_BRIGHTNESS, max_clipped=config.QUALITY_MAX_CLIPPED,
+                 track_share=config.QUALITY_TRACK_SHARE, report_interval=config.QUALITY_REPORT_INTERVAL):
+        self.min_width = min_width
+        self.min_height = min_height
+        self.min_aspect = min_aspect
+        self.max_aspect = max_aspect
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.track_share = track_share
+        self.report_interval = report_interval
+        self.counters = Counter()
+        self._last_report = time.time()
+
+    def score(self, crop):
+        """Returns (score, reject_reason). reject_reason is None for a usable crop."""
+        h, w = crop.shape[:2]
+        if w < self.min_width or h < self.min_height:
+            return 0.0, 'too_small'
+        aspect = w / h
+        if not self.min_aspect <= aspect <= self.max_aspect:
+            return 0.0, 'bad_aspect'
+
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        gray = cv2.resize(gray, (max(1, round(_NORMALIZED_HEIGHT * aspect)), _NORMALIZED_HEIGHT),
+                          interpolation=cv2.INTER_AREA)
+
+        brightness = float(gray.mean())
+        if brightness < self.min_brightness:
+            return 0.0, 'too_dark'
+        if brightness > self.max_brightness:
+            return 0.0, 'too_bright'
+        clipped = float(np.count_nonzero((gray <= 10) | (gray >= 245))) / gray.size
+        if clipped > self.max_clipped:
+            return 0.0, 'clipped'
+
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        if sharpness < self.min_sharpness:
+            return sharpness, 'blurred'
+        return sharpness * (1.0 - clipped), None
+
+    def select(self, frame, boxes, track=None):
+        """
+        Scores the crops for `boxes` in `frame` and returns the boxes worth OCR-ing:
+        at most one, the best-scoring usable crop. With a `track`, that crop must
+        also score at least track_share of the track's best so far, and a new best
+        is kept on the track.
+        """
+        best, best_score = None, -1.0
+        for box in boxes:
+            x1, y1, x2, y2 = box
+            score, reason = self.score(frame[y1:y2, x1:x2])
+            self.counters['checked'] += 1
+            if reason:
+                self.counters[reason] += 1
+            elif score > best_score:
+                best, best_score = box, score
+        if best is None:
+            return []
+        if track is not None:
+            if best_score < track.best_score * self.track_share:
+                self.counters['below_track_best'] += 1
+                return []
+            if best_score > track.best_score:
+                track.best_score, track.best_box = best_score, best
+        self.counters['ocr'] += 1
+        return [best]
+
+    def summary(self):
+        checked = self.counters['checked']
+        if not checked:
+            return "no crops checked"
+        rejected = {k: v for k, v in self.counters.items() if k not in ('checked', 'ocr')}
+        skipped = checked - self.counters['ocr']
+        reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(rejected.items())) or "none"
+        return (f"{checked} crops, {self.counters['ocr']} sent to OCR, {skipped} skipped "
+                f"({100.0 * skipped / checked:.0f}%); rejected: {reasons}")
+
+    def maybe_report(self):
+        """Logs the counters once every report_interval seconds."""
+        if self.report_interval and time.time() - self._last_report >= self.report_interval:
+            self._last_report = time.time()
+            log.info('QUALITY', self.summary(), **self.counters)
@@ -0,0 +1,334 @@
+"""
+Operator search over every session ever recorded, by partial or misread plate.
+
+"That car from Tuesday" usually comes with half a plate or one read off a
+blurry snapshot. PlateSearchIndex keeps the whole session history in
+compact columns (one array slot per session, not one dict) and the distinct
+plates in a trigram index:
+
+- plates and queries are first folded to OCR confusion classes (0/O/D/Q,
+  8/B/3, 5/S, ... from plate_match.OCR_CONFUSIONS), so a trigram of "RAB8O5"
+  and one of "RA8B05" are the same key;
+- the plates sharing the most folded trigrams with the query (queries under
+  three characters: every plate containing it) are scored with an OCR-aware
+  substring edit distance, where a confusion costs CONFUSION_COST and the
+  query may match any part of the plate;
+- matches within SEARCH_MAX_COST are ranked by that cost, then by their most
+  recent session, and returned with their newest sessions (optionally only
+  those with from <= entry_time < to).
+
+Two arbitrary (non-confusion) edits inside a 7-character query can remove
+every shared trigram; such plates are not found. OCR errors are almost
+always confusions, which the folding absorbs.
+
+The index is built from the store once, then kept current incrementally:
+the dashboard feeds it CarEntered and PaymentCompleted events from the bus
+(add_session / update_session), and rebuilds it in the background every
+SEARCH_REBUILD_INTERVAL seconds for anything that happened without an event.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+import config
+from plate_match import CONFUSION_COST, OCR_CONFUSIONS
+
+def _confusion_classes(pairs):
+    """char -> representative of its confusion class (union-find over the pairs)."""
+    parent = {}
+
+    def find(c):
+        while parent.setdefault(c, c) != c:
+            c = parent[c]
+        return c
+
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return {c: find(c) for c in parent}
+
+
+_FOLD = str.maketrans(_confusion_classes(OCR_CONFUSIONS))
+_CONFUSABLE = {frozenset(pair) for pair in OCR_CONFUSIONS}
+
+
+def fold(text):
+    """`text` upper-cased, without spaces/dashes, with every OCR-confusable character replaced by its class."""
+    return clean(text).translate(_FOLD)
+
+
+def clean(text):
+    return ''.join(c for c in (text or '').upper() if c.isalnum())
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def substring_cost(query, plate, max_cost=float('inf')):
+    """
+    OCR-aware edit distance from `query` to the closest part of `plate`:
+    skipping plate characters before and after the match is free, a
+    confusion costs CONFUSION_COST and any other edit 1. Gives up (inf) as
+    soon as the cost must exceed `max_cost`.
+    """
+    if query in plate:
+        return 0.0
+    previous = [0.0] * (len(plate) + 1)
+    for i, cq in enumerate(query, 1):
+        current = [float(i)]
+        for j, cp in enumerate(plate, 1):
+            if cq == cp:
+                substitution = 0.0
+            elif frozenset((cq, cp)) in _CONFUSABLE:
+                substitution = CONFUSION_COST
+            else:
+                substitution = 1.0
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + substitution))
+        previous = current
+        if min(previous) > max_cost:
+            return float('inf')  # costs only grow down the table
+    return min(previous)
+
+
+def _stamp(text):
+    """'YYYY-MM-DD HH:MM:SS' (or a prefix of it) -> sortable int YYYYMMDDhhmmss; '' -> 0."""
+    if text and len(text) == 19:
+        try:
+            return int(text[:4] + text[5:7] + text[8:10] + text[11:13] + text[14:16] + text[17:19])
+        except ValueError:
+            pass
+    digits = ''.join(c for c in (text or '') if c.isdigit())[:14]
+    return int(digits.ljust(14, '0')) if digits else 0
+
+
+def _status(value):
+    value = str(value).strip()
+    return int(value) if value.isdigit() and len(value) == 1 else 0
+
+
+def _unstamp(value):
+    if not value:
+        return ''
+    s = f"{value:014d}"
+    return f"{s[:4]}-{s[4:6]}-{s[6:8]} {s[8:10]}:{s[10:12]}:{s[12:14]}"
+
+
+class _Columns:
+    """The session history, one slot per session in `no` order."""
+
+    def __init__(self):
+        self.no = array('q')
+        self.entry = array('q')  # _stamp(entry_time)
+        self.exit = array('q')
+        self.status = bytearray()  # payment_status digit: 0 unpaid, 1 paid, 2 closed by the sweeper
+        self.due = []  # strings, interned through `dues`
+        self.dues = {}
+
+    def append(self, no, entry, exit_time, due, status):
+        self.no.append(no)
+        self.entry.append(_stamp(entry))
+        self.exit.append(_stamp(exit_time))
+        self.status.append(_status(status))
+        self.due.append(self.dues.setdefault(due, due))
+
+    def find(self, no):
+        """Slot of session `no`, or None."""
+        i = bisect_left(self.no, no)
+        return i if i < len(self.no) and self.no[i] == no else None
+
+    def row(self, i, plate):
+        return {'no': str(self.no[i]), 'entry_time': _unstamp(self.entry[i]), 'exit_time': _unstamp(self.exit[i]),
+                'car_plate': plate, 'due_payment': self.due[i], 'payment_status': str(self.status[i])}
+
+
+class _Index:
+    """Columns, plates and trigram postings; PlateSearchIndex swaps a freshly built one in whole."""
+
+    def __init__(self):
+        self.columns = _Columns()
+        self.plates = []  # plate id -> plate
+        self.folded = []  # plate id -> fold(plate)
+        self.plate_ids = {}
+        self.postings = []  # plate id -> array of column slots
+        self.grams = {}  # folded trigram -> array of plate ids
+
+    def _plate_id(self, plate):
+        plate_id = self.plate_ids.get(plate)
+        if plate_id is None:
+            plate_id = self.plate_ids[plate] = len(self.plates)
+            folded = fold(plate)
+            self.plates.append(plate)
+            self.folded.append(folded)
+            self.postings.append(array('l'))
+            for gram in trigrams(folded):
+                self.grams.setdefault(gram, array('l')).append(plate_id)
+        return plate_id
+
+    def add(self, no, plate, entry, exit_time='', due='', status='0'):
+        columns = self.columns
+        if columns.no and no <= columns.no[-1]:
+            return  # already indexed (or out of order, which the next rebuild sorts out)
+        plate_id = self._plate_id(plate)
+        self.postings[plate_id].append(len(columns.no))
+        columns.append(no, entry, exit_time, due, status)
+
+    def update(self, no, fields):
+        columns = self.columns
+        slot = columns.find(no)
+        if slot is None:
+            return False
+        if 'exit_time' in fields:
+            columns.exit[slot] = _stamp(fields['exit_time'])
+        if 'due_payment' in fields:
+            due = str(fields['due_payment'])
+            columns.due[slot] = columns.dues.setdefault(due, due)
+        if 'payment_status' in fields:
+            columns.status[slot] = _status(fields['payment_status'])
+        return True
+
+
+class PlateSearchIndex:
+    """Ranked, OCR-tolerant plate search over a store's whole session history."""
+
+    def __init__(self, store, max_cost=config.SEARCH_MAX_COST, candidates=config.SEARCH_CANDIDATES,
+                 rebuild_interval=config.SEARCH_REBUILD_INTERVAL):
+        self.store = store
+        self.max_cost = max_cost
+        self.candidates = candidates
+        self.rebuild_interval = rebuild_interval
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.index = _Index()
+        self.pending = None  # updates received while a rebuild reads the store, replayed onto it
+        self.built_at = None
+
+    # --- Building ---
+    def build(self):
+        """(Re)reads the whole history from the store; searches keep using the old index until it is done."""
+        started = time.monotonic()
+        with self.lock:
+            self.pending = []
+        fresh = _Index()
+        cleaned = {}
+        for row in self.store.sessions():
+            try:
+                no = int(row['no'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            raw = row.get('car_plate')
+            plate = cleaned.get(raw)
+            if plate is None:
+                plate = cleaned[raw] = clean(raw)
+            if plate:
+                fresh.add(no, plate, row.get('entry_time'), row.get('exit_time'), row.get('due_payment') or '',
+                          row.get('payment_status'))
+        with self.lock:
+            for apply in self.pending:
+                apply(fresh)
+            self.index, self.pending = fresh, None
+            self.built_at = time.monotonic()
+        self.ready.set()
+        return time.monotonic() - started
+
+    def start(self):
+        """Builds in the background now and every rebuild_interval seconds."""
+        def run():
+            while True:
+                self.build()
+                if not self.rebuild_interval:
+                    return
+                time.sleep(self.rebuild_interval)
+
+        threading.Thread(target=run, name='plate-search', daemon=True).start()
+
+    # --- Incremental updates ---
+    def _apply(self, change):
+        with self.lock:
+            change(self.index)
+            if self.pending is not None:
+                self.pending.append(change)
+
+    def add_session(self, no, plate, entry_time):
+        plate = clean(plate)
+        if plate:
+            self._apply(lambda index: index.add(int(no), plate, entry_time))
+
+    def update_session(self, no, **fields):
+        """Applies exit_time / due_payment / payment_status changes to session `no`."""
+        self._apply(lambda index: index.update(int(no), fields))
+
+    def on_car_entered(self, event):
+        self.add_session(event.no, event.plate, event.entry_time)
+
+    def on_payment_completed(self, event):
+        self.update_session(event.no, exit_time=event.paid_at, due_payment=event.amount, payment_status='1')
+
+    # --- Search ---
+    def _candidates(self, index, folded):
+        """
+        [(plate id, lower bound of its cost)], most promising first. Each edit that is not
+        an OCR confusion breaks at most three of the query's folded trigrams, so a plate
+        missing m of them is at least ceil(m / 3) edits away.
+        """
+        if len(folded) < 3:
+            return [(i, 0) for i, plate in enumerate(index.folded) if folded in plate]
+        grams = trigrams(folded)
+        hits = Counter()
+        for gram in grams:
+            hits.update(index.grams.get(gram, ()))
+        return [(plate_id, -(-(len(grams) - count) // 3)) for plate_id, count in hits.most_common(self.candidates)]
+
+    def search(self, query, limit=20, sessions=5, start=None, end=None):
+        """
+        Returns up to `limit` matches, best first: {'plate', 'cost', 'sessions': count in range,
+        'last_entry', 'recent': newest `sessions` session rows}. `start`/`end` limit the sessions
+        (and so the plates) to start <= entry_time < end.
+        """
+        query = clean(query)
+        if not query or limit < 1:
+            return []
+        low, high = _stamp(start), _stamp(end)
+
+        def in_range(slot):
+            return (not low or entry[slot] >= low) and (not high or entry[slot] < high)
+
+        with self.lock:
+            index = self.index
+            columns = index.columns
+            entry = columns.entry
+            ranked, bound = [], self.max_cost
+            for plate_id, lower in self._candidates(index, fold(query)):
+                if lower > bound:
+                    break  # the rest are further away than every match already kept
+                cost = substring_cost(query, index.plates[plate_id], bound)
+                if cost > self.max_cost:
+                    continue
+                postings = index.postings[plate_id]
+                # Newest session in range: postings are in `no` (so entry) order
+                newest = next((slot for slot in reversed(postings) if in_range(slot)), None)
+                if newest is not None:
+                    ranked.append((cost, -entry[newest], plate_id))
+                    if len(ranked) >= 4 * limit:
+                        ranked.sort()
+                        del ranked[limit:]
+                        bound = ranked[-1][0]  # a worse plate can no longer make the list
+            ranked.sort()
+
+            matches = []
+            for cost, _, plate_id in ranked[:limit]:
+                plate = index.plates[plate_id]
+                slots = [slot for slot in index.postings[plate_id] if in_range(slot)]
+                matches.append({'plate': plate, 'cost': round(cost, 2), 'sessions': len(slots),
+                                'last_entry': _unstamp(entry[slots[-1]]),
+                                'recent': [columns.row(slot, plate) for slot in reversed(slots[-sessions:] if sessions > 0 else [])]})
+            return matches
+
+    def stats(self):
+        with self.lock:
+            index = self.index
+            return {'sessions': len(index.columns.no), 'plates': len(index.plates), 'trigrams': len(index.grams),
+                    'ready': self.ready.is_set()}
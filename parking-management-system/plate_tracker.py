@@ -0,0 +1,124 @@
+"""
+IoU tracker giving every plate in view its own vote buffer.
+
+The gates used to push every valid read from every box into one shared
+plate_buffer, so two cars in view (or one queued behind the barrier) mixed
+their votes. PlateTracker matches each frame's boxes to the tracks of the
+previous frames by overlap (greedy, highest IoU first). Each Track collects
+the reads for its own plate and makes its own decision once it has
+TRACK_VOTES valid reads; a decided track is not read again, so a busy lane
+clears car after car without resetting anything.
+
+A track ends when it has not been matched for TRACK_MAX_MISSED detector
+frames or TRACK_MAX_IDLE seconds (the car drove off, or the lane went idle).
+"""
+import time
+from collections import Counter
+
+import cv2
+
+import config
+
+
+def iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes."""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    if inter == 0:
+        return 0.0
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union
+
+
+class Track:
+    """One plate followed across frames, with its own votes and decision."""
+
+    def __init__(self, track_id, box, now):
+        self.id = track_id
+        self.box = box
+        self.votes = []
+        self.decision = None  # plate the gate acted on, once decided
+        self.best_score = 0.0  # quality score of the best crop OCR-ed so far (see QualityGate.select)
+        self.best_box = None
+        self.first_seen = now
+        self.last_seen = now
+        self.missed = 0
+
+    def vote(self, plate, needed=config.TRACK_VOTES):
+        """Adds a valid read. Returns the winning plate once `needed` reads are in, else None."""
+        self.votes.append(plate)
+        if len(self.votes) < needed:
+            return None
+        return Counter(self.votes).most_common(1)[0][0]
+
+    def decide(self, plate):
+        """Marks the track as handled, so it is not read or acted on again."""
+        self.decision = plate
+
+    def reset_votes(self):
+        """Drops the votes without deciding, so the plate is read again from scratch."""
+        self.votes.clear()
+
+
+class PlateTracker:
+    """Matches detector boxes to tracks frame by frame."""
+
+    def __init__(self, iou_threshold=config.TRACK_IOU, max_missed=config.TRACK_MAX_MISSED,
+                 max_idle=config.TRACK_MAX_IDLE):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.max_idle = max_idle
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, boxes, now=None):
+        """
+        Assigns this frame's `boxes` to tracks (starting new ones as needed) and
+        expires stale tracks. Returns the tracks seen in this frame.
+        """
+        now = time.time() if now is None else now
+        pairs = sorted(((iou(track.box, box), t, b) for t, track in enumerate(self.tracks)
+                        for b, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, t, b in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or b in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(b)
+            track = self.tracks[t]
+            track.box, track.last_seen, track.missed = boxes[b], now, 0
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.missed += 1
+        seen = [self.tracks[t] for t in sorted(matched_tracks)]
+        for b, box in enumerate(boxes):
+            if b not in matched_boxes:
+                track = Track(self._next_id, box, now)
+                self._next_id += 1
+                self.tracks.append(track)
+                seen.append(track)
+
+        self.tracks = [track for track in self.tracks
+                       if track.missed <= self.max_missed and now - track.last_seen <= self.max_idle]
+        return seen
+
+    def clear(self):
+        """Forgets every track (e.g. when the lane is empty)."""
+        self.tracks = []
+
+
+def draw_tracks(frame, tracks):
+    """
+    Draws each track's box with its ID and decision (or vote count) on `frame`,
+    which must be the native camera frame: track boxes are in its coordinates.
+    """
+    for track in tracks:
+        x1, y1, x2, y2 = track.box
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0) if track.decision else (0, 255, 255), 2)
+        label = f"#{track.id} {track.decision}" if track.decision else f"#{track.id} {len(track.votes)} votes"
+        cv2.putText(frame, label, (x1, max(15, y1 - 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+    return frame
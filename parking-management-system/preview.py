@@ -0,0 +1,89 @@
+"""
+Low-rate JPEG preview of a gate's annotated camera feed.
+
+In headless mode (PMS_HEADLESS=1) the gates open no windows and never block
+on cv2.waitKey. Monitoring goes through PreviewPublisher instead: at most
+PREVIEW_FPS times a second it asks the loop for an annotated frame (so
+the track boxes are only drawn when a preview is actually due), scales it to
+PREVIEW_WIDTH and JPEG-encodes it once on a background thread. The JPEG
+is written atomically to <PREVIEW_DIR>/<lane>.jpg, and the dashboard
+(system_ui/backend/app.py) streams that one file to every viewer as MJPEG.
+A slow encode or disk never holds up the gate loop: if the previous preview
+is still being written, the new one is skipped.
+"""
+import os
+import threading
+import time
+
+import cv2
+
+import config
+from event_log import get_logger
+
+log = get_logger('preview')
+
+
+def preview_path(lane, preview_dir=config.PREVIEW_DIR):
+    return os.path.join(preview_dir, f"{lane.lower()}.jpg")
+
+
+def write_preview(path, jpeg):
+    """Replaces `path` with `jpeg` (bytes) via temp file + rename, so readers never see half a frame."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(jpeg)
+    try:
+        os.replace(tmp_path, path)
+    except PermissionError:
+        os.remove(tmp_path)  # Windows: a viewer has the old frame open; the next preview will go through
+
+
+class PreviewPublisher:
+    """Publishes an annotated frame every 1/fps seconds without slowing the gate loop."""
+
+    def __init__(self, lane, fps=config.PREVIEW_FPS, width=config.PREVIEW_WIDTH,
+                 quality=config.PREVIEW_JPEG_QUALITY, preview_dir=config.PREVIEW_DIR):
+        self.enabled = fps > 0
+        self.interval = 1.0 / fps if fps > 0 else None
+        self.width = width
+        self.quality = quality
+        self.path = preview_path(lane, preview_dir)
+        self._last = 0.0
+        self._busy = threading.Lock()
+        self.published = 0
+        self.skipped = 0
+        if self.enabled:
+            os.makedirs(preview_dir, exist_ok=True)
+
+    def maybe_publish(self, make_frame):
+        """Calls `make_frame()` and publishes its result if a preview is due; otherwise does nothing."""
+        if not self.enabled or time.monotonic() - self._last < self.interval:
+            return
+        if not self._busy.acquire(blocking=False):
+            self.skipped += 1
+            return
+        self._last = time.monotonic()
+        frame = make_frame()
+        h, w = frame.shape[:2]
+        if self.width and w > self.width:
+            frame = cv2.resize(frame, (self.width, round(h * self.width / w)), interpolation=cv2.INTER_AREA)
+        else:
+            frame = frame.copy()  # the loop reuses its buffers
+        threading.Thread(target=self._encode_and_write, args=(frame,), daemon=True).start()
+
+    def _encode_and_write(self, frame):
+        try:
+            ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if ok:
+                write_preview(self.path, jpeg.tobytes())
+                self.published += 1
+        except OSError as e:
+            log.warning('PREVIEW', f"Could not write {self.path}: {e}")
+        finally:
+            self._busy.release()
+
+    def close(self):
+        """Removes the preview file so viewers do not watch a frozen frame."""
+        with self._busy:
+            if self.enabled and os.path.exists(self.path):
+                os.remove(self.path)
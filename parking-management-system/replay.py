@@ -0,0 +1,260 @@
+"""
+Replay recorded footage through the unchanged entry/exit gate loops.
+
+    python replay.py entry dataset/train/images --repeat 3
+    python replay.py exit recordings/exit_lane.mp4 --fps 15 --out replay_out/exit
+
+The source is a video file or a directory of images (read in name order).
+Frames are delivered as fast as the pipeline takes them, or paced to --fps.
+The gate module's main() runs as is, with these stand-ins:
+
+- camera: ReplayCapture reads the source instead of the webcam;
+- Arduino: ReplayArduino reports a car at --distance cm on every poll and
+  records every command the gate sends ('1' open, '0' close, '2'/'3' alarm,
+  'S' stop) in <out>/decisions.jsonl with the frame it happened on;
+- display: cv2.imshow/waitKey do nothing;
+- time.sleep inside the gate module is scaled by --sleep-scale (0 = the
+  15 s barrier and buzzer waits take no time);
+- storage: sessions, attempts and the event log go to <out>, never to the
+  live files;
+- tracking: with an image folder, tracks are reset on every new image, since
+  each file is a separate scene.
+
+Detection, quality gate, preprocessing and OCR are timed per call, and
+<out>/summary.json holds the per-stage throughput, so two runs on the same
+footage show what a change did to performance and to the decisions.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# What each gate command means, for the decision log
+COMMANDS = {'0': 'close', '1': 'open', '2': 'alarm_unpaid', '3': 'alarm_denied', 'S': 'stop_alarm'}
+
+
+class ReplayCapture:
+    """cv2.VideoCapture stand-in reading a video file or an image directory."""
+
+    def __init__(self, source, fps=None, repeat=1):
+        self.source = source
+        self.fps = fps
+        self.repeat = max(1, repeat)
+        self.frame_index = -1
+        self.frame_name = None
+        self._next_due = None
+        self._cached = None
+        self._served = 0
+        if os.path.isdir(source):
+            self.images = sorted(os.path.join(source, name) for name in os.listdir(source)
+                                 if name.lower().endswith(IMAGE_EXTENSIONS))
+            self.video = None
+        else:
+            self.images = None
+            self.video = cv2.VideoCapture(source)
+
+    def isOpened(self):
+        return bool(self.images) if self.images is not None else self.video.isOpened()
+
+    def _next_frame(self):
+        if self._cached is not None and self._served < self.repeat:
+            self._served += 1
+            return self._cached
+        if self.images is not None:
+            position = (self.frame_index + 1) // self.repeat
+            if position >= len(self.images):
+                return None
+            self.frame_name = os.path.basename(self.images[position])
+            frame = cv2.imread(self.images[position])
+        else:
+            ok, frame = self.video.read()
+            if not ok:
+                return None
+            self.frame_name = f"{self.source}#{int(self.video.get(cv2.CAP_PROP_POS_FRAMES)) - 1}"
+        self._cached, self._served = frame, 1
+        return frame
+
+    def read(self):
+        if self.fps:
+            now = time.perf_counter()
+            if self._next_due is not None and now < self._next_due:
+                time.sleep(self._next_due - now)
+            self._next_due = max(now, self._next_due or now) + 1.0 / self.fps
+        frame = self._next_frame()
+        if frame is None:
+            return False, None
+        self.frame_index += 1
+        return True, frame
+
+    def release(self):
+        if self.video is not None:
+            self.video.release()
+
+
+class ReplayArduino:
+    """GateLink stand-in: always sees a car at `distance` cm and logs the commands it is sent."""
+
+    def __init__(self, capture, distance, log_path):
+        self.capture = capture
+        self.distance = distance
+        self.log = open(log_path, 'w')
+        self.decisions = []
+
+    def read_distance(self):
+        return self.distance
+
+    def write(self, data):
+        for command in data.decode(errors='ignore').strip():
+            decision = {'frame': self.capture.frame_index, 'source': self.capture.frame_name,
+                        'command': command, 'action': COMMANDS.get(command, 'unknown')}
+            self.decisions.append(decision)
+            self.log.write(json.dumps(decision) + '\n')
+        self.log.flush()
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.log.close()
+
+
+class StageTimer:
+    """Wall-clock time and call count per pipeline stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def wrap(self, name, func):
+        stage = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stage['calls'] += 1
+                stage['seconds'] += time.perf_counter() - start
+        return timed
+
+    def summary(self):
+        return {name: {'calls': s['calls'], 'seconds': round(s['seconds'], 4),
+                       'ms_per_call': round(1000 * s['seconds'] / s['calls'], 3) if s['calls'] else None,
+                       'per_second': round(s['calls'] / s['seconds'], 1) if s['seconds'] else None}
+                for name, s in self.stages.items()}
+
+
+class _ScaledTime:
+    """The gate module's `time`, with sleep() scaled so barrier/buzzer waits do not stall a replay."""
+
+    def __init__(self, scale):
+        self.scale = scale
+
+    def sleep(self, seconds):
+        if self.scale > 0:
+            time.sleep(seconds * self.scale)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def _use_replay_storage(out_dir):
+    """Points the store (and everything else the gates write) at `out_dir`; must run before config is imported."""
+    os.makedirs(out_dir, exist_ok=True)
+    os.environ['PMS_SESSIONS_CSV'] = os.path.join(out_dir, 'sessions.csv')
+    os.environ['PMS_ATTEMPTS_CSV'] = os.path.join(out_dir, 'attempts.csv')
+    os.environ['PMS_SQLITE_PATH'] = os.path.join(out_dir, 'replay.db')
+    os.environ['PMS_READY_DIR'] = os.path.join(out_dir, 'run')
+    os.environ['PMS_LOG_DIR'] = os.path.join(out_dir, 'logs')
+    os.environ['PMS_EXIT_AUTH'] = '0'  # no payment station is publishing during a replay
+
+
+def run(lane, source, out_dir, fps=None, repeat=1, distance=20.0, sleep_scale=0.0):
+    """Runs the `lane` ('entry' or 'exit') gate loop over `source`. Returns the summary dict."""
+    if 'config' in sys.modules:
+        raise RuntimeError("run() must be called before config is imported, so the replay store is used")
+    _use_replay_storage(out_dir)
+
+    import gate_startup
+    gate_module = __import__('car_entry_updated' if lane == 'entry' else 'car_exit_updated')
+    timer = StageTimer()
+    capture = ReplayCapture(source, fps, repeat)
+    if not capture.isOpened():
+        raise SystemExit(f"[REPLAY] Cannot read {source}")
+    arduino = ReplayArduino(capture, distance, os.path.join(out_dir, 'decisions.jsonl'))
+
+    load_ocr = gate_startup.load_ocr
+
+    def timed_ocr():
+        reader = load_ocr()
+        reader.read = timer.wrap('ocr', reader.read)
+        return reader
+
+    class TimedQualityGate(gate_module.QualityGate):
+        select = timer.wrap('quality', gate_module.QualityGate.select)
+
+    class SceneTracker(gate_module.PlateTracker):
+        """Every file of an image folder is its own scene, so no track carries over to the next image."""
+        scene = None
+
+        def update(self, boxes, now=None):
+            if capture.images is not None and capture.frame_name != self.scene:
+                self.clear()
+                self.scene = capture.frame_name
+            return super().update(boxes, now)
+
+    gate_startup.open_camera = lambda: capture
+    gate_startup.open_arduino = lambda port_detector: arduino
+    gate_startup.load_ocr = timed_ocr
+    gate_module.detect_plates = timer.wrap('detect', gate_module.detect_plates)
+    gate_module.preprocess_plate = timer.wrap('preprocess', gate_module.preprocess_plate)
+    gate_module.QualityGate = TimedQualityGate
+    gate_module.PlateTracker = SceneTracker
+    gate_module.time = _ScaledTime(sleep_scale)
+    gate_module.detect_arduino_port = lambda: 'replay'
+    cv2.imshow = lambda *args: None
+    cv2.waitKey = lambda delay=0: -1
+    cv2.destroyAllWindows = lambda: None
+
+    start = time.perf_counter()
+    gate_module.main()
+    elapsed = time.perf_counter() - start
+
+    frames = capture.frame_index + 1
+    summary = {'lane': lane, 'source': source, 'frames': frames, 'seconds': round(elapsed, 3),
+               'fps': round(frames / elapsed, 2) if elapsed else None, 'paced_fps': fps,
+               'stages': timer.summary(),
+               'decisions': {action: sum(1 for d in arduino.decisions if d['action'] == action)
+                             for action in sorted({d['action'] for d in arduino.decisions})}}
+    with open(os.path.join(out_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a gate loop on recorded video or an image folder.")
+    parser.add_argument('lane', choices=['entry', 'exit'])
+    parser.add_argument('source', help="Video file or image directory")
+    parser.add_argument('--fps', type=float, help="Pace frames to this rate (default: as fast as possible)")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Serve every frame this many times (image folders: a car held in view)")
+    parser.add_argument('--distance', type=float, default=20.0, help="cm - distance the fake sensor reports")
+    parser.add_argument('--sleep-scale', type=float, default=0.0, help="Scale for the gate's time.sleep calls")
+    parser.add_argument('--out', default='replay_out', help="Directory for the store, decision log and summary")
+    args = parser.parse_args()
+
+    summary = run(args.lane, args.source, args.out, args.fps, args.repeat, args.distance, args.sleep_scale)
+    print(f"[REPLAY] {summary['frames']} frames in {summary['seconds']:.2f}s ({summary['fps']} fps)")
+    for name, stage in summary['stages'].items():
+        print(f"[REPLAY] {name:10s} {stage['calls']:6d} calls, {stage['ms_per_call']} ms/call, "
+              f"{stage['per_second']} /s")
+    print(f"[REPLAY] decisions: {summary['decisions'] or 'none'} - see {args.out}/decisions.jsonl")
+
+
+if __name__ == "__main__":
+    main()
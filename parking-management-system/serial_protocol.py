@@ -0,0 +1,339 @@
+"""
+Binary framed protocol between the PCs and the Arduino boards.
+
+The boards used to print text lines at 9600 baud ("DIST:12.34", "MSG:...",
+"plate,balance", "READY", "DONE") and the PCs parsed whatever came through,
+so a dropped or corrupted byte produced a wrong distance or a garbled plate
+with nothing to tell it apart from a good one. Every message is now one
+frame, sent at SERIAL_BAUD (115200):
+
+    A5 5A | version | type | seq | length | payload (length bytes) | CRC-16
+
+- A5 5A marks the start of a frame; after garbage or a bad CRC the decoder
+  skips to the next A5 5A, so one bad byte costs one frame, never the stream;
+- version is PROTOCOL_VERSION; frames of another version are dropped;
+- seq is a per-sender counter, echoed in ACKs so the PC knows which command
+  the board carried out;
+- the CRC is CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) over version..payload,
+  little-endian like every other multi-byte field.
+
+A distance sample is 14 bytes, about 1.2 ms on the wire, and the board sends
+one every 50 ms instead of every 200 ms. GateLink hands the gate loop the
+newest sample rather than the oldest queued line, so the loop never acts on
+a reading that sat in the serial buffer behind newer ones.
+
+The C side lives in pms_protocol.h next to each sketch. SERIAL_PROTOCOL=text
+keeps the old line protocol for boards that have not been re-flashed.
+"""
+import binascii
+import struct
+
+import config
+from event_log import get_logger
+
+log = get_logger('serial_protocol')
+
+SYNC = b'\xa5\x5a'
+PROTOCOL_VERSION = 1
+MAX_PAYLOAD = 48
+_HEADER = struct.Struct('<BBBB')  # version, type, seq, length
+_CRC = struct.Struct('<H')
+
+# Board -> PC
+HELLO = 0x01        # device kind (DEVICE_GATE / DEVICE_PAYMENT), sent once after reset
+DISTANCE = 0x02     # uint32 board millis, uint16 distance in mm (NO_ECHO when nothing came back)
+GATE_STATUS = 0x03  # uint8 gate open, uint8 alert (ALERT_*)
+ACK = 0x04          # uint8 seq of the command, uint8 status (0 = done, 1 = unknown command)
+MESSAGE = 0x05      # UTF-8 text, diagnostics only
+CARD = 0x10         # uint8 plate length, plate bytes, int32 balance
+READY = 0x11        # empty - the reader waits for a REPLY
+DONE = 0x12         # int32 balance written to the card
+TIMEOUT = 0x13      # empty - the reader gave up waiting for the PC
+# PC -> board
+COMMAND = 0x20      # one command character: '0' close, '1' open, '2'/'3' alarm, 'S' stop alarm
+REPLY = 0x21        # uint8 code ('I' insufficient, 'A' already paid, 'N' not found, 'B' balance), int32 balance
+
+DEVICE_GATE = 1
+DEVICE_PAYMENT = 2
+ALERT_NONE, ALERT_PAYMENT, ALERT_TAMPERING = 0, 1, 2
+NO_ECHO = 0xFFFF
+NO_ECHO_CM = 999.99  # what getDistanceCm() used to print on a sensor timeout
+
+TYPE_NAMES = {HELLO: 'HELLO', DISTANCE: 'DISTANCE', GATE_STATUS: 'GATE_STATUS', ACK: 'ACK', MESSAGE: 'MESSAGE',
+              CARD: 'CARD', READY: 'READY', DONE: 'DONE', TIMEOUT: 'TIMEOUT', COMMAND: 'COMMAND', REPLY: 'REPLY'}
+
+
+class ProtocolError(ValueError):
+    """A frame that cannot be built or a payload that does not match its type."""
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE of `data`."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encode(frame_type, payload=b'', seq=0):
+    """Returns the bytes of one frame."""
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"Payload of {len(payload)} bytes exceeds {MAX_PAYLOAD}")
+    body = _HEADER.pack(PROTOCOL_VERSION, frame_type, seq & 0xFF, len(payload)) + payload
+    return SYNC + body + _CRC.pack(crc16(body))
+
+
+class Frame:
+    """One decoded frame."""
+
+    def __init__(self, frame_type, seq, payload):
+        self.type = frame_type
+        self.seq = seq
+        self.payload = payload
+
+    def __repr__(self):
+        return f"Frame({TYPE_NAMES.get(self.type, hex(self.type))}, seq={self.seq}, payload={self.payload!r})"
+
+
+class FrameDecoder:
+    """
+    Incremental decoder: feed() it whatever bytes arrived and get back the
+    complete, CRC-checked frames. Partial frames wait for the next feed().
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = 0
+        self.crc_errors = 0
+        self.version_errors = 0
+        self.dropped_bytes = 0
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # Keep a trailing A5: it may be the first half of the next sync
+                keep = 1 if self.buffer[-1:] == SYNC[:1] else 0
+                self.dropped_bytes += len(self.buffer) - keep
+                del self.buffer[:len(self.buffer) - keep]
+                return frames
+            if start:
+                self.dropped_bytes += start
+                del self.buffer[:start]
+            if len(self.buffer) < len(SYNC) + _HEADER.size:
+                return frames
+            version, frame_type, seq, length = _HEADER.unpack_from(self.buffer, len(SYNC))
+            if version != PROTOCOL_VERSION or length > MAX_PAYLOAD:
+                # Not a frame we can read (or a false sync inside another frame's payload): resync
+                self.version_errors += version != PROTOCOL_VERSION
+                self._skip_sync()
+                continue
+            end = len(SYNC) + _HEADER.size + length + _CRC.size
+            if len(self.buffer) < end:
+                return frames
+            body = bytes(self.buffer[len(SYNC):end - _CRC.size])
+            if _CRC.unpack_from(self.buffer, end - _CRC.size)[0] != crc16(body):
+                self.crc_errors += 1
+                self._skip_sync()
+                continue
+            del self.buffer[:end]
+            self.frames += 1
+            frames.append(Frame(frame_type, seq, body[_HEADER.size:]))
+
+    def _skip_sync(self):
+        del self.buffer[:1]
+        self.dropped_bytes += 1
+
+
+# --- Payloads ---
+def distance_cm(frame):
+    """(board millis, distance in cm) of a DISTANCE frame; NO_ECHO_CM when the sensor saw nothing."""
+    try:
+        millis, mm = struct.unpack('<IH', frame.payload)
+    except struct.error:
+        raise ProtocolError(f"Bad DISTANCE payload {frame.payload!r}")
+    return millis, NO_ECHO_CM if mm == NO_ECHO else mm / 10.0
+
+
+def gate_status(frame):
+    """(gate open, alert) of a GATE_STATUS frame."""
+    try:
+        is_open, alert = struct.unpack('<BB', frame.payload)
+    except struct.error:
+        raise ProtocolError(f"Bad GATE_STATUS payload {frame.payload!r}")
+    return bool(is_open), alert
+
+
+def card(frame):
+    """(plate, balance) of a CARD frame."""
+    payload = frame.payload
+    if not payload or len(payload) != 1 + payload[0] + 4:
+        raise ProtocolError(f"Bad CARD payload {payload!r}")
+    plate = payload[1:1 + payload[0]].decode('ascii', errors='ignore').replace('\x00', '').strip()
+    return plate, struct.unpack_from('<i', payload, 1 + payload[0])[0]
+
+
+def encode_card(plate, balance, seq=0):
+    plate = plate.encode('ascii')
+    return encode(CARD, bytes([len(plate)]) + plate + struct.pack('<i', balance), seq)
+
+
+def reply_payload(reply):
+    """REPLY payload for `reply`: 'I', 'A', 'N', or the new card balance as an int."""
+    if isinstance(reply, int):
+        return b'B' + struct.pack('<i', reply)
+    return reply.encode('ascii')[:1] + struct.pack('<i', 0)
+
+
+# --- Links ---
+class _Link:
+    """Serial port wrapper shared by the gate and payment links."""
+
+    def __init__(self, ser, protocol=config.SERIAL_PROTOCOL):
+        if protocol not in ('binary', 'text'):
+            raise ValueError(f"Unknown serial protocol '{protocol}' (expected 'binary' or 'text')")
+        self.ser = ser
+        self.binary = protocol == 'binary'
+        self.decoder = FrameDecoder()
+        self._buffer = b''
+        self._seq = 0
+
+    def _read_available(self):
+        waiting = self.ser.in_waiting
+        return self.ser.read(waiting) if waiting else b''
+
+    def _frames(self):
+        return self.decoder.feed(self._read_available())
+
+    def _lines(self):
+        """Complete text lines received since the last call (text protocol)."""
+        self._buffer += self._read_available()
+        *lines, self._buffer = self._buffer.split(b'\n')
+        return [line.decode('utf-8', errors='ignore').strip() for line in lines]
+
+    def _send(self, frame_type, payload=b''):
+        self._seq = (self._seq + 1) & 0xFF
+        self.ser.write(encode(frame_type, payload, self._seq))
+        return self._seq
+
+    def _log(self, frame):
+        if frame.type == MESSAGE:
+            log.info('ARDUINO MSG', frame.payload.decode('utf-8', errors='ignore'))
+        elif frame.type == HELLO:
+            log.info('ARDUINO', f"Board up, protocol v{PROTOCOL_VERSION}")
+
+    def stats(self):
+        return {'frames': self.decoder.frames, 'crc_errors': self.decoder.crc_errors,
+                'version_errors': self.decoder.version_errors, 'dropped_bytes': self.decoder.dropped_bytes}
+
+    def reset_input_buffer(self):
+        self.ser.reset_input_buffer()
+        self.decoder = FrameDecoder()
+        self._buffer = b''
+
+    @property
+    def is_open(self):
+        return self.ser.is_open
+
+    def close(self):
+        if self.binary and (self.decoder.crc_errors or self.decoder.version_errors):
+            log.warning('SERIAL', f"Link stats: {self.stats()}", **self.stats())
+        self.ser.close()
+
+
+class GateLink(_Link):
+    """
+    A gate's serial link. read_distance() drains everything received and returns
+    the newest distance (None if no new sample came in); write(b'1') etc. sends
+    the gate commands, framed as COMMAND frames on the binary protocol.
+    """
+
+    def __init__(self, ser, protocol=config.SERIAL_PROTOCOL):
+        super().__init__(ser, protocol)
+        self.gate_open = None
+        self.alert = ALERT_NONE
+        self.sample_millis = None  # board clock of the newest distance sample
+        self.pending = {}  # seq -> command not acknowledged yet
+
+    def read_distance(self):
+        try:
+            return self._read_binary() if self.binary else self._read_text()
+        except OSError as e:  # serial.SerialException is an OSError
+            log.error('SERIAL', f"Serial read failed: {e}")
+            return None
+
+    def _read_binary(self):
+        distance = None
+        for frame in self._frames():
+            try:
+                if frame.type == DISTANCE:
+                    self.sample_millis, distance = distance_cm(frame)
+                elif frame.type == GATE_STATUS:
+                    self.gate_open, self.alert = gate_status(frame)
+                elif frame.type == ACK and len(frame.payload) == 2:
+                    command = self.pending.pop(frame.payload[0], None)
+                    if frame.payload[1]:
+                        log.warning('ARDUINO', f"Rejected command {command!r}", command=command)
+                else:
+                    self._log(frame)
+            except ProtocolError as e:
+                log.error('SERIAL', str(e))
+        return distance
+
+    def _read_text(self):
+        distance = None
+        for line in self._lines():
+            if line.startswith("DIST:"):
+                try:
+                    distance = float(line[5:])
+                except ValueError:
+                    log.error('SERIAL', f"Could not convert '{line[5:]}' to float.")
+            elif line.startswith("MSG:"):
+                log.info('ARDUINO MSG', line[4:])
+        return distance
+
+    def write(self, data):
+        """Sends gate commands; `data` is the command characters, e.g. b'1'."""
+        if not self.binary:
+            return self.ser.write(data)
+        for command in data.strip():
+            self.pending[self._send(COMMAND, bytes([command]))] = chr(command)
+        if len(self.pending) > 16:
+            # The board never answered these (reset, or an older sketch): stop tracking them
+            self.pending.clear()
+        return len(data)
+
+
+class PaymentLink(_Link):
+    """
+    The payment reader's serial link, seen by PaymentStation as the lines of the
+    old text protocol ("plate,balance", "READY", "DONE", "[TIMEOUT]"), so the
+    payment state machine is the same for both protocols.
+    """
+
+    def read_lines(self):
+        if not self.binary:
+            return self._lines()
+        lines = []
+        for frame in self._frames():
+            try:
+                if frame.type == CARD:
+                    plate, balance = card(frame)
+                    lines.append(f"{plate},{balance}")
+                elif frame.type == READY:
+                    lines.append("READY")
+                elif frame.type == DONE:
+                    lines.append("DONE")
+                elif frame.type == TIMEOUT:
+                    lines.append("[TIMEOUT] Reader gave up waiting for the PC")
+                else:
+                    self._log(frame)
+            except ProtocolError as e:
+                log.error('SERIAL', str(e))
+        return lines
+
+    def send(self, reply):
+        """Answers the reader: 'I', 'A', 'N', or the new card balance as an int."""
+        if self.binary:
+            self._send(REPLY, reply_payload(reply))
+        else:
+            self.ser.write(f"{reply}\r\n".encode())
@@ -0,0 +1,262 @@
+"""
+Closes or flags parking sessions that will never close by themselves.
+
+A session the entry gate opened but nobody ever paid for - an entry misread
+that never matched at the exit, a car that slipped out behind another, a
+session opened twice - stays "in parking" forever: every later
+is_car_already_in_parking check for that plate refuses the car, and every
+look at the cars inside has to step over it. SessionSweeper runs every
+SWEEP_INTERVAL seconds in the dashboard and applies these rules to the
+unpaid sessions (store.unpaid_sessions()), first match wins:
+
+    superseded      open, but the plate has a newer session since      SWEEP_SUPERSEDED
+    bad_entry_time  open with an unreadable entry_time, or one more    SWEEP_BAD_ENTRY_TIME
+                    than SWEEP_FUTURE_TOLERANCE s in the future
+    abandoned       open for more than SWEEP_MAX_OPEN_HOURS            SWEEP_ABANDONED
+    unpaid_fare     priced (exit_time set) but never paid, more than   SWEEP_UNPAID_FARE
+                    SWEEP_MAX_OPEN_HOURS ago
+
+Each rule's setting says what happens to its sessions: 'close' sets
+payment_status to CLOSED_STATUS ('2') and, if it is empty, exit_time to the
+sweep time, all in one store update; 'flag' only raises an alert (once per
+session); 'off' skips the rule. Every close and flag is also logged as an
+attempt (SESSION_CLOSED / SESSION_FLAGGED, with the rule's reason), so it
+shows among the dashboard's alerts. A closed session can no longer be paid
+for or let out, so only 'superseded' closes by default: a car open for more
+than SWEEP_MAX_OPEN_HOURS may simply still be parked, and is flagged for
+the operator instead.
+
+Closed sessions leave the set of unpaid sessions the gates, the fuzzy plate
+index and the sweeper itself look through. With SQLite that set is a
+partial index; with CSV every sweep then compacts testdb.csv, moving the
+sessions settled (paid or closed) more than SWEEP_ARCHIVE_AFTER_HOURS ago
+to testdb.archive.csv (store.compact()), so what the gates parse stays as
+large as the car park's real occupancy instead of growing with the history.
+
+    python session_sweeper.py --dry-run      # list what would be closed or flagged
+    python session_sweeper.py                # sweep once
+    python session_sweeper.py --every 3600   # keep sweeping
+"""
+import argparse
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import config
+from event_log import get_logger, setup_logging
+from storage import CLOSED_STATUS, TIME_FORMAT
+
+log = get_logger('sweeper')
+
+CLOSE, FLAG, OFF = 'close', 'flag', 'off'
+RULES = ('superseded', 'bad_entry_time', 'abandoned', 'unpaid_fare')
+_FLAGGED = re.compile(r'^Session (\d+)\b')  # the session `no` in a SESSION_FLAGGED attempt's details
+
+
+def default_actions():
+    return {'superseded': config.SWEEP_SUPERSEDED, 'bad_entry_time': config.SWEEP_BAD_ENTRY_TIME,
+            'abandoned': config.SWEEP_ABANDONED, 'unpaid_fare': config.SWEEP_UNPAID_FARE}
+
+
+class Finding:
+    """An unpaid session one of the rules matched."""
+
+    def __init__(self, session, rule, reason, details=''):
+        self.session = session
+        self.rule = rule
+        self.reason = reason
+        self.details = f"Session {session['no']}, entered {session.get('entry_time') or '?'}{details}"
+
+    @property
+    def no(self):
+        return self.session['no']
+
+    @property
+    def plate(self):
+        return (self.session.get('car_plate') or '').strip()
+
+    @property
+    def open(self):
+        return not self.session.get('exit_time')
+
+    def __repr__(self):
+        return f"Finding({self.rule}, no={self.no}, plate={self.plate!r}, reason={self.reason!r})"
+
+
+def _readable(text):
+    try:
+        datetime.strptime(text, TIME_FORMAT)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class SessionSweeper:
+    """Finds stale and anomalous unpaid sessions in a store and closes or flags them."""
+
+    def __init__(self, store, interval=config.SWEEP_INTERVAL, max_open_hours=config.SWEEP_MAX_OPEN_HOURS,
+                 future_tolerance=config.SWEEP_FUTURE_TOLERANCE, actions=None, on_close=None,
+                 archive_after_hours=config.SWEEP_ARCHIVE_AFTER_HOURS):
+        self.store = store
+        self.interval = interval
+        self.max_open_hours = max_open_hours
+        self.archive_after_hours = archive_after_hours
+        self.future_tolerance = future_tolerance
+        self.actions = dict(default_actions(), **(actions or {}))
+        for rule, action in self.actions.items():
+            if rule not in RULES or action not in (CLOSE, FLAG, OFF):
+                raise ValueError(f"Sweep rule '{rule}': unknown rule or action '{action}' "
+                                 f"(expected {', '.join(RULES)} with close, flag or off)")
+        self.on_close = on_close  # on_close(no, **fields) for every closed session, e.g. PlateSearchIndex.update_session
+        self.flagged = None  # session nos already flagged; read from the attempts log by the first sweep
+        self.lock = threading.Lock()
+        self.last_report = None
+
+    # --- Rules ---
+    def _match(self, session, abandoned_before, future_after):
+        """(rule, reason, details) of the first enabled rule `session` breaks, or None."""
+        entry = session.get('entry_time') or ''
+        if session.get('exit_time'):
+            if self.actions['unpaid_fare'] != OFF and session['exit_time'] < abandoned_before:
+                return 'unpaid_fare', "Fare recorded but never paid", f", priced {session['exit_time']}"
+            return None
+        checks = (
+            ('superseded', session.get('newest') not in (None, '', session['no']),
+             "Plate entered again since", f", plate entered again in session {session.get('newest')}"),
+            ('bad_entry_time', not _readable(entry), "Unreadable entry time", ''),
+            ('bad_entry_time', entry > future_after, "Entry time in the future", ''),
+            ('abandoned', entry < abandoned_before, f"Open for more than {self.max_open_hours:g} h", ''),
+        )
+        for rule, broken, reason, details in checks:
+            if broken and self.actions[rule] != OFF:
+                return rule, reason, details
+        return None
+
+    def find(self, now=None):
+        """Returns (findings, unpaid sessions looked at) without changing anything."""
+        now = now or datetime.now()
+        abandoned_before = (now - timedelta(hours=self.max_open_hours)).strftime(TIME_FORMAT)
+        future_after = (now + timedelta(seconds=self.future_tolerance)).strftime(TIME_FORMAT)
+        unpaid = self.store.unpaid_sessions()
+        findings = []
+        for session in unpaid:
+            match = self._match(session, abandoned_before, future_after)
+            if match:
+                findings.append(Finding(session, *match))
+        return findings, unpaid
+
+    # --- Sweeping ---
+    def _already_flagged(self):
+        if self.flagged is None:
+            self.flagged = set()
+            for attempt in self.store.attempts():
+                if attempt.get('attempt_type') == 'SESSION_FLAGGED':
+                    match = _FLAGGED.match(attempt.get('details') or '')
+                    if match:
+                        self.flagged.add(match.group(1))
+        return self.flagged
+
+    def _close(self, findings, stamp):
+        """Closes the findings' sessions that are still unpaid; returns the set of `no`s closed."""
+        # Only sessions still unpaid are touched: a payment that lands meanwhile wins
+        opened = {f.no: {'payment_status': CLOSED_STATUS, 'exit_time': stamp} for f in findings if f.open}
+        priced = {f.no: {'payment_status': CLOSED_STATUS} for f in findings if not f.open}
+        closed = set()
+        if opened:
+            closed.update(self.store.update_sessions(opened, only_if={'payment_status': '0', 'exit_time': ''}))
+        if priced:
+            closed.update(self.store.update_sessions(priced, only_if={'payment_status': '0'}))
+        for f in findings:
+            if f.no not in closed:
+                continue  # paid (or closed elsewhere) since find(): nothing to report
+            self.store.log_attempt(f.plate, 'SESSION_CLOSED', f.reason, f.details)
+            log.debug('SWEEP', f"Closed session {f.no} ({f.plate}): {f.reason}", no=f.no, plate=f.plate, rule=f.rule)
+            if self.on_close:
+                self.on_close(f.no, payment_status=CLOSED_STATUS, **({'exit_time': stamp} if f.open else {}))
+        return closed
+
+    def sweep(self, apply=True, now=None):
+        """
+        Applies the rules once, then compacts the store. Returns a report: {'unpaid', 'open_before',
+        'open_after', 'closed', 'flagged', 'archived', 'rules': {rule: findings}, 'seconds', 'findings'}.
+        """
+        started = time.monotonic()
+        now = now or datetime.now()
+        with self.lock:
+            findings, unpaid = self.find(now)
+            to_close = [f for f in findings if self.actions[f.rule] == CLOSE]
+            to_flag = [f for f in findings if self.actions[f.rule] == FLAG]
+            closed_nos, flagged, archived = set(), 0, 0
+            if apply:
+                if to_close:
+                    closed_nos = self._close(to_close, now.strftime(TIME_FORMAT))
+                seen = self._already_flagged()
+                for f in to_flag:
+                    if f.no not in seen:
+                        self.store.log_attempt(f.plate, 'SESSION_FLAGGED', f.reason, f.details)
+                        seen.add(f.no)
+                        flagged += 1
+                if self.archive_after_hours:
+                    archived = self.store.compact(
+                        (now - timedelta(hours=self.archive_after_hours)).strftime(TIME_FORMAT))
+            open_before = sum(1 for session in unpaid if not session.get('exit_time'))
+            closed = len(closed_nos)
+            report = {'unpaid': len(unpaid), 'open_before': open_before,
+                      'open_after': open_before - sum(1 for f in to_close if f.open and f.no in closed_nos),
+                      'closed': closed, 'flagged': flagged, 'archived': archived, 'rules': dict(Counter(f.rule for f in findings)),
+                      'seconds': round(time.monotonic() - started, 3), 'findings': findings}
+            if apply:
+                self.last_report = report
+        if apply and (closed or flagged or archived):
+            log.info('SWEEP', f"Closed {closed} and flagged {flagged} stale sessions, archived {archived}; "
+                     f"open sessions {report['open_before']} -> {report['open_after']} ({report['seconds']:.2f}s).",
+                     closed=closed, flagged=flagged, archived=archived, open_before=report['open_before'],
+                     open_after=report['open_after'], rules=report['rules'])
+        return report
+
+    def start(self):
+        """Sweeps in the background now and every `interval` seconds. Returns False with the interval 0."""
+        if not self.interval:
+            return False
+
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except Exception:
+                    log.exception('SWEEP', "Sweep failed; trying again next interval.")
+                time.sleep(self.interval)
+
+        threading.Thread(target=run, name='session-sweeper', daemon=True).start()
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Close or flag stale and anomalous parking sessions.")
+    parser.add_argument('--dry-run', action='store_true', help="Only list what the rules find")
+    parser.add_argument('--every', type=float, help="Keep sweeping every this many seconds")
+    args = parser.parse_args()
+
+    from storage import open_store
+    setup_logging('sweeper')
+    sweeper = SessionSweeper(open_store(), interval=args.every or 0)
+    report = sweeper.sweep(apply=not args.dry_run)
+    for f in report['findings']:
+        print(f"{f.rule:15s} {sweeper.actions[f.rule]:6s} {f.plate:10s} {f.details}: {f.reason}")
+    print(f"[SWEEP] {report['unpaid']} unpaid sessions, {len(report['findings'])} found {report['rules']}; "
+          f"closed {report['closed']}, flagged {report['flagged']}, archived {report['archived']}; open sessions "
+          f"{report['open_before']} -> {report['open_after']} in {report['seconds']:.2f}s"
+          + (" (dry run)" if args.dry_run else ""))
+    if args.every:
+        try:
+            while True:
+                time.sleep(args.every)
+                sweeper.sweep()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""
+Crash-safe storage for parking sessions (testdb.csv) and unauthorized
+attempts (unauthorized_attempts_log.csv).
+
+The entry gate, exit gate, payment station and dashboard all touch the same
+files from separate processes, so every access goes through an advisory lock
+held on a sidecar `<file>.lock` (the data file itself is swapped out on every
+rewrite, so it cannot carry the lock):
+
+- appends take the exclusive lock for one single write() of the whole row;
+- rewrites (payment updates) take the exclusive lock, re-read the current
+  rows, write them to a temp file, fsync it and rename it over the original,
+  so a crash leaves either the old or the new file, never a torn one;
+- readers take the shared lock only while opening the file and taking its
+  size, then parse that snapshot unlocked. A reader waits for at most one
+  append and never holds a writer up while it parses.
+
+Sessions settled long ago (paid and gone, or closed by the sweeper) are moved
+from testdb.csv to testdb.archive.csv by CsvStore.compact(), which the
+session sweeper runs. The gates' lookups only read testdb.csv, so what they
+parse stays about as large as the car park's occupancy; sessions() reads
+both files, so the dashboard, the exports and the search still see the whole
+history.
+"""
+import csv
+import heapq
+import io
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows gate PCs
+    fcntl = None
+    import msvcrt
+
+SESSION_FIELDS = ['no', 'entry_time', 'exit_time', 'car_plate', 'due_payment', 'payment_status']
+ATTEMPT_FIELDS = ['timestamp', 'car_plate', 'attempt_type', 'reason', 'details']
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+CLOSED_STATUS = '2'  # payment_status of a session closed unpaid by the sweeper (see session_sweeper.py)
+
+_TAIL_CHUNK = 4096  # bytes read from the end of the file to find the last row
+_REPLACE_RETRIES = 20  # Windows refuses to replace a file a reader still has open
+
+
+# ===== Locking =====
+@contextmanager
+def file_lock(path, shared=False):
+    """
+    Holds the advisory lock for `path`, shared for readers and exclusive for writers.
+    Windows has no shared mode, so there every lock is exclusive.
+    """
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd)
+
+
+# ===== Low-level CSV helpers =====
+def _encode_row(values):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator='\n').writerow(values)
+    return buf.getvalue()
+
+
+def _snapshot_lines(f, size):
+    """Yields the complete lines in the first `size` bytes of `f`; a torn last line is dropped."""
+    remaining = size
+    while remaining > 0:
+        line = f.readline(remaining)
+        if not line or not line.endswith(b'\n'):
+            break
+        remaining -= len(line)
+        yield line.decode('utf-8', errors='replace')
+
+
+def _open_snapshot(path):
+    """(open file, size) of `path`, taken under the shared lock; None if there is no such file."""
+    with file_lock(path, shared=True):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        return f, os.fstat(f.fileno()).st_size
+
+
+def _snapshot_rows(snapshot):
+    """Yields the rows of an _open_snapshot() as dicts, then closes it."""
+    if snapshot is None:
+        return
+    f, size = snapshot
+    with f:
+        yield from csv.DictReader(_snapshot_lines(f, size))
+
+
+def iter_rows(path):
+    """Yields the rows of `path` as dicts, read from a consistent snapshot."""
+    yield from _snapshot_rows(_open_snapshot(path))
+
+
+def read_rows(path):
+    """Returns all rows of `path` as a list of dicts."""
+    return list(iter_rows(path))
+
+
+def _append_locked(path, header, *rows):
+    """Appends `rows` (lists of values) with a single write(). The caller must hold the exclusive lock."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        data = ''.join(_encode_row(values) for values in rows)
+        size = os.fstat(fd).st_size
+        if size == 0:
+            data = _encode_row(header) + data
+        else:
+            os.lseek(fd, size - 1, os.SEEK_SET)
+            if os.read(fd, 1) != b'\n':
+                data = '\n' + data  # a previous writer crashed mid-row; start on a fresh line
+        os.write(fd, data.encode('utf-8'))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def append_row(path, header, values):
+    """Appends one row to `path`, writing `header` first if the file is new or empty."""
+    with file_lock(path):
+        _append_locked(path, header, values)
+
+
+def _tail(path):
+    """
+    Returns (the last complete row of `path` as a list of values or None, the torn
+    row a crashed writer left after it as text, '' if there is none).
+    """
+    try:
+        with open(path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            start = max(0, size - _TAIL_CHUNK)
+            f.seek(start)
+            parts = f.read().split(b'\n')
+    except FileNotFoundError:
+        return None, ''
+    torn = parts.pop().decode('utf-8', errors='replace')  # after the last newline
+    if start:
+        parts = parts[1:]  # the chunk starts mid-line
+    lines = [line for line in parts if line.strip()]
+    if not lines or (len(lines) < 2 and not start):
+        return None, torn  # only the header (or nothing) is there
+    return next(csv.reader([lines[-1].decode('utf-8', errors='replace')])), torn
+
+
+def _max_no(path):
+    """
+    The largest numeric `no` among the complete rows of `path` (0 if none). Reads
+    without taking the lock, so it can run while the caller holds it.
+    """
+    largest = 0
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            for row in csv.reader(_snapshot_lines(f, size)):
+                if row and row[0].strip().isdigit():
+                    largest = max(largest, int(row[0]))
+    except FileNotFoundError:
+        pass
+    return largest
+
+
+def _replace(src, dst):
+    for attempt in range(_REPLACE_RETRIES):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == _REPLACE_RETRIES - 1:
+                raise
+            time.sleep(0.05)
+
+
+def atomic_write(path, header, rows):
+    """Replaces `path` with `rows` (dicts) via temp file + fsync + rename."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=header, extrasaction='ignore', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        _replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if fcntl:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def rewrite_rows(path, header, transform):
+    """
+    Re-reads `path` under the exclusive lock, passes the rows to `transform` and
+    atomically replaces the file with the list it returns (None leaves the file
+    as it is). Rows appended by other processes before the lock was taken are
+    part of what `transform` sees.
+    """
+    with file_lock(path):
+        try:
+            # No append can be in flight here, so an unterminated last line is kept as is
+            with open(path, 'r', newline='', encoding='utf-8', errors='replace') as f:
+                rows = list(csv.DictReader(f))
+        except FileNotFoundError:
+            rows = []
+        rows = transform(rows)
+        if rows is not None:
+            atomic_write(path, header, rows)
+
+
+# ===== Session / attempt stores =====
+def _in_range(rows, field, start, end):
+    """Filters rows to start <= row[field] < end; TIME_FORMAT strings sort chronologically."""
+    if not start and not end:
+        return rows
+    return (row for row in rows
+            if (not start or (row.get(field) or '') >= start) and (not end or (row.get(field) or '') < end))
+
+
+def _no_key(row):
+    no = (row.get('no') or '').strip()
+    return int(no) if no.isdigit() else -1
+
+
+def _merge_sessions(archived, active):
+    """Merges two `no`-ordered row streams; a row in both (mid-compaction) is yielded once."""
+    last = None
+    for row in heapq.merge(archived, active, key=_no_key):
+        no = _no_key(row)
+        if no >= 0 and no == last:
+            continue
+        last = no
+        yield row
+
+
+def _settled_before(row, before):
+    """True for a session paid or closed with an exit_time before `before` (TIME_FORMAT)."""
+    exit_time = row.get('exit_time') or ''
+    return (_no_key(row) >= 0 and row.get('payment_status') in ('1', CLOSED_STATUS)
+            and exit_time != '' and exit_time < before)
+
+
+def open_store(backend=config.STORAGE_BACKEND, sessions_path=config.SESSIONS_CSV,
+               attempts_path=config.ATTEMPTS_CSV, db_path=config.SQLITE_PATH):
+    """Returns the configured store: CsvStore ('csv') or storage_sqlite.SqliteStore ('sqlite')."""
+    if backend == 'csv':
+        return CsvStore(sessions_path, attempts_path)
+    if backend == 'sqlite':
+        from storage_sqlite import SqliteStore
+        return SqliteStore(db_path)
+    raise ValueError(f"Unknown storage backend '{backend}' (expected 'csv' or 'sqlite')")
+
+
+class CsvStore:
+    """Parking sessions and unauthorized attempts kept in the two CSV files (and the sessions archive)."""
+
+    def __init__(self, sessions_path=config.SESSIONS_CSV, attempts_path=config.ATTEMPTS_CSV, archive_path=None):
+        self.sessions_path = sessions_path
+        self.attempts_path = attempts_path
+        # testdb.csv -> testdb.archive.csv, next to it
+        self.archive_path = archive_path or os.path.splitext(sessions_path)[0] + '.archive.csv'
+
+    def exists(self):
+        """True once the sessions file has been created."""
+        return os.path.exists(self.sessions_path)
+
+    def version(self):
+        """Changes whenever either file is written; cheap enough to call per request (two stat calls)."""
+        stamps = []
+        for path in (self.sessions_path, self.attempts_path):
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    # --- Sessions ---
+    def sessions(self, start=None, end=None):
+        """
+        Yields sessions oldest first, archived ones included, optionally only those with
+        start <= entry_time < end.
+        """
+        # Active file first: compact() adds rows to the archive before it drops them from the
+        # active file, so the two snapshots cannot both miss a row
+        active = _open_snapshot(self.sessions_path)
+        archived = _open_snapshot(self.archive_path)
+        rows = _merge_sessions(_snapshot_rows(archived), _snapshot_rows(active))
+        return _in_range(rows, 'entry_time', start, end)
+
+    def _active(self):
+        """The sessions not archived yet: every unsettled one, and the recently settled."""
+        return iter_rows(self.sessions_path)
+
+    def _latest(self, plate, predicate=None):
+        latest = None
+        for row in self._active():
+            if (row.get('car_plate') or '').strip() == plate and (predicate is None or predicate(row)):
+                latest = row
+        return latest
+
+    def latest_session(self, plate):
+        """Returns the most recent session for `plate`, or None."""
+        return self._latest(plate)
+
+    def latest_unpaid_session(self, plate):
+        """Returns the most recent session for `plate` with payment_status 0, or None."""
+        return self._latest(plate, lambda row: (row.get('payment_status') or '').strip() == '0')
+
+    def is_parked(self, plate):
+        """
+        True if the latest open (unpaid, no exit) or closed (paid, exited) session for
+        `plate` is the open one.
+        """
+        def settled(row):
+            status, exit_time = row.get('payment_status'), row.get('exit_time')
+            return (status == '0' and exit_time == '') or (status == '1' and exit_time not in ('', None))
+
+        latest = self._latest(plate, settled)
+        return latest is not None and latest['payment_status'] == '0'
+
+    def parked_sessions(self, paid_since):
+        """Yields the sessions of cars still in the car park: unpaid with no exit, or paid at/after `paid_since`."""
+        for row in self._active():
+            status, exit_time = row.get('payment_status'), row.get('exit_time') or ''
+            if (status == '0' and exit_time == '') or (status == '1' and exit_time >= paid_since):
+                yield row
+
+    def unpaid_sessions(self):
+        """
+        Returns the sessions with payment_status 0 (open, or priced but never paid), oldest
+        first, each with 'newest': the `no` of the latest session of its plate.
+        """
+        unpaid, newest = [], {}
+        for row in self._active():
+            plate = (row.get('car_plate') or '').strip()
+            if plate in newest or row.get('payment_status') == '0':
+                newest[plate] = row['no']  # only tracked for plates with an unpaid session so far
+            if row.get('payment_status') == '0':
+                unpaid.append(row)
+        for row in unpaid:
+            row['newest'] = newest[(row.get('car_plate') or '').strip()]
+        return unpaid
+
+    def add_session(self, plate, entry_time):
+        """Opens a new unpaid session for `plate` and returns its `no`."""
+        with file_lock(self.sessions_path):
+            last, torn = _tail(self.sessions_path)
+            try:
+                no = int(last[0]) + 1 if last else 1
+            except (ValueError, IndexError):
+                # iter_rows would wait for a shared lock behind the exclusive one held here
+                no = max(_max_no(self.sessions_path), _max_no(self.archive_path)) + 1
+            # A torn row whose `no` was written in full stays in the file: never hand that number out again
+            torn_no = torn.split(',', 1)[0].strip() if ',' in torn else ''
+            if torn_no.isdigit():
+                no = max(no, int(torn_no) + 1)
+            _append_locked(self.sessions_path, SESSION_FIELDS,
+                           [no, entry_time.strftime(TIME_FORMAT), '', plate, '', 0])
+        return no
+
+    def update_session(self, no, **fields):
+        """Sets `fields` on session `no`. Returns False if there is no such session."""
+        found = []
+
+        def apply(rows):
+            for row in rows:
+                if row.get('no') == str(no):
+                    row.update({k: str(v) for k, v in fields.items()})
+                    found.append(row)
+            return rows
+
+        rewrite_rows(self.sessions_path, SESSION_FIELDS, apply)
+        return bool(found)
+
+    def update_sessions(self, changes, only_if=None):
+        """
+        Applies {no: {field: value}} in a single rewrite, skipping sessions whose current
+        values no longer match `only_if` ({field: value}). Returns the `no`s (str) updated.
+        """
+        changes = {str(no): fields for no, fields in changes.items()}
+        only_if = {k: str(v) for k, v in (only_if or {}).items()}
+        updated = []
+
+        def apply(rows):
+            for row in rows:
+                fields = changes.get(row.get('no'))
+                if fields and all((row.get(k) or '') == v for k, v in only_if.items()):
+                    row.update({k: str(v) for k, v in fields.items()})
+                    updated.append(row['no'])
+            return rows
+
+        rewrite_rows(self.sessions_path, SESSION_FIELDS, apply)
+        return updated
+
+    def compact(self, settled_before):
+        """
+        Moves the sessions settled (paid, or closed by the sweeper) with an exit_time
+        before `settled_before` (TIME_FORMAT) to the archive. The newest session stays,
+        so numbering carries on. Returns how many were moved.
+        """
+        moved = []
+
+        def split(rows):
+            keep = []
+            for i, row in enumerate(rows):
+                (moved if i < len(rows) - 1 and _settled_before(row, settled_before) else keep).append(row)
+            if not moved:
+                return None
+            self._archive(moved)  # before they leave the active file, so no reader misses them
+            return keep
+
+        rewrite_rows(self.sessions_path, SESSION_FIELDS, split)
+        return len(moved)
+
+    def _archive(self, rows):
+        """Adds `rows` to the archive, keeping it in `no` order. Called with the sessions lock held."""
+        rows = sorted(rows, key=_no_key)
+        with file_lock(self.archive_path):
+            last, _ = _tail(self.archive_path)
+            if last is None or (last[0].strip().isdigit() and int(last[0]) < _no_key(rows[0])):
+                _append_locked(self.archive_path, SESSION_FIELDS,
+                               *([row.get(field, '') for field in SESSION_FIELDS] for row in rows))
+                return
+
+            # An older session settled late (closed by the sweeper): merge it in. Read without
+            # the shared lock, which would wait behind the exclusive one held here
+            def archived():
+                with open(self.archive_path, 'r', newline='', encoding='utf-8', errors='replace') as f:
+                    yield from csv.DictReader(f)
+            atomic_write(self.archive_path, SESSION_FIELDS, _merge_sessions(archived(), rows))
+
+    # --- Unauthorized attempts ---
+    def attempts(self, start=None, end=None):
+        """Yields logged unauthorized attempts oldest first, optionally limited to [start, end)."""
+        return _in_range(iter_rows(self.attempts_path), 'timestamp', start, end)
+
+    def log_attempt(self, plate, attempt_type, reason, details="", timestamp=None):
+        """Appends one unauthorized attempt."""
+        timestamp = (timestamp or datetime.now()).strftime(TIME_FORMAT)
+        append_row(self.attempts_path, ATTEMPT_FIELDS, [timestamp, plate, attempt_type, reason, details])
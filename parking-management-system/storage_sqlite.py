@@ -0,0 +1,301 @@
+"""
+SQLite backend for parking sessions and unauthorized attempts.
+
+Same interface as storage.CsvStore, selected with PMS_STORAGE=sqlite. The
+database runs in WAL mode so the dashboard can read while the gates and the
+payment station write, and every gate lookup is an indexed query instead of
+a full-file parse:
+
+- (car_plate, payment_status, exit_time) serves is_parked / latest_session /
+  latest_unpaid_session;
+- entry_time serves the dashboard's date-range queries;
+- (payment_status, exit_time) serves parked_sessions for the fuzzy plate index;
+- a partial index over the unpaid sessions alone serves the stale-session
+  sweeper; it holds only the cars inside (and whatever the sweeper has not
+  closed yet), however long the history grows.
+
+Each process keeps one connection per database file. The SQL below is kept
+as fixed strings so sqlite3's statement cache reuses the prepared statements.
+
+To move an existing installation over:
+
+    python storage_sqlite.py import --db parking.db --sessions testdb.csv --attempts unauthorized_attempts_log.csv
+"""
+import argparse
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import config
+from storage import SESSION_FIELDS, ATTEMPT_FIELDS, TIME_FORMAT, CsvStore, iter_rows
+
+_FETCH_SIZE = 500  # rows fetched per lock hold while streaming a result set
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    no             INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry_time     TEXT NOT NULL,
+    exit_time      TEXT NOT NULL DEFAULT '',
+    car_plate      TEXT NOT NULL,
+    due_payment    TEXT NOT NULL DEFAULT '',
+    payment_status TEXT NOT NULL DEFAULT '0'
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_plate_status_exit ON sessions (car_plate, payment_status, exit_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_entry_time ON sessions (entry_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_status_exit ON sessions (payment_status, exit_time);
+CREATE INDEX IF NOT EXISTS idx_sessions_unpaid ON sessions (no) WHERE payment_status = '0';
+
+CREATE TABLE IF NOT EXISTS attempts (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp    TEXT NOT NULL,
+    car_plate    TEXT NOT NULL,
+    attempt_type TEXT NOT NULL,
+    reason       TEXT NOT NULL,
+    details      TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_timestamp ON attempts (timestamp);
+"""
+
+_SESSION_COLUMNS = ', '.join(SESSION_FIELDS)
+_ATTEMPT_COLUMNS = ', '.join(ATTEMPT_FIELDS)
+
+_SQL_LATEST = f"SELECT {_SESSION_COLUMNS} FROM sessions WHERE car_plate = ? ORDER BY no DESC LIMIT 1"
+_SQL_LATEST_UNPAID = (f"SELECT {_SESSION_COLUMNS} FROM sessions "
+                      "WHERE car_plate = ? AND payment_status = '0' ORDER BY no DESC LIMIT 1")
+_SQL_LATEST_SETTLED = (f"SELECT {_SESSION_COLUMNS} FROM sessions "
+                       "WHERE car_plate = ? AND ((payment_status = '0' AND exit_time = '') "
+                       "OR (payment_status = '1' AND exit_time <> '')) ORDER BY no DESC LIMIT 1")
+_SQL_PARKED = (f"SELECT {_SESSION_COLUMNS} FROM sessions "
+               "WHERE (payment_status = '0' AND exit_time = '') OR (payment_status = '1' AND exit_time >= ?) "
+               "ORDER BY no")
+_SQL_UNPAID = (f"SELECT {_SESSION_COLUMNS}, "
+               "(SELECT MAX(newer.no) FROM sessions newer WHERE newer.car_plate = sessions.car_plate) "
+               "FROM sessions INDEXED BY idx_sessions_unpaid WHERE payment_status = '0' ORDER BY no")
+_SQL_INSERT_SESSION = "INSERT INTO sessions (entry_time, car_plate) VALUES (?, ?)"
+_SQL_INSERT_ATTEMPT = f"INSERT INTO attempts ({_ATTEMPT_COLUMNS}) VALUES (?, ?, ?, ?, ?)"
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(db_path):
+    """
+    Returns (connection, lock) for this process's connection to `db_path`, opening it
+    in WAL mode on first use. The connection is shared by every thread in the process,
+    so calls on it must hold the lock.
+    """
+    key = (os.path.abspath(db_path), os.getpid())
+    with _connections_lock:
+        entry = _connections.get(key)
+        if entry is None:
+            conn = sqlite3.connect(db_path, timeout=5.0, isolation_level=None,
+                                   check_same_thread=False, cached_statements=128)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            entry = _connections[key] = (conn, threading.Lock())
+        return entry
+
+
+def _as_row(fields, values):
+    """Returns a CSV-shaped dict (all values as strings) so callers do not care which backend is in use."""
+    return {field: '' if value is None else str(value) for field, value in zip(fields, values)}
+
+
+class SqliteStore:
+    """Parking sessions and unauthorized attempts kept in one SQLite database."""
+
+    def __init__(self, db_path=config.SQLITE_PATH):
+        self.db_path = db_path
+        self._conn, self._lock = get_connection(db_path)
+
+    def _one(self, sql, params):
+        with self._lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return _as_row(SESSION_FIELDS, row) if row else None
+
+    def _stream(self, sql, params, fields):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+        while True:
+            with self._lock:
+                batch = cursor.fetchmany(_FETCH_SIZE)
+            if not batch:
+                return
+            for values in batch:
+                yield _as_row(fields, values)
+
+    def exists(self):
+        """Always True: the schema is created when the connection is opened."""
+        return True
+
+    def version(self):
+        """Changes whenever any process (data_version) or this one (total_changes) writes the database."""
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0], self._conn.total_changes
+
+    # --- Sessions ---
+    def sessions(self, start=None, end=None):
+        """Yields sessions oldest first, optionally only those with start <= entry_time < end."""
+        clauses, params = [], []
+        if start:
+            clauses.append("entry_time >= ?")
+            params.append(start)
+        if end:
+            clauses.append("entry_time < ?")
+            params.append(end)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "entry_time, no" if clauses else "no"
+        return self._stream(f"SELECT {_SESSION_COLUMNS} FROM sessions{where} ORDER BY {order}",
+                            params, SESSION_FIELDS)
+
+    def latest_session(self, plate):
+        """Returns the most recent session for `plate`, or None."""
+        return self._one(_SQL_LATEST, (plate,))
+
+    def latest_unpaid_session(self, plate):
+        """Returns the most recent session for `plate` with payment_status 0, or None."""
+        return self._one(_SQL_LATEST_UNPAID, (plate,))
+
+    def is_parked(self, plate):
+        """
+        True if the latest open (unpaid, no exit) or closed (paid, exited) session for
+        `plate` is the open one.
+        """
+        latest = self._one(_SQL_LATEST_SETTLED, (plate,))
+        return latest is not None and latest['payment_status'] == '0'
+
+    def parked_sessions(self, paid_since):
+        """Yields the sessions of cars still in the car park: unpaid with no exit, or paid at/after `paid_since`."""
+        return self._stream(_SQL_PARKED, (paid_since,), SESSION_FIELDS)
+
+    def unpaid_sessions(self):
+        """
+        Returns the sessions with payment_status 0 (open, or priced but never paid), oldest
+        first, each with 'newest': the `no` of the latest session of its plate.
+        """
+        return list(self._stream(_SQL_UNPAID, (), SESSION_FIELDS + ['newest']))
+
+    def add_session(self, plate, entry_time):
+        """Opens a new unpaid session for `plate` and returns its `no`."""
+        with self._lock:
+            return self._conn.execute(_SQL_INSERT_SESSION, (entry_time.strftime(TIME_FORMAT), plate)).lastrowid
+
+    def update_session(self, no, **fields):
+        """Sets `fields` on session `no`. Returns False if there is no such session."""
+        unknown = set(fields) - set(SESSION_FIELDS[1:])
+        if unknown:
+            raise ValueError(f"Unknown session fields: {sorted(unknown)}")
+        if not fields:
+            return False
+        columns = sorted(fields)
+        sql = f"UPDATE sessions SET {', '.join(f'{c} = ?' for c in columns)} WHERE no = ?"
+        with self._lock:
+            cursor = self._conn.execute(sql, [str(fields[c]) for c in columns] + [int(no)])
+        return cursor.rowcount > 0
+
+    def update_sessions(self, changes, only_if=None):
+        """
+        Applies {no: {field: value}} in one transaction, skipping sessions whose current
+        values no longer match `only_if` ({field: value}). Returns the `no`s (str) updated.
+        """
+        only_if = only_if or {}
+        unknown = set(only_if) - set(SESSION_FIELDS[1:])
+        if unknown:
+            raise ValueError(f"Unknown session fields: {sorted(unknown)}")
+        conditions = sorted(only_if)
+        where = ''.join(f" AND {c} = ?" for c in conditions)
+        updated = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for no, fields in changes.items():
+                    unknown = set(fields) - set(SESSION_FIELDS[1:])
+                    if unknown:
+                        raise ValueError(f"Unknown session fields: {sorted(unknown)}")
+                    columns = sorted(fields)
+                    sql = f"UPDATE sessions SET {', '.join(f'{c} = ?' for c in columns)} WHERE no = ?{where}"
+                    params = [str(fields[c]) for c in columns] + [int(no)] + [str(only_if[c]) for c in conditions]
+                    if self._conn.execute(sql, params).rowcount:
+                        updated.append(str(no))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return updated
+
+    def compact(self, settled_before):
+        """
+        Nothing to move: the gate lookups are indexed and the sweeper reads the partial
+        index of unpaid sessions, so settled history costs them nothing. Returns 0.
+        """
+        return 0
+
+    # --- Unauthorized attempts ---
+    def attempts(self, start=None, end=None):
+        """Yields logged unauthorized attempts oldest first, optionally limited to [start, end)."""
+        clauses, params = [], []
+        if start:
+            clauses.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            clauses.append("timestamp < ?")
+            params.append(end)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._stream(f"SELECT {_ATTEMPT_COLUMNS} FROM attempts{where} ORDER BY id",
+                            params, ATTEMPT_FIELDS)
+
+    def log_attempt(self, plate, attempt_type, reason, details="", timestamp=None):
+        """Appends one unauthorized attempt."""
+        timestamp = (timestamp or datetime.now()).strftime(TIME_FORMAT)
+        with self._lock:
+            self._conn.execute(_SQL_INSERT_ATTEMPT, (timestamp, plate, attempt_type, reason, details or ''))
+
+    # --- Import ---
+    def import_csv(self, sessions_path=config.SESSIONS_CSV, attempts_path=config.ATTEMPTS_CSV):
+        """
+        Copies the CSV history into the database in one transaction, keeping each
+        session's `no`. Sessions already present (same `no`) are left alone, and
+        only attempts newer than the newest one in the database are added, so the
+        import can be re-run. Returns (sessions, attempts) imported.
+        """
+        sessions = [(int(row['no']), row['entry_time'], row.get('exit_time') or '', row['car_plate'],
+                     row.get('due_payment') or '', row.get('payment_status') or '0')
+                    for row in CsvStore(sessions_path, attempts_path).sessions()  # archived ones included
+                    if (row.get('no') or '').strip().isdigit()]
+        attempts = [tuple(row.get(field) or '' for field in ATTEMPT_FIELDS) for row in iter_rows(attempts_path)]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                newest = self._conn.execute("SELECT MAX(timestamp) FROM attempts").fetchone()[0]
+                if newest:
+                    attempts = [attempt for attempt in attempts if attempt[0] > newest]
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO sessions ({_SESSION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", sessions)
+                imported_sessions = self._conn.total_changes - before
+                self._conn.executemany(_SQL_INSERT_ATTEMPT, attempts)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return imported_sessions, len(attempts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite storage for the parking system.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    imp = sub.add_parser('import', help="Import testdb.csv and the unauthorized attempts log.")
+    imp.add_argument('--db', default=config.SQLITE_PATH)
+    imp.add_argument('--sessions', default=config.SESSIONS_CSV)
+    imp.add_argument('--attempts', default=config.ATTEMPTS_CSV)
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        sessions, attempts = SqliteStore(args.db).import_csv(args.sessions, args.attempts)
+        print(f"[IMPORT] {sessions} sessions and {attempts} unauthorized attempts imported into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,530 @@
 # app.py
-from flask import Flask, render_template, jsonify
-import csv
+from flask import Flask, render_template, jsonify, request, Response, abort
 from datetime import datetime
+import atexit
+import csv
+import gzip
+import hashlib
+import io
+import json
 import os # Import os for file existence check
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+# Shared modules (storage, config) live in the project root, two levels up
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import config
+from event_bus import CarEntered, EventSubscriber, PaymentCompleted
+from event_log import get_logger, setup_logging
+from plate_search import PlateSearchIndex
+from session_sweeper import SessionSweeper
+from storage import open_store, SESSION_FIELDS, ATTEMPT_FIELDS
 
 app = Flask(__name__)
+log = get_logger('dashboard')
 
-CSV_FILE = '../../testdb.csv'
-UNAUTHORIZED_ATTEMPTS_LOG_FILE = '../../unauthorized_attempts_log.csv' # NEW: Path to the new log file
+CSV_FILE = os.path.join('../..', config.SESSIONS_CSV) # testdb.csv unless PMS_SESSIONS_CSV says otherwise
+UNAUTHORIZED_ATTEMPTS_LOG_FILE = os.path.join('../..', config.ATTEMPTS_CSV) # NEW: Path to the new log file
+DB_FILE = os.path.join('../..', config.SQLITE_PATH) # Used when PMS_STORAGE=sqlite
+store = open_store(sessions_path=CSV_FILE, attempts_path=UNAUTHORIZED_ATTEMPTS_LOG_FILE, db_path=DB_FILE)
+PREVIEW_DIR = os.path.join('../..', config.PREVIEW_DIR) # Gates write <lane>.jpg here (see preview.py)
+PREVIEW_LANES = ('entry', 'exit')
+BUS_DIR = os.path.join('../..', config.BUS_DIR) # Gates and payment station publish here (see event_bus.py)
 
-def read_parking_data():
-    """Reads data from testdb.csv and returns a list of dictionaries."""
-    data = []
-    try:
-        with open(CSV_FILE, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                data.append(row)
-    except FileNotFoundError:
-        print(f"Error: {CSV_FILE} not found.")
-    return data
-
-def read_alerts_from_log_csv(): # Renamed function for clarity
-    """Reads unauthorized attempts from unauthorized_attempts_log.csv."""
+
+class PreviewFeed:
+    """
+    Latest preview JPEG of one lane, shared by every viewer. A single watcher thread
+    reads the file when the gate replaces it, so N viewers cost one read per frame
+    and no decoding or re-encoding at all.
+    """
+
+    def __init__(self, path, poll_interval):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.jpeg = None
+        self.seq = 0
+        self.changed = threading.Condition()
+        self._mtime = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name=f"preview-{os.path.basename(self.path)}",
+                                                daemon=True)
+                self._thread.start()
+
+    def _watch(self):
+        while True:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime != self._mtime:
+                    with open(self.path, 'rb') as f:
+                        jpeg = f.read()
+                    self._mtime = mtime
+                    with self.changed:
+                        self.jpeg, self.seq = jpeg, self.seq + 1
+                        self.changed.notify_all()
+            except OSError:
+                pass # Lane not running (no preview yet) or the file is being replaced
+            time.sleep(self.poll_interval)
+
+    def frames(self, timeout=10.0):
+        """Yields each new JPEG as it arrives; ends if the lane stops publishing for `timeout` seconds."""
+        self.start()
+        seen = 0 # seq 0 = nothing received yet
+        while True:
+            with self.changed:
+                if not self.changed.wait_for(lambda: self.seq != seen, timeout=timeout):
+                    return
+                jpeg, seen = self.jpeg, self.seq
+            yield jpeg
+
+
+preview_feeds = {lane: PreviewFeed(os.path.join(PREVIEW_DIR, f"{lane}.jpg"),
+                                   poll_interval=1.0 / (2 * config.PREVIEW_FPS) if config.PREVIEW_FPS > 0 else 1.0)
+                 for lane in PREVIEW_LANES}
+
+class EventFeed:
+    """
+    The latest bus events, shared by every /api/events client: one subscriber
+    fills the ring, and each client waits on the condition for what it has not seen.
+    """
+
+    def __init__(self, size=200):
+        self.ring = deque(maxlen=size) # (seq, event)
+        self.seq = 0
+        self.changed = threading.Condition()
+
+    def add(self, event):
+        with self.changed:
+            self.seq += 1
+            self.ring.append((self.seq, event))
+            self.changed.notify_all()
+
+    def events(self, last_seq=0, timeout=15.0):
+        """Yields (seq, event) after `last_seq` as they arrive, or (None, None) after `timeout` s of silence."""
+        while True:
+            with self.changed:
+                if not self.changed.wait_for(lambda: self.seq > last_seq, timeout=timeout):
+                    pending = [(None, None)]
+                else:
+                    pending = [(seq, event) for seq, event in self.ring if seq > last_seq]
+                    last_seq = self.seq
+            yield from pending
+
+
+event_feed = EventFeed()
+# Each open preview/event stream holds a server thread (3 per open page); past this many, new ones get a 503
+# so the API requests always have DASHBOARD_THREADS - DASHBOARD_MAX_STREAMS threads left
+stream_slots = threading.BoundedSemaphore(config.DASHBOARD_MAX_STREAMS)
+
+
+def streaming(body, mimetype, headers):
+    """Response for a long-lived stream, holding a stream slot until it is closed, or a 503 if none is free."""
+    if not stream_slots.acquire(blocking=False):
+        body.close()
+        log.warning('DASHBOARD', f"Stream refused: {config.DASHBOARD_MAX_STREAMS} streams already open.",
+                    path=request.path)
+        return Response("Too many open streams", status=503, mimetype='text/plain', headers={'Retry-After': '30'})
+    response = Response(body, mimetype=mimetype, headers=headers)
+    response.call_on_close(stream_slots.release)
+    return response
+bus_subscriber = EventSubscriber('dashboard', BUS_DIR)
+bus_subscriber.on(None, event_feed.add)
+# Operator search over the whole history, kept current from the same events (see plate_search.py)
+plate_search = PlateSearchIndex(store)
+bus_subscriber.on(CarEntered, plate_search.on_car_entered)
+bus_subscriber.on(PaymentCompleted, plate_search.on_payment_completed)
+# Closes or flags sessions that will never close by themselves, every SWEEP_INTERVAL s (see session_sweeper.py)
+session_sweeper = SessionSweeper(store, on_close=plate_search.update_session)
+
+
+def start_event_bus():
+    """Subscribes the dashboard to the bus."""
+    if config.BUS_ENABLED:
+        bus_subscriber.start()
+
+
+class ResponseCache:
+    """
+    Bodies of the polled JSON endpoints, rebuilt only when the store changes
+    (store.version()). Hundreds of dashboards polling unchanged data cost one
+    read, one encode and one gzip per change. A change is rebuilt on a
+    background thread while every request keeps getting the previous body,
+    so no poll waits for a read of the whole history; only the very first
+    request for a query does.
+    """
+
+    def __init__(self, version, size=config.DASHBOARD_CACHE_ENTRIES):
+        self.version = version
+        self.size = size
+        self.entries = OrderedDict() # key -> _CachedBody, least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """Returns (body, gzipped body) for `key`, calling build() for the data if it is out of date."""
+        version = self.version()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = _CachedBody()
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+            self.entries.move_to_end(key)
+        return entry.get(version, build)
+
+
+class _CachedBody:
+    def __init__(self):
+        self.current = None # (version, body, gzipped), replaced as a whole
+        self.building = threading.Lock()
+
+    def get(self, version, build):
+        current = self.current
+        if current and current[0] == version:
+            return current[1:]
+        if current:
+            if self.building.acquire(blocking=False):
+                threading.Thread(target=self._rebuild, args=(version, build), daemon=True).start()
+            return current[1:] # stale until the rebuild is done
+        with self.building:
+            if not self.current:
+                self._build(version, build)
+        return self.current[1:]
+
+    def _rebuild(self, version, build):
+        try:
+            self._build(version, build)
+        except Exception:
+            log.exception('DASHBOARD', "Could not rebuild a cached response")
+        finally:
+            self.building.release()
+
+    def _build(self, version, build):
+        body = json.dumps(build(), separators=(',', ':')).encode('utf-8')
+        self.current = (version, body, gzip.compress(body, 6))
+
+
+response_cache = ResponseCache(store.version)
+
+
+def cached_json(key, build):
+    """
+    A JSON response from the cache, gzipped if the client accepts that. No ETag on
+    purpose: waitress closes the connection after every 304, and a re-sent cached
+    body is cheaper than a new connection per poll.
+    """
+    body, gzipped = response_cache.get(key, build)
+    headers = {'Cache-Control': 'no-store', 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings and len(body) >= config.DASHBOARD_GZIP_MIN:
+        headers['Content-Encoding'] = 'gzip'
+        body = gzipped
+    return Response(body, mimetype='application/json', headers=headers)
+
+
+def _limit(rows, limit):
+    """The last `limit` rows (all of them if limit is None)."""
+    return list(rows) if limit is None else list(deque(rows, maxlen=limit))
+
+
+def read_parking_data(start=None, end=None):
+    """Reads parking sessions (optionally start <= entry_time < end) and returns a list of dictionaries."""
+    if not store.exists():
+        log.error('STORE', f"{CSV_FILE} not found.")
+        return []
+    return list(store.sessions(start, end))
+
+def read_alerts_from_log_csv(start=None, end=None): # Renamed function for clarity
+    """Reads unauthorized attempts (optionally start <= timestamp < end) from the attempts log."""
     alerts = []
     try:
-        if not os.path.exists(UNAUTHORIZED_ATTEMPTS_LOG_FILE):
-            print(f"Warning: {UNAUTHORIZED_ATTEMPTS_LOG_FILE} not found. No alerts will be displayed.")
+        if config.STORAGE_BACKEND == 'csv' and not os.path.exists(UNAUTHORIZED_ATTEMPTS_LOG_FILE):
+            log.warning('STORE', f"{UNAUTHORIZED_ATTEMPTS_LOG_FILE} not found. No alerts will be displayed.")
             return []
 
-        with open(UNAUTHORIZED_ATTEMPTS_LOG_FILE, 'r', newline='') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                # Ensure all expected fields exist
-                if all(k in row for k in ['timestamp', 'car_plate', 'attempt_type', 'reason', 'details']):
-                    alerts.append({
-                        'timestamp': row['timestamp'],
-                        'plate': row['car_plate'],
-                        'message': f"Type: {row['attempt_type']}, Reason: {row['reason']}. Details: {row['details']}",
-                        'type': row['attempt_type'] # This can be used for more specific styling in frontend
-                    })
-                else:
-                    print(f"Skipping malformed row in {UNAUTHORIZED_ATTEMPTS_LOG_FILE}: {row}")
+        for row in store.attempts(start, end):
+            # Ensure all expected fields exist
+            if all(row.get(k) is not None for k in ['timestamp', 'car_plate', 'attempt_type', 'reason', 'details']):
+                alerts.append({
+                    'timestamp': row['timestamp'],
+                    'plate': row['car_plate'],
+                    'message': f"Type: {row['attempt_type']}, Reason: {row['reason']}. Details: {row['details']}",
+                    'type': row['attempt_type'] # This can be used for more specific styling in frontend
+                })
+            else:
+                log.warning('STORE', f"Skipping malformed row in {UNAUTHORIZED_ATTEMPTS_LOG_FILE}: {row}")
 
     except FileNotFoundError: # This catch is technically redundant due to os.path.exists check, but harmless
-        print(f"Error: {UNAUTHORIZED_ATTEMPTS_LOG_FILE} not found. Cannot read alerts.")
+        log.error('STORE', f"{UNAUTHORIZED_ATTEMPTS_LOG_FILE} not found. Cannot read alerts.")
     except Exception as e:
-        print(f"An error occurred while reading alerts from CSV: {e}")
+        log.exception('STORE', f"An error occurred while reading alerts from CSV: {e}")
     return alerts
 
+# ===== Streaming export =====
+# kind -> (fields, store method, plate field)
+EXPORTS = {'sessions': (SESSION_FIELDS, 'sessions', 'car_plate'),
+           'attempts': (ATTEMPT_FIELDS, 'attempts', 'car_plate')}
+EXPORT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_CHUNK = 64 * 1024 # bytes - rows are encoded (and compressed) this much at a time
+
+
+def export_chunks(kind, fmt, start=None, end=None, plate=None, compress=False):
+    """
+    Yields the export as byte chunks, reading the store as it goes, so memory
+    stays at one chunk whatever the range. The same query over an unchanged
+    store yields the same bytes (gzip included: no timestamp in the header);
+    export_spool writes them to a file once so a download can resume at a
+    byte offset.
+    """
+    fields, method, plate_field = EXPORTS[kind]
+    plate = plate.strip().upper() if plate else None
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None # wbits 31: gzip framing
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fields, lineterminator='\n', extrasaction='ignore') if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    for row in getattr(store, method)(start, end):
+        if plate and plate not in (row.get(plate_field) or '').upper():
+            continue
+        if writer:
+            writer.writerow(row)
+        else:
+            buf.write(json.dumps({field: row.get(field, '') for field in fields}) + '\n')
+        if buf.tell() >= EXPORT_CHUNK:
+            data = buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+            data = gz.compress(data) if gz else data
+            if data:
+                yield data
+    data = buf.getvalue().encode('utf-8')
+    if gz:
+        data = gz.compress(data) + gz.flush()
+    if data:
+        yield data
+
+
+_export_spools = OrderedDict() # query -> (store version, spool path, length, etag)
+_export_lock = threading.Lock()
+_export_building = {} # query -> lock, so one query is only spooled once at a time
+_export_stale = [] # evicted spools Windows would not delete yet (still being downloaded)
+
+
+def _remove_spools(paths):
+    left = []
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            left.append(path) # Windows: a download still has it open; tried again on the next eviction
+    return left
+
+
+def export_spool(query):
+    """
+    (open file, length, etag) of the export written to a temporary spool file in one
+    pass over the store, so every response for it - Content-Length, ETag and each
+    resumed Range - comes from the same snapshot. Kept until the store changes
+    (at most DASHBOARD_EXPORT_SPOOLS queries).
+    """
+    with _export_lock:
+        building = _export_building.setdefault(query, threading.Lock())
+    with building:
+        version = store.version()
+        with _export_lock:
+            known = _export_spools.get(query)
+            if known and known[0] == version:
+                _export_spools.move_to_end(query)
+                # opened under the lock: an eviction cannot delete it before the download has it open
+                return open(known[1], 'rb'), known[2], known[3]
+        fd, path = tempfile.mkstemp(prefix='pms-export-', suffix='.part')
+        length, digest = 0, hashlib.blake2b(digest_size=12)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in export_chunks(*query):
+                    f.write(chunk)
+                    length += len(chunk)
+                    digest.update(chunk)
+        except BaseException:
+            _remove_spools([path])
+            raise
+        etag = digest.hexdigest()
+        with _export_lock:
+            evicted = [entry[1] for entry in [_export_spools.pop(query, None)] if entry]
+            _export_spools[query] = (version, path, length, etag)
+            while len(_export_spools) > config.DASHBOARD_EXPORT_SPOOLS:
+                old_query, entry = _export_spools.popitem(last=False)
+                _export_building.pop(old_query, None)
+                evicted.append(entry[1])
+            _export_stale[:] = _remove_spools(_export_stale + evicted)
+            return open(path, 'rb'), length, etag
+
+
+@atexit.register
+def _remove_export_spools():
+    _remove_spools([entry[1] for entry in _export_spools.values()] + _export_stale)
+
+
+def _read_range(f, first, stop):
+    """Yields bytes [first, stop) of the open spool `f` in EXPORT_CHUNK pieces, then closes it."""
+    with f:
+        f.seek(first)
+        remaining = stop - first
+        while remaining > 0:
+            data = f.read(min(EXPORT_CHUNK, remaining))
+            if not data:
+                return
+            remaining -= len(data)
+            yield data
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/parking_data')
 def get_parking_data():
-    data = read_parking_data()
-    return jsonify(data)
+    # Optional ?from=YYYY-MM-DD[ HH:MM:SS]&to=... range, served from the entry_time index on SQLite,
+    # and ?limit=N for only the newest N sessions
+    start, end = request.args.get('from'), request.args.get('to')
+    limit = request.args.get('limit', type=int)
+    return cached_json(('parking_data', start, end, limit), lambda: _limit(read_parking_data(start, end), limit))
 
 @app.route('/api/alerts')
 def get_alerts():
-    alerts = read_alerts_from_log_csv() # Call the new function
-    return jsonify(alerts)
+    start, end = request.args.get('from'), request.args.get('to')
+    limit = request.args.get('limit', type=int)
+    return cached_json(('alerts', start, end, limit),
+                       lambda: _limit(read_alerts_from_log_csv(start, end), limit)) # Call the new function
+
+@app.route('/api/export/<kind>.<fmt>')
+def export(kind, fmt):
+    # Whole history ranges as a download: ?from=&to= (entry_time / timestamp) and ?plate= (part of a plate).
+    # gzip if the client accepts it, and Range / If-Range so an interrupted download resumes where it stopped.
+    if kind not in EXPORTS or fmt not in EXPORT_TYPES:
+        abort(404)
+    compress = 'gzip' in request.accept_encodings
+    query = (kind, fmt, request.args.get('from'), request.args.get('to'), request.args.get('plate'), compress)
+    spool, length, etag = export_spool(query)
+    headers = {'ETag': f'"{etag}"', 'Accept-Ranges': 'bytes', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding',
+               'Content-Disposition': f'attachment; filename="{kind}.{fmt}"'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+
+    first, stop, status = 0, length, 200
+    ranges = request.range
+    if ranges and len(ranges.ranges) == 1 and ('If-Range' not in request.headers or request.if_range.etag == etag):
+        byte_range = ranges.range_for_length(length)
+        if byte_range is None:
+            spool.close()
+            return Response(status=416, headers={'Content-Range': f"bytes */{length}", 'ETag': f'"{etag}"'})
+        (first, stop), status = byte_range, 206
+        headers['Content-Range'] = f"bytes {first}-{stop - 1}/{length}"
+    headers['Content-Length'] = str(stop - first)
+
+    log.info('EXPORT', f"{kind}.{fmt} bytes {first}-{stop - 1} of {length}", kind=kind, fmt=fmt,
+             start=query[2], end=query[3], plate=query[4], first=first, length=length)
+    return Response(_read_range(spool, first, stop), status=status,
+                    mimetype=EXPORT_TYPES[fmt], headers=headers, direct_passthrough=True)
+
+@app.after_request
+def compress(response):
+    # Pages and other JSON are gzipped per response; the polled endpoints come gzipped from the cache
+    if (response.status_code == 200 and not response.is_streamed and 'Content-Encoding' not in response.headers
+            and (response.mimetype.startswith('text/') or response.mimetype == 'application/json')
+            and 'gzip' in request.accept_encodings and (response.content_length or 0) >= config.DASHBOARD_GZIP_MIN):
+        response.set_data(gzip.compress(response.get_data(), 6))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/api/search')
+def search_plates():
+    # ?q= partial or misread plate; optional ?from=&to= on entry_time, ?limit= matches, ?sessions= per match
+    if not plate_search.ready.wait(timeout=10):
+        return jsonify({'error': "Search index is still being built"}), 503, {'Retry-After': '5'}
+    started = time.perf_counter()
+    matches = plate_search.search(request.args.get('q', ''), limit=max(1, request.args.get('limit', 20, type=int)),
+                                  sessions=max(1, request.args.get('sessions', 5, type=int)),
+                                  start=request.args.get('from'), end=request.args.get('to'))
+    return jsonify({'query': request.args.get('q', ''), 'took_ms': round((time.perf_counter() - started) * 1000, 2),
+                    'matches': matches})
+
+@app.route('/api/events')
+def event_stream():
+    # Server-sent events: the page refreshes as soon as a car enters, pays, leaves or is denied
+    try:
+        last_seq = min(int(request.headers.get('Last-Event-ID', event_feed.seq)), event_feed.seq) # restarted server
+    except ValueError:
+        last_seq = event_feed.seq
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        for seq, event in event_feed.events(last_seq):
+            if event is None:
+                yield ': keep-alive\n\n' # lets the server notice clients that went away
+                continue
+            yield f"id: {seq}\nevent: {event.type}\ndata: {json.dumps(event.to_dict(), default=str)}\n\n"
+
+    return streaming(stream(), 'text/event-stream', {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/preview/<lane>.mjpg')
+def preview_stream(lane):
+    # MJPEG: any number of <img src="/api/preview/entry.mjpg"> viewers share the gate's single encode
+    if lane not in preview_feeds:
+        abort(404)
+
+    def stream():
+        for jpeg in preview_feeds[lane].frames():
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(jpeg)).encode()
+                   + b'\r\n\r\n' + jpeg + b'\r\n')
+
+    return streaming(stream(), 'multipart/x-mixed-replace; boundary=frame', {'Cache-Control': 'no-cache'})
+
+@app.route('/api/preview/<lane>.jpg')
+def preview_snapshot(lane):
+    path = os.path.join(PREVIEW_DIR, f"{lane}.jpg")
+    if lane not in preview_feeds or not os.path.exists(path):
+        abort(404)
+    with open(path, 'rb') as f:
+        return Response(f.read(), mimetype='image/jpeg', headers={'Cache-Control': 'no-cache'})
+
+def serve(server=config.DASHBOARD_SERVER, host=config.DASHBOARD_HOST, port=config.DASHBOARD_PORT):
+    """
+    Runs the dashboard: 'waitress' is the production server (a thread pool
+    behind one event loop, HTTP/1.1 keep-alive, fine on the Windows gate PCs),
+    'dev' the Flask debug server with the reloader, for working on the page.
+    """
+    if server == 'dev':
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_event_bus() # Only in the reloader's serving process; its watcher would subscribe (and record) twice
+            plate_search.start()
+            session_sweeper.start()
+        app.run(host=host, port=port, debug=True, threaded=True) # One thread per viewer; the preview streams stay open
+        return
+    if server != 'waitress':
+        raise ValueError(f"Unknown dashboard server '{server}' (expected 'waitress' or 'dev')")
+
+    from waitress import serve as waitress_serve
+    start_event_bus()
+    plate_search.start()
+    session_sweeper.start()
+    log.info('DASHBOARD', f"Serving on http://{host}:{port} ({config.DASHBOARD_THREADS} threads)",
+             host=host, port=port, threads=config.DASHBOARD_THREADS)
+    waitress_serve(app, host=host, port=port, threads=config.DASHBOARD_THREADS,
+                   connection_limit=config.DASHBOARD_CONNECTION_LIMIT, channel_timeout=config.DASHBOARD_KEEPALIVE,
+                   ident='pms-dashboard')
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    setup_logging('dashboard', log_dir=os.path.join('../..', config.LOG_DIR))
+    serve()
\ No newline at end of file
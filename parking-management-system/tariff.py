@@ -0,0 +1,198 @@
+"""
+Fare computation for parking sessions.
+
+All money is integer minor units (MINOR_UNITS_PER_MAJOR per franc), so fares
+never pick up float noise like 49.980000000000004. A tariff is:
+
+- time-of-day bands, each with a per-minute rate; together they cover 00:00-24:00;
+- a grace period: stays of at most `grace_minutes` are free;
+- an optional daily cap: what is charged for the minutes falling on one calendar
+  day never exceeds `daily_cap`;
+- `round_to`: the final fare is rounded up to a multiple of this (100 = whole
+  francs, which is what the RFID cards hold).
+
+Billing keeps the original rule: every started minute counts, starting from the
+minute the car entered.
+
+The tariff is loaded from TARIFF_FILE (JSON) when it exists, e.g.
+
+    {"grace_minutes": 5, "daily_cap": 500000, "round_to": 100,
+     "bands": [{"start": "00:00", "end": "07:00", "rate_per_minute": 400},
+               {"start": "07:00", "end": "19:00", "rate_per_minute": 833},
+               {"start": "19:00", "end": "24:00", "rate_per_minute": 400}]}
+
+and otherwise defaults to the flat 8.33 per minute the payment station has
+always charged.
+
+fares_bulk() re-prices any number of sessions in one pass over NumPy arrays,
+and `python tariff.py reprice` uses it to audit (or rewrite) stored fares.
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+import config
+
+MINOR_UNITS_PER_MAJOR = 100
+MINUTES_PER_DAY = 24 * 60
+
+
+def _parse_clock(value):
+    """'HH:MM' -> minute of day ('24:00' is allowed as an end)."""
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_money(minor):
+    """Minor units -> the string stored in due_payment ('50' or '49.98')."""
+    major, cents = divmod(int(minor), MINOR_UNITS_PER_MAJOR)
+    return str(major) if cents == 0 else f"{major}.{cents:02d}"
+
+
+def to_card_units(minor):
+    """Whole francs to take off an RFID card for a fare of `minor` (rounded up)."""
+    return -(-int(minor) // MINOR_UNITS_PER_MAJOR)
+
+
+class Tariff:
+    """Time-of-day rates with grace period, daily cap and rounding (all in minor units)."""
+
+    def __init__(self, bands, grace_minutes=0, daily_cap=None, round_to=1):
+        self.grace_minutes = int(grace_minutes)
+        self.daily_cap = None if daily_cap is None else int(daily_cap)
+        self.round_to = max(1, int(round_to))
+
+        rates = [None] * MINUTES_PER_DAY
+        for band in bands:
+            start, end = _parse_clock(band['start']), _parse_clock(band['end'])
+            if not 0 <= start < end <= MINUTES_PER_DAY:
+                raise ValueError(f"Invalid tariff band {band['start']}-{band['end']}")
+            for minute in range(start, end):
+                if rates[minute] is not None:
+                    raise ValueError(f"Tariff bands overlap at {minute // 60:02d}:{minute % 60:02d}")
+                rates[minute] = int(band['rate_per_minute'])
+        if None in rates:
+            minute = rates.index(None)
+            raise ValueError(f"Tariff bands leave {minute // 60:02d}:{minute % 60:02d} uncovered")
+
+        # cumulative[m] = cost of minutes [0, m) of one day
+        self.cumulative = [0]
+        for rate in rates:
+            self.cumulative.append(self.cumulative[-1] + rate)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['bands'], data.get('grace_minutes', 0), data.get('daily_cap'), data.get('round_to', 1))
+
+    def _capped(self, amount):
+        return amount if self.daily_cap is None else min(amount, self.daily_cap)
+
+    def _round(self, amount):
+        return -(-amount // self.round_to) * self.round_to
+
+    def fare(self, entry_time, exit_time):
+        """Fare in minor units for a stay from `entry_time` to `exit_time` (datetimes)."""
+        seconds = (exit_time - entry_time).total_seconds()
+        if seconds <= self.grace_minutes * 60:
+            return 0
+        billable = int(seconds / 60) + 1
+
+        start_day = entry_time.toordinal()
+        start_minute = entry_time.hour * 60 + entry_time.minute
+        end_day, end_minute = divmod(start_minute + billable, MINUTES_PER_DAY)
+        end_day += start_day
+
+        if end_day == start_day:
+            amount = self._capped(self.cumulative[end_minute] - self.cumulative[start_minute])
+        else:
+            amount = (self._capped(self.cumulative[MINUTES_PER_DAY] - self.cumulative[start_minute])
+                      + (end_day - start_day - 1) * self._capped(self.cumulative[MINUTES_PER_DAY])
+                      + self._capped(self.cumulative[end_minute]))
+        return self._round(amount)
+
+
+def default_tariff():
+    """The historical flat rate: 8.33 per started minute, charged in whole francs."""
+    return Tariff([{'start': '00:00', 'end': '24:00', 'rate_per_minute': 833}], round_to=MINOR_UNITS_PER_MAJOR)
+
+
+def load_tariff(path=config.TARIFF_FILE):
+    """Loads the tariff from `path`, or the default flat rate if the file does not exist."""
+    if not path or not os.path.exists(path):
+        return default_tariff()
+    with open(path, 'r') as f:
+        return Tariff.from_dict(json.load(f))
+
+
+def fares_bulk(tariff, entry_times, exit_times):
+    """
+    Vectorized Tariff.fare(): prices every session in one pass over arrays.
+
+    `entry_times` / `exit_times` are anything np.asarray(..., 'datetime64[s]') accepts
+    (e.g. lists of 'YYYY-MM-DD HH:MM:SS' strings). Returns an int64 array of minor
+    units, with -1 where either time is missing (open sessions).
+    """
+    import numpy as np
+
+    entry = np.asarray(entry_times, dtype='datetime64[s]')
+    exit_ = np.asarray(exit_times, dtype='datetime64[s]')
+    missing = np.isnat(entry) | np.isnat(exit_)
+    entry_s = np.where(missing, 0, entry.astype(np.int64))
+    exit_s = np.where(missing, 0, exit_.astype(np.int64))
+
+    seconds = exit_s - entry_s
+    billable = seconds // 60 + 1
+    start_minute_abs = entry_s // 60
+    start_day, start_minute = np.divmod(start_minute_abs, MINUTES_PER_DAY)
+    end_day, end_minute = np.divmod(start_minute_abs + billable, MINUTES_PER_DAY)
+
+    cumulative = np.asarray(tariff.cumulative, dtype=np.int64)
+    day_total = cumulative[-1]
+    cap = np.iinfo(np.int64).max if tariff.daily_cap is None else tariff.daily_cap
+
+    same_day = np.minimum(cumulative[end_minute] - cumulative[start_minute], cap)
+    spanning = (np.minimum(day_total - cumulative[start_minute], cap)
+                + np.maximum(end_day - start_day - 1, 0) * min(day_total, cap)
+                + np.minimum(cumulative[end_minute], cap))
+    amount = np.where(end_day == start_day, same_day, spanning)
+    amount = -(-amount // tariff.round_to) * tariff.round_to
+
+    amount = np.where(seconds <= tariff.grace_minutes * 60, 0, amount)
+    return np.where(missing, -1, amount)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-price stored parking sessions with the current tariff.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    reprice = sub.add_parser('reprice', help="Recompute due_payment for closed sessions.")
+    reprice.add_argument('--tariff', default=config.TARIFF_FILE, help="Tariff JSON (default: PMS_TARIFF_FILE)")
+    reprice.add_argument('--from', dest='start', help="Only sessions with entry_time >= this")
+    reprice.add_argument('--to', dest='end', help="Only sessions with entry_time < this")
+    reprice.add_argument('--write', action='store_true', help="Store the new fares instead of only reporting")
+    args = parser.parse_args()
+
+    from storage import open_store
+    store = open_store()
+    tariff = load_tariff(args.tariff)
+
+    sessions = [row for row in store.sessions(args.start, args.end) if row.get('exit_time')]
+    started = datetime.now()
+    fares = fares_bulk(tariff, [row['entry_time'] for row in sessions], [row['exit_time'] for row in sessions])
+    elapsed = (datetime.now() - started).total_seconds()
+
+    changes = {}
+    for row, fare in zip(sessions, fares.tolist()):
+        if fare >= 0 and row.get('due_payment') != format_money(fare):
+            changes[row['no']] = {'due_payment': format_money(fare)}
+    total = int(fares[fares > 0].sum()) if len(fares) else 0
+    print(f"[TARIFF] Priced {len(sessions)} sessions in {elapsed:.3f}s, total {format_money(total)}, "
+          f"{len(changes)} differ from the stored due_payment")
+
+    if args.write and changes:
+        store.update_sessions(changes)
+        print(f"[TARIFF] Updated due_payment on {len(changes)} sessions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmarks the OCR engines (plate_ocr.py) on the labelled plate crops.
+
+Every plate box in dataset/val (or --images) is preprocessed like the gates
+do and read by each engine. Per engine it reports the mean and p95 latency
+per crop, the share of reads passing the RA format check and, when a truth
+file is given, the exact-match accuracy. A truth file is a CSV of
+`image,plate` rows, e.g. `car_20250324_104723.jpg,RAC123D`.
+
+    python test_files/bench_ocr.py [--truth plates.csv] [--repeat 5] [--engines tesseract,segment]
+
+An engine that cannot be loaded here (tesseract missing, no trained
+weights) is reported and skipped.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from eval_rectification import VAL_DIR, load_val, valid_plate
+from plate_ocr import open_reader
+from plate_reader import preprocess_plate
+
+
+def load_truth(path):
+    if not path:
+        return {}
+    with open(path, newline='') as f:
+        return {row[0].strip(): row[1].strip().upper() for row in csv.reader(f) if len(row) >= 2}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and accuracy of the OCR engines on plate crops.")
+    parser.add_argument('--images', default=VAL_DIR, help="Directory with images/ and labels/ (YOLO format)")
+    parser.add_argument('--truth', help="CSV of image,plate pairs for accuracy")
+    parser.add_argument('--engines', default='tesseract,segment')
+    parser.add_argument('--repeat', type=int, default=5, help="Reads per crop when timing")
+    args = parser.parse_args()
+
+    truth = load_truth(args.truth)
+    crops = [(name, preprocess_plate(image, tuple(int(v) for v in box))[1])
+             for name, image, box in load_val(args.images)]
+    print(f"[BENCH] {len(crops)} plate crops, {args.repeat} timed reads each")
+
+    for engine in args.engines.split(','):
+        try:
+            reader = open_reader(engine.strip())
+        except Exception as e:
+            print(f"[BENCH] {engine:10s} skipped: {e}")
+            continue
+
+        latencies, valid, correct = [], 0, 0
+        for name, thresh in crops:
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = reader.read(thresh)
+                latencies.append(time.perf_counter() - start)
+            plate = valid_plate(text)
+            valid += plate is not None
+            correct += plate is not None and truth.get(name) == plate
+
+        latencies = np.array(latencies) * 1000
+        accuracy = f", accuracy {100.0 * correct / len(truth):.0f}%" if truth else ""
+        print(f"[BENCH] {engine:10s} mean {latencies.mean():.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms "
+              f"per crop, valid format {100.0 * valid / max(1, len(crops)):.0f}%{accuracy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Benchmarks the storage paths of the gates, the payment station and the
+dashboard against synthetic histories of growing size, and flags
+regressions against a saved baseline.
+
+    python test_files/bench_storage.py                                  # csv, 10k / 100k / 1M sessions
+    python test_files/bench_storage.py --scales 10k,100k,1M,10M --storage csv,sqlite
+    python test_files/bench_storage.py --save baseline.json             # remember this run
+    python test_files/bench_storage.py --baseline baseline.json         # exit code 1 on a regression
+
+For every scale and storage backend it writes a history with
+synthetic_history.py (ending last Monday 09:00, so runs in the same week
+see the same data) and times, in a fresh process configured for it (so
+the modules open their store exactly as the lanes do):
+
+    is_car_already_in_parking   entry gate: a parked, a regular and an unknown plate in turn
+    process_payment             payment station: price_card() and marking the session paid, once per parked car
+    handle_exit                 exit gate: a just-paid, an unpaid and an unknown plate in turn (no Arduino)
+    read_parking_data           dashboard: the whole session history
+    read_alerts_from_log_csv    dashboard: the whole attempt log
+
+Each function is called until --budget seconds or --max-calls calls are
+used up; the median call is its time at that scale. The report gives
+every function's scaling curve and its exponent k (time ~ rows^k, a
+least-squares fit: about 0 for O(1), 1 for O(N)). read_parking_data is
+skipped above --max-materialize sessions, as it holds the whole history in
+memory.
+
+Against --baseline, a function regresses if its fastest call at a scale
+(the least noisy figure) both grows by more than --tolerance and by more
+than --min-delta-ms, or if its exponent grows by more than
+--exponent-tolerance. Each worker first times a fixed CSV-parsing
+workload, and times are scaled by it before comparing, so a throttled or
+busier machine does not read as a regression.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import SESSION_FIELDS
+from synthetic_history import PER_DAY, load_probes, parse_count, write_history
+
+BACKEND = os.path.join(ROOT, 'system_ui', 'backend')
+FUNCTIONS = ('is_car_already_in_parking', 'process_payment', 'handle_exit', 'read_parking_data',
+             'read_alerts_from_log_csv')
+
+
+# --- Worker (one process per history) ---
+def measure(call, cases, budget, max_calls):
+    """Calls call(case) for the cases in turn until the budget or the cases run out; per-call seconds."""
+    times = []
+    spent = 0.0
+    for case in cases:
+        start = time.perf_counter()
+        call(case)
+        times.append(time.perf_counter() - start)
+        spent += times[-1]
+        if spent >= budget or len(times) >= max_calls:
+            break
+    if not times:
+        return {'skipped': 'no cases'}
+    return {'calls': len(times), 'median': statistics.median(times), 'min': min(times), 'max': max(times)}
+
+
+def calibrate(repeat=5):
+    """
+    Seconds for a fixed CSV-parsing workload (the fastest of `repeat`): how fast
+    this machine is right now, so runs on a busier or throttled machine can be
+    compared with the baseline.
+    """
+    text = ''.join(f"{i},2025-06-02 11:39:50,2025-06-02 12:38:56,RAG557V,600,1\n" for i in range(20000))
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for row in csv.DictReader(io.StringIO(text), fieldnames=SESSION_FIELDS):
+            row.get('car_plate')
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_worker(args):
+    """Times FUNCTIONS against the history this process was configured for (PMS_* environment)."""
+    from event_log import setup_logging
+    setup_logging('bench')  # the lanes' log records go to the history's logs/, as they would in service
+
+    sys.path.insert(0, BACKEND)
+    import car_entry_updated
+    import car_exit_updated
+    import payment
+    import app as dashboard
+    from storage import TIME_FORMAT
+    from tariff import format_money
+
+    probes = load_probes(args.worker)
+    parked = probes['parked']
+    to_pay, unpaid = parked[:len(parked) // 2], parked[len(parked) // 2:]
+    paid = []
+
+    def process_payment(plate):
+        # What PaymentStation does for one card, minus the serial link: price it, then confirm
+        session, exit_time, due = payment.price_card(plate)
+        if session is not None:
+            payment.store.update_session(session['no'], payment_status='1', exit_time=exit_time.strftime(TIME_FORMAT),
+                                         due_payment=format_money(due))
+            paid.append(plate)
+
+    results = {'calibration': calibrate()}
+    results['is_car_already_in_parking'] = measure(
+        car_entry_updated.is_car_already_in_parking,
+        itertools.cycle([parked[0] if parked else probes['unknown'], probes['regulars'][0], probes['unknown']]),
+        args.budget, args.max_calls)
+    results['process_payment'] = measure(process_payment, iter(to_pay), args.budget, args.max_calls)
+    exits = [plate for trio in itertools.zip_longest(paid, unpaid, [probes['unknown']] * len(parked))
+             for plate in trio if plate]
+    results['handle_exit'] = measure(lambda plate: car_exit_updated.handle_exit(plate, None),
+                                     itertools.cycle(exits or [probes['unknown']]), args.budget, args.max_calls)
+    if args.rows > args.max_materialize:
+        results['read_parking_data'] = {'skipped': f"over --max-materialize ({args.max_materialize} sessions)"}
+    else:
+        results['read_parking_data'] = measure(lambda _: dashboard.read_parking_data(), itertools.repeat(None),
+                                               args.budget, args.max_calls)
+    results['read_alerts_from_log_csv'] = measure(lambda _: dashboard.read_alerts_from_log_csv(),
+                                                  itertools.repeat(None), args.budget, args.max_calls)
+    with open(args.out, 'w') as f:
+        json.dump(results, f)
+
+
+def history_end():
+    """Last Monday 09:00: every run benchmarks the same histories, ending at a busy hour."""
+    monday = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    monday -= timedelta(days=monday.weekday())
+    return monday if monday <= datetime.now() else monday - timedelta(days=7)
+
+
+def bench_history(rows, storage, args, workdir):
+    """Writes a history of `rows` sessions and times it in a worker process; {function: stats}."""
+    history = os.path.join(workdir, f"{storage}-{rows}")
+    started = time.perf_counter()
+    env = write_history(history, rows, storage, args.seed, args.per_day, history_end())
+    print(f"[BENCH] {storage} {rows} sessions written in {time.perf_counter() - started:.1f}s", flush=True)
+
+    out = os.path.join(history, 'results.json')
+    env = dict(os.environ, **env, PMS_BUS='0', PMS_LOG_CONSOLE='0', PMS_LOG_DIR=os.path.join(history, 'logs'))
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', history, '--out', out,
+                    '--rows', str(rows), '--budget', str(args.budget), '--max-calls', str(args.max_calls),
+                    '--max-materialize', str(args.max_materialize)], cwd=ROOT, env=env, check=True)
+    with open(out) as f:
+        results = json.load(f)
+    if not args.keep:
+        shutil.rmtree(history, ignore_errors=True)
+    return results
+
+
+# --- Scaling curves and regressions ---
+def exponent(curve):
+    """k of time ~ rows^k, fitted over the scales measured ({rows: seconds}); None under two scales."""
+    points = [(math.log(rows), math.log(seconds)) for rows, seconds in curve.items() if seconds > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread if spread else None
+
+
+def complexity(k):
+    if k is None:
+        return ''
+    if k < 0.2:
+        return 'O(1)'
+    if k < 0.8:
+        return 'sublinear'
+    if k < 1.2:
+        return 'O(N)'
+    return 'superlinear'
+
+
+def curves(results, stat='median'):
+    """{storage: {function: {rows: seconds}}} from the run's results; `stat` is 'median' or 'min'."""
+    return {storage: {name: {int(rows): stats[name][stat] for rows, stats in by_rows.items()
+                             if stat in stats.get(name, {})}
+                      for name in FUNCTIONS}
+            for storage, by_rows in results.items()}
+
+
+def _ms(seconds):
+    if seconds is None:
+        return '-'
+    return f"{seconds:.3g} s" if seconds >= 1 else f"{seconds * 1000:.3g} ms"
+
+
+def report(results):
+    for storage, functions in curves(results).items():
+        scales = sorted({int(rows) for rows in results[storage]})
+        print(f"\n[BENCH] {storage}: median per call")
+        print(f"{'function':28s}" + ''.join(f"{rows:>12,d}" for rows in scales) + f"{'k':>7s}  growth")
+        for name, curve in functions.items():
+            k = exponent(curve)
+            print(f"{name:28s}" + ''.join(f"{_ms(curve.get(rows)):>12s}" for rows in scales)
+                  + (f"{k:7.2f}  {complexity(k)}" if k is not None else ''))
+
+
+def regressions(results, baseline, tolerance, min_delta, exponent_tolerance):
+    """Lines describing every function that got worse than in `baseline`."""
+    found = []
+    now, before = curves(results, 'min'), curves(baseline, 'min')  # the fastest call is the least noisy
+    for storage, functions in now.items():
+        for name, curve in functions.items():
+            old = before.get(storage, {}).get(name, {})
+            for rows in sorted(set(curve) & set(old)):
+                # Both runs in the baseline machine's time, so a slower machine is not a regression
+                speed = (results[storage][str(rows)].get('calibration') or 1.0) / \
+                    (baseline[storage][str(rows)].get('calibration') or 1.0)
+                new_s, old_s = curve[rows] / speed, old[rows]
+                if new_s > old_s * (1 + tolerance) and new_s - old_s > min_delta:
+                    found.append(f"{storage} {name} at {rows:,d} sessions: {_ms(old_s)} -> {_ms(new_s)} "
+                                 f"({new_s / old_s:.2f}x, machine speed {1 / speed:.2f}x the baseline's)")
+            shared = {rows: curve[rows] for rows in set(curve) & set(old)}  # exponents: unaffected by speed
+            k_new, k_old = exponent(shared), exponent({rows: old[rows] for rows in shared})
+            if k_new is not None and k_old is not None and k_new - k_old > exponent_tolerance:
+                found.append(f"{storage} {name} scales worse: k {k_old:.2f} -> {k_new:.2f} "
+                             f"({complexity(k_old)} -> {complexity(k_new)})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling curves of the storage paths on synthetic histories.")
+    parser.add_argument('--scales', default='10k,100k,1M', help="Session counts, e.g. 10k,100k,1M,10M")
+    parser.add_argument('--storage', default='csv', help="Backends to run: csv, sqlite or csv,sqlite")
+    parser.add_argument('--per-day', type=int, default=PER_DAY, help="Arrivals per day in the histories")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--budget', type=float, default=2.0, help="s of calls per function and scale")
+    parser.add_argument('--max-calls', type=int, default=25)
+    parser.add_argument('--max-materialize', type=parse_count, default=2000000,
+                        help="Largest history read_parking_data is run on")
+    parser.add_argument('--save', help="Write the results (JSON) here")
+    parser.add_argument('--baseline', help="Results of an earlier --save to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown per scale (0.25 = 25%%)")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="Slowdowns smaller than this are noise")
+    parser.add_argument('--exponent-tolerance', type=float, default=0.2)
+    parser.add_argument('--workdir', help="Where to write the histories (default: a temporary directory)")
+    parser.add_argument('--keep', action='store_true', help="Keep the histories afterwards")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    scales = sorted(parse_count(scale) for scale in args.scales.split(','))
+    workdir = args.workdir or tempfile.mkdtemp(prefix='pms-bench-')
+    results = {}
+    try:
+        for storage in args.storage.split(','):
+            for rows in scales:
+                results.setdefault(storage, {})[str(rows)] = bench_history(rows, storage, args, workdir)
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report(results)
+    run = {'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+           'machine': platform.node(), 'per_day': args.per_day, 'seed': args.seed, 'results': results}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(run, f, indent=1)
+        print(f"\n[BENCH] Results saved to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        found = regressions(results, baseline['results'], args.tolerance, args.min_delta_ms / 1000,
+                            args.exponent_tolerance)
+        print(f"\n[BENCH] Against {args.baseline} ({baseline.get('created')}): "
+              f"{len(found) or 'no'} regression{'s' if len(found) != 1 else ''}")
+        for line in found:
+            print(f"[BENCH] REGRESSION {line}")
+        if found:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Replays DIST traces through distance_filter.DistanceFilter and compares it
+with the raw threshold the gates used before.
+
+    python test_files/eval_distance_filter.py                      # synthetic traces
+    python test_files/eval_distance_filter.py traces/*.txt --interval 0.2
+    python test_files/eval_distance_filter.py --record /dev/ttyUSB0 --seconds 60 --out traces/lane.csv
+
+A trace is either the sketch's old text output (one "DIST:12.34" per line,
+samples --interval seconds apart) or a CSV of "seconds,distance" rows as
+written by --record. For each trace it prints:
+
+- detector samples: how many samples would have run the detector (raw value
+  under the trigger vs. filter active);
+- episodes: separate raw crossings vs. PRESENT episodes (noise shows up as
+  many short raw episodes);
+- lead: how long before the raw threshold was first crossed the filter
+  reported the car as arriving.
+
+Synthetic traces carry the expected number of cars, so spurious triggers
+are counted too.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distance_filter import DistanceFilter, EVENT_ARRIVING, EVENT_PRESENT  # noqa: E402
+from serial_protocol import NO_ECHO_CM  # noqa: E402
+
+TRIGGER = 50.0  # cm - the entry gate's trigger distance
+INTERVAL = 0.05  # s - sample period of the framed protocol
+
+
+def load_trace(path, interval):
+    samples = []
+    with open(path) as f:
+        for i, line in enumerate(f):
+            line = line.strip()
+            if line.startswith('DIST:'):
+                samples.append((i * interval, float(line[5:])))
+            elif ',' in line:
+                t, distance = line.split(',')[:2]
+                try:
+                    samples.append((float(t), float(distance)))
+                except ValueError:
+                    pass  # header
+    return samples
+
+
+def record(port, seconds, out):
+    import serial
+    from serial_protocol import GateLink
+    link = GateLink(serial.Serial(port, 115200, timeout=0))
+    start = time.monotonic()
+    with open(out, 'w') as f:
+        f.write('seconds,distance\n')
+        while time.monotonic() - start < seconds:
+            distance = link.read_distance()
+            if distance is not None:
+                f.write(f"{time.monotonic() - start:.3f},{distance:.2f}\n")
+            time.sleep(0.005)
+    link.close()
+    print(f"Recorded {seconds}s from {port} to {out}")
+
+
+# --- Synthetic traces ---
+def _noisy(distance, rng):
+    if rng.random() < 0.03:
+        return NO_ECHO_CM  # missed echo
+    if rng.random() < 0.02:
+        return rng.uniform(5, 45)  # spurious short echo
+    return max(2.0, distance + rng.gauss(0, 2.0))
+
+
+def synthetic(seed=1):
+    """Returns {name: (samples, cars)} for a few typical lane situations."""
+    rng = random.Random(seed)
+    traces = {}
+
+    def build(profile, seconds):
+        return [(i * INTERVAL, _noisy(profile(i * INTERVAL), rng)) for i in range(int(seconds / INTERVAL))]
+
+    def approach(t, start=2.0, speed=120.0, stop_at=30.0, stay=6.0):
+        if t < start:
+            return 400.0
+        d = 350.0 - speed * (t - start) + 0.5 * 25.0 * (t - start) ** 2  # braking
+        arrive = start + (350.0 - stop_at) / speed * 1.4
+        if t < arrive and d > stop_at:
+            return d
+        if t < arrive + stay:
+            return stop_at
+        return 400.0
+
+    traces['empty lane'] = (build(lambda t: 400.0, 60), 0)
+    traces['car approaches and stops'] = (build(approach, 20), 1)
+    traces['slow creep'] = (build(lambda t: 400.0 if t < 2 else max(35.0, 300.0 - 25.0 * (t - 2)), 25), 1)
+    traces['passer-by at 120 cm'] = (build(lambda t: 120.0 if 5 < t < 6.5 else 400.0, 15), 0)
+    traces['two cars'] = (build(lambda t: approach(t) if t < 20 else approach(t - 20), 40), 2)
+    return traces
+
+
+def evaluate(samples, trigger=TRIGGER):
+    sensor = DistanceFilter(max_distance=trigger)
+    raw_active = filtered_active = raw_episodes = present_episodes = arrivals = 0
+    in_raw, arriving_at, leads = False, None, []
+    for t, raw in samples:
+        reading = sensor.update(raw, t)
+        hit = raw <= trigger
+        raw_active += hit
+        filtered_active += reading.active
+        if hit and not in_raw:
+            raw_episodes += 1
+            if arriving_at is not None:
+                leads.append(t - arriving_at)
+                arriving_at = None
+        in_raw = hit
+        if reading.event == EVENT_ARRIVING:
+            arrivals += 1
+            arriving_at = t
+        elif reading.event == EVENT_PRESENT:
+            present_episodes += 1
+    return {'samples': len(samples), 'raw_detector': raw_active, 'filtered_detector': filtered_active,
+            'raw_episodes': raw_episodes, 'present_episodes': present_episodes, 'arrivals': arrivals,
+            'lead': sum(leads) / len(leads) if leads else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the distance filter on recorded or synthetic traces.")
+    parser.add_argument('traces', nargs='*', help="DIST text logs or seconds,distance CSVs")
+    parser.add_argument('--interval', type=float, default=0.2, help="s between samples of a DIST text log")
+    parser.add_argument('--trigger', type=float, default=TRIGGER, help="cm - trigger distance")
+    parser.add_argument('--record', metavar='PORT', help="Record a trace from a gate board instead")
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--out', default='trace.csv')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.seconds, args.out)
+        return
+
+    if args.traces:
+        traces = {os.path.basename(path): (load_trace(path, args.interval), None) for path in args.traces}
+    else:
+        traces = synthetic()
+
+    print(f"{'trace':28s} {'cars':>4s} {'raw eps':>7s} {'present':>7s} {'arrivals':>8s} "
+          f"{'raw det':>7s} {'filt det':>8s} {'lead':>6s}")
+    for name, (samples, cars) in traces.items():
+        r = evaluate(samples, args.trigger)
+        lead = f"{r['lead']:.2f}s" if r['lead'] is not None else '-'
+        print(f"{name:28s} {cars if cars is not None else '?':>4} {r['raw_episodes']:7d} {r['present_episodes']:7d} "
+              f"{r['arrivals']:8d} {r['raw_detector']:7d} {r['filtered_detector']:8d} {lead:>6s}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Compares plate preprocessing with and without rectification on dataset/val.
+
+Every val image is turned into a short synthetic "approach": FRAMES frames,
+each a random perspective tilt of the image (as seen from an angled gate
+camera), with the labelled plate box moved along. Each frame's box goes
+through preprocess_plate() and tesseract exactly like the gates do, and a
+read counts once VOTES frames produced a valid RA plate - the gate's voting
+rule. The report gives, per mode, the average number of frames needed per
+successful read and the share of frames OCR read validly.
+
+    python test_files/eval_rectification.py [--frames 15] [--tilt 0.15] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+from collections import Counter
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from plate_ocr import TesseractReader
+from plate_reader import preprocess_plate
+
+VAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dataset', 'val')
+VOTES = 3  # valid reads the gates wait for before deciding
+
+
+def load_val(val_dir):
+    """Yields (name, image, box) for every val image with a plate label."""
+    images_dir, labels_dir = os.path.join(val_dir, 'images'), os.path.join(val_dir, 'labels')
+    for name in sorted(os.listdir(images_dir)):
+        label_path = os.path.join(labels_dir, os.path.splitext(name)[0] + '.txt')
+        image = cv2.imread(os.path.join(images_dir, name))
+        if image is None or not os.path.exists(label_path):
+            continue
+        with open(label_path) as f:
+            lines = [line.split() for line in f if line.strip()]
+        h, w = image.shape[:2]
+        for _, cx, cy, bw, bh in lines[:1]:
+            cx, cy, bw, bh = float(cx) * w, float(cy) * h, float(bw) * w, float(bh) * h
+            yield name, image, (cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2)
+
+
+def tilted_frame(image, box, tilt, rng):
+    """Returns (frame, box) with the image warped by a random perspective tilt of up to `tilt`."""
+    h, w = image.shape[:2]
+    corners = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    moved = corners + np.float32([[rng.uniform(-tilt, tilt) * w, rng.uniform(-tilt, tilt) * h]
+                                  for _ in range(4)])
+    matrix = cv2.getPerspectiveTransform(corners, moved)
+    frame = cv2.warpPerspective(image, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE)
+
+    x1, y1, x2, y2 = box
+    points = cv2.perspectiveTransform(np.float32([[[x1, y1], [x2, y1], [x2, y2], [x1, y2]]]), matrix)[0]
+    x1, y1 = (int(max(0, v)) for v in points.min(axis=0))
+    x2, y2 = int(min(w, points[:, 0].max())), int(min(h, points[:, 1].max()))
+    return frame, (x1, y1, x2, y2)
+
+
+def valid_plate(text):
+    """The gates' RA format check; returns the plate or None."""
+    text = text.strip().replace(" ", "")
+    if "RA" not in text:
+        return None
+    candidate = text[text.find("RA"):]
+    if len(candidate) < 7:
+        return None
+    candidate = candidate[:7]
+    prefix, digits, suffix = candidate[:3], candidate[3:6], candidate[6]
+    if prefix.isalpha() and prefix.isupper() and digits.isdigit() and suffix.isalpha() and suffix.isupper():
+        return candidate
+    return None
+
+
+def run(reader, samples, rectify):
+    stats = Counter()
+    for frames in samples:
+        votes = []
+        for count, (frame, box) in enumerate(frames, 1):
+            x1, y1, x2, y2 = box
+            if x2 <= x1 or y2 <= y1:
+                continue
+            _, thresh = preprocess_plate(frame, box, rectify=rectify)
+            plate = valid_plate(reader.read(thresh))
+            stats['frames'] += 1
+            if plate:
+                stats['valid'] += 1
+                votes.append(plate)
+                if len(votes) >= VOTES:
+                    stats['reads'] += 1
+                    stats['frames_to_read'] += count
+                    break
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--val', default=VAL_DIR)
+    parser.add_argument('--frames', type=int, default=15, help="Frames per simulated approach")
+    parser.add_argument('--tilt', type=float, default=0.15, help="Max corner shift as a share of the image size")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    reader = TesseractReader()
+    rng = random.Random(args.seed)
+    samples = []
+    for name, image, box in load_val(args.val):
+        # The first frame is the untouched image, the rest approach at an angle
+        samples.append([(image, tuple(int(v) for v in box))] +
+                       [tilted_frame(image, box, args.tilt, rng) for _ in range(args.frames - 1)])
+    print(f"[EVAL] {len(samples)} val plates, {args.frames} frames each, tilt up to {args.tilt:.0%}")
+
+    for label, rectify in (("crop + Otsu", False), ("rectified + adaptive", True)):
+        stats = run(reader, samples, rectify)
+        reads = stats['reads']
+        per_read = f"{stats['frames_to_read'] / reads:.1f}" if reads else "n/a"
+        valid_rate = 100.0 * stats['valid'] / stats['frames'] if stats['frames'] else 0.0
+        print(f"[EVAL] {label:22s} reads {reads}/{len(samples)}, frames per read {per_read}, "
+              f"valid OCR frames {valid_rate:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
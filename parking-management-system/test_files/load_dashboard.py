@@ -0,0 +1,236 @@
+"""
+Load test for the dashboard backend: hundreds of simulated dashboards polling
+/api/parking_data and /api/alerts against a synthetic history.
+
+    python test_files/load_dashboard.py                                  # 1M sessions, 200 clients, 30 s
+    python test_files/load_dashboard.py --rows 100000 --clients 500 --interval 1
+    python test_files/load_dashboard.py --storage sqlite --interval 0    # closed loop: max throughput
+    python test_files/load_dashboard.py --url http://127.0.0.1:5000 --clients 100   # an already running server
+    python test_files/load_dashboard.py --rows 100000 --streams 20       # 20 open pages' preview/event streams
+
+Without --url it writes a synthetic history (see synthetic_history.py) to a
+temporary directory, starts system_ui/backend/app.py on it
+(PMS_DASHBOARD_SERVER, waitress by default) and stops it afterwards. Each
+client keeps one HTTP/1.1 connection open and polls the endpoints the page
+polls every --interval seconds (5 s in the browser), sending
+Accept-Encoding: gzip. Meanwhile --writes sessions per second are added to
+the store, as the gates would, so cached responses keep being invalidated
+and rebuilt. --streams N opens N pages' long-lived streams as well (the two
+MJPEG previews and /api/events each), reopened whenever they end, as the
+threads they hold are what can starve the polling clients; streams past
+PMS_DASHBOARD_MAX_STREAMS should be refused with a 503.
+
+Prints requests/s, status counts, transferred bytes and latency percentiles
+per endpoint.
+"""
+import argparse
+import http.client
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic_history import open_history, random_plate, write_history
+
+BACKEND = os.path.join(ROOT, 'system_ui', 'backend')
+PAGE_PATHS = ['/api/parking_data?limit=500', '/api/alerts?limit=200']  # what index.html polls
+STREAM_PATHS = ['/api/preview/entry.mjpg', '/api/preview/exit.mjpg', '/api/events']  # what index.html keeps open
+FULL_PATHS = ['/api/parking_data', '/api/alerts']
+
+
+# --- Server ---
+def start_server(env, port, server, log_dir):
+    env = dict(os.environ, **env, PMS_DASHBOARD_PORT=str(port), PMS_DASHBOARD_SERVER=server, PMS_BUS='0',
+               PMS_SWEEP_INTERVAL='0', PMS_LOG_CONSOLE='0', PMS_LOG_DIR=log_dir)
+    proc = subprocess.Popen([sys.executable, 'app.py'], cwd=BACKEND, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"[LOAD] Dashboard exited with code {proc.returncode}")
+        try:
+            http.client.HTTPConnection('127.0.0.1', port, timeout=1).request('GET', '/')
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("[LOAD] Dashboard did not start within 30 s")
+
+
+# --- Clients ---
+class Results:
+    def __init__(self):
+        self.samples = []  # (path, status, seconds, bytes)
+        self.streams = []  # (path, status, seconds open, bytes)
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def add(self, *sample):
+        self.samples.append(sample)  # list.append is atomic
+
+    def connected(self):
+        with self.lock:
+            self.connections += 1
+
+
+def client(host, port, paths, interval, deadline, results, rng):
+    conn = None
+    next_at = time.monotonic() + rng.uniform(0, interval)
+    while True:
+        if interval:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_at += interval
+        if time.monotonic() >= deadline:
+            break
+        for path in paths:
+            if conn is None:
+                conn = http.client.HTTPConnection(host, port, timeout=30)
+                results.connected()
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+                response = conn.getresponse()
+                body = response.read()
+                status = response.status
+                if response.getheader('Connection', '').lower() == 'close':
+                    conn.close()
+                    conn = None
+            except (OSError, http.client.HTTPException):
+                body, status = b'', 'error'
+                conn.close()
+                conn = None
+            results.add(path, status, time.perf_counter() - start, len(body))
+    if conn:
+        conn.close()
+
+
+def stream_client(host, port, path, deadline, results):
+    """Keeps `path` open until the deadline, reopening it when the server ends it (a 503 after 1 s)."""
+    while time.monotonic() < deadline:
+        conn = http.client.HTTPConnection(host, port, timeout=20)  # longer than the 15 s SSE keep-alive
+        start, size, status = time.perf_counter(), 0, 'error'
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            status = response.status
+            while time.monotonic() < deadline:
+                data = response.read1(65536)
+                if not data:
+                    break
+                size += len(data)
+        except (OSError, http.client.HTTPException):
+            pass
+        conn.close()
+        results.streams.append((path, status, time.perf_counter() - start, size))
+        if status != 200:
+            time.sleep(1.0)
+
+
+def writer(store, rate, deadline, rng):
+    """Adds sessions at `rate` per second, as the entry gate would."""
+    while time.monotonic() < deadline:
+        store.add_session(random_plate(rng), datetime.now())
+        time.sleep(1.0 / rate)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else float('nan')
+
+
+def report(results, seconds):
+    total = len(results.samples)
+    print(f"\n[LOAD] {total} requests in {seconds:.1f}s = {total / seconds:.1f} req/s "
+          f"over {results.connections} connections")
+    print(f"{'endpoint':32s} {'req/s':>7s} {'200':>6s} {'other':>6s} {'err':>5s} {'avg KB':>7s} "
+          f"{'p50 ms':>7s} {'p90 ms':>7s} {'p99 ms':>7s} {'p99.9':>7s} {'max ms':>7s}")
+    for path in sorted({sample[0] for sample in results.samples}):
+        samples = [sample for sample in results.samples if sample[0] == path]
+        latencies = sorted(sample[2] * 1000 for sample in samples)
+        statuses = [sample[1] for sample in samples]
+        kb = sum(sample[3] for sample in samples) / len(samples) / 1024
+        print(f"{path:32s} {len(samples) / seconds:7.1f} {statuses.count(200):6d} {len(statuses) - statuses.count(200) - statuses.count('error'):6d} "
+              f"{statuses.count('error'):5d} {kb:7.1f} {percentile(latencies, 50):7.1f} "
+              f"{percentile(latencies, 90):7.1f} {percentile(latencies, 99):7.1f} "
+              f"{percentile(latencies, 99.9):7.1f} {latencies[-1]:7.1f}")
+    for path in sorted({sample[0] for sample in results.streams}):
+        streams = [sample for sample in results.streams if sample[0] == path]
+        statuses = [sample[1] for sample in streams]
+        print(f"[LOAD] Stream {path}: {statuses.count(200)} opened, {statuses.count(503)} refused (503), "
+              f"{len(statuses) - statuses.count(200) - statuses.count(503)} other/errors, "
+              f"{sum(sample[3] for sample in streams) / 1024:.1f} KB received")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many dashboards polling the backend.")
+    parser.add_argument('--url', help="Test a running dashboard instead of starting one")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Sessions in the synthetic history")
+    parser.add_argument('--storage', choices=('csv', 'sqlite'), default='csv')
+    parser.add_argument('--server', choices=('waitress', 'dev'), default='waitress')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=5.0, help="s between polls per client (0 = closed loop)")
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--writes', type=float, default=1.0, help="Sessions added per second during the test")
+    parser.add_argument('--full', action='store_true', help="Poll the whole history instead of the page's limits")
+    parser.add_argument('--streams', type=int, default=0, help="Open pages holding the preview and event streams")
+    args = parser.parse_args()
+
+    workdir = proc = store = None
+    try:
+        if args.url:
+            url = urlsplit(args.url)
+            host, port = url.hostname, url.port or 80
+        else:
+            workdir = tempfile.mkdtemp(prefix='pms-load-')
+            started = time.perf_counter()
+            env = write_history(workdir, args.rows, args.storage)
+            print(f"[LOAD] {args.rows} sessions ({args.storage}) written in {time.perf_counter() - started:.1f}s")
+            store = open_history(env) if args.writes > 0 else None
+            proc = start_server(env, args.port, args.server, os.path.join(workdir, 'logs'))
+            host, port = '127.0.0.1', args.port
+
+        paths = FULL_PATHS if args.full else PAGE_PATHS
+        for path in paths:  # the first request for each query builds its cache entry
+            conn = http.client.HTTPConnection(host, port, timeout=300)
+            started = time.perf_counter()
+            conn.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+            size = len(conn.getresponse().read())
+            print(f"[LOAD] Cold {path}: {(time.perf_counter() - started) * 1000:.0f} ms, {size / 1024:.1f} KB")
+            conn.close()
+
+        results = Results()
+        deadline = time.monotonic() + args.seconds
+        threads = [threading.Thread(target=client, args=(host, port, paths, args.interval, deadline, results,
+                                                          random.Random(i)), daemon=True)
+                   for i in range(args.clients)]
+        if store is not None:
+            threads.append(threading.Thread(target=writer, args=(store, args.writes, deadline, random.Random(-1)),
+                                            daemon=True))
+        threads += [threading.Thread(target=stream_client, args=(host, port, path, deadline, results), daemon=True)
+                    for _ in range(args.streams) for path in STREAM_PATHS]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report(results, time.monotonic() - started)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
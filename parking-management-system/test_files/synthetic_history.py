@@ -0,0 +1,233 @@
+"""
+Synthetic parking history (sessions and unauthorized attempts) for load
+tests and benchmarks, at any size from a few thousand to tens of millions
+of sessions.
+
+    python test_files/synthetic_history.py /tmp/pms-1m --rows 1000000
+    python test_files/synthetic_history.py /tmp/pms-10m --rows 10000000 --storage sqlite
+
+The history ends now and looks like the car park's own:
+- arrivals are a Poisson process of about --per-day cars a day whose rate
+  follows the day (morning and evening peaks, quiet nights) and the week
+  (quieter weekends), so a bigger history is a longer one, not a busier one;
+- 70% of the arrivals are regulars (a pool of two days' worth of plates,
+  the busiest coming daily, most every few days), the rest mostly one-off
+  visitors; a car is never parked twice at once;
+- stays are log-normal (median 90 min); cars whose stay has not ended are
+  still parked (unpaid, no exit time);
+- ABANDONED of the other sessions never paid or left - the stale sessions
+  real gates leave behind, mostly entry misreads, so only ever on visitor
+  plates - and their cars are refused (ENTRY_DENIED) whenever they come back;
+- paid sessions carry the fare of the configured tariff, and about 2.5% of
+  exits are refused first (unpaid or payment too old).
+
+Next to the CSVs (and parking.db with --storage sqlite) it writes
+probes.json: plates the benchmarks can use (parked, abandoned, regular and
+unknown ones).
+"""
+import argparse
+import csv
+import heapq
+import json
+import math
+import os
+import random
+import string
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import ATTEMPT_FIELDS, SESSION_FIELDS, TIME_FORMAT
+from tariff import format_money, load_tariff
+
+PER_DAY = 1500  # default arrivals per day
+ABANDONED = 0.001  # share of sessions that never paid or left
+UNKNOWN_PLATE = 'RB0000A'  # not in the RA format, so in no history
+# Relative arrival rate by hour of day, and by weekday (Monday first)
+HOURLY = [0.1, 0.05, 0.05, 0.05, 0.1, 0.3, 0.9, 1.8, 2.2, 1.6, 1.2, 1.2,
+          1.4, 1.3, 1.2, 1.3, 1.6, 2.0, 1.8, 1.2, 0.8, 0.5, 0.3, 0.2]
+WEEKLY = [1.0, 1.0, 1.0, 1.0, 1.1, 0.7, 0.5]
+_SCALE = 24 * 7 / (sum(HOURLY) * sum(WEEKLY))  # makes the weekly mean rate 1
+_PEAK = max(HOURLY) * max(WEEKLY) * _SCALE
+
+
+def random_plate(rng):
+    return (f"RA{rng.choice(string.ascii_uppercase)}{rng.randint(0, 999):03d}"
+            f"{rng.choice(string.ascii_uppercase)}")
+
+
+def _rate(moment):
+    """Arrival rate at `moment`, relative to the weekly mean."""
+    return HOURLY[moment.hour] * WEEKLY[moment.weekday()] * _SCALE
+
+
+def arrival_times(rows, per_day, end, rng):
+    """
+    `rows` arrival times (epoch s), oldest first, the newest just before `end`.
+    Drawn backwards from `end` by thinning a Poisson process at the peak rate,
+    so the history ends exactly now whatever its length.
+    """
+    peak = per_day / 86400.0 * _PEAK
+    times = array('d')
+    t = end.timestamp()
+    while len(times) < rows:
+        t -= rng.expovariate(peak)
+        if rng.random() * _PEAK < _rate(datetime.fromtimestamp(t)):
+            times.append(t)
+    times.reverse()
+    return times
+
+
+class _Plates:
+    """Who arrives next: a regular (the first ones most often) or a visitor."""
+
+    def __init__(self, rng, per_day):
+        self.rng = rng
+        self.regulars = [random_plate(rng) for _ in range(max(20, per_day * 2))]
+        self.regular = set(self.regulars)
+        self.inside = {}  # plate -> datetime it leaves
+        self.abandoned = set()  # plates with a session that never closes
+
+    def next(self, at):
+        """(plate, refused): refused if its car has an abandoned session. Never a car still inside."""
+        rng = self.rng
+        while True:
+            if rng.random() < 0.7:
+                plate = self.regulars[int(len(self.regulars) * rng.random() ** 1.5)]
+            else:
+                plate = random_plate(rng)
+            if plate in self.abandoned:
+                return plate, True
+            if self.inside.get(plate, at) <= at:
+                return plate, False
+
+
+def generate(rows, per_day=PER_DAY, seed=1, end=None, tariff=None):
+    """
+    Yields ('session', row) and ('attempt', row) tuples - CSV rows in
+    SESSION_FIELDS / ATTEMPT_FIELDS order, each kind oldest first - and
+    finally ('probes', {...}).
+    """
+    rng = random.Random(seed)
+    tariff = tariff or load_tariff()
+    end = (end or datetime.now()).replace(microsecond=0)
+    plates = _Plates(rng, per_day)
+    pending = []  # heap of (timestamp, n, attempt row), written once the sessions reach their time
+    parked, abandoned = [], []
+
+    no = 0
+    for t in arrival_times(rows, per_day, end, rng):
+        at = datetime.fromtimestamp(t).replace(microsecond=0)
+        entry = at.strftime(TIME_FORMAT)
+        while pending and pending[0][0] <= entry:
+            yield 'attempt', heapq.heappop(pending)[2]
+
+        plate, refused = plates.next(at)
+        if refused:
+            yield 'attempt', [entry, plate, 'ENTRY_DENIED', 'Car already in parking', '']
+            plate, _ = plates.next(at)
+            while plate in plates.abandoned:
+                plate, _ = plates.next(at)
+        no += 1
+        stay = timedelta(minutes=min(4320.0, max(2.0, rng.lognormvariate(math.log(90), 1.0))))
+        leave = at + stay
+
+        if leave > end or (plate not in plates.regular and rng.random() < ABANDONED / 0.3):
+            yield 'session', [no, entry, '', plate, '', 0]
+            if leave <= end:
+                abandoned.append(plate)
+                plates.abandoned.add(plate)
+            else:
+                parked.append(plate)
+        else:
+            paid_at = leave - timedelta(seconds=rng.uniform(30, 240))
+            due = format_money(tariff.fare(at, paid_at))
+            yield 'session', [no, entry, paid_at.strftime(TIME_FORMAT), plate, due, 1]
+            refused = rng.random()
+            if refused < 0.02:
+                tried = max(at, paid_at - timedelta(minutes=2)).strftime(TIME_FORMAT)
+                heapq.heappush(pending, (tried, no, [tried, plate, 'EXIT_DENIED', 'Payment not made', f"Due: {due}"]))
+            elif refused < 0.025:
+                late = leave + timedelta(minutes=rng.uniform(6, 60))
+                if late <= end:
+                    heapq.heappush(pending, (late.strftime(TIME_FORMAT), no, [
+                        late.strftime(TIME_FORMAT), plate, 'EXIT_DENIED', 'Previous payment too old',
+                        f"Paid {(late - paid_at).total_seconds() / 60:.2f} min ago"]))
+        plates.inside[plate] = leave
+
+    for _, _, row in sorted(pending):
+        yield 'attempt', row
+    yield 'probes', {'end': end.strftime(TIME_FORMAT), 'parked': parked, 'abandoned': abandoned[-1000:],
+                     'regulars': [plate for plate in plates.regulars[:100] if plate not in plates.abandoned][:50],
+                     'unknown': UNKNOWN_PLATE}
+
+
+def write_history(out_dir, rows, storage='csv', seed=1, per_day=PER_DAY, end=None):
+    """
+    Writes `rows` sessions (and their attempts) ending at `end` (default now) to
+    out_dir; returns the PMS_* settings for them. The same seed, per_day and end
+    give the same history.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    sessions_path = os.path.join(out_dir, 'sessions.csv')
+    attempts_path = os.path.join(out_dir, 'attempts.csv')
+    with open(sessions_path, 'w', newline='') as s, open(attempts_path, 'w', newline='') as a:
+        writers = {'session': csv.writer(s), 'attempt': csv.writer(a)}
+        writers['session'].writerow(SESSION_FIELDS)
+        writers['attempt'].writerow(ATTEMPT_FIELDS)
+        for kind, row in generate(rows, per_day, seed, end):
+            if kind == 'probes':
+                with open(os.path.join(out_dir, 'probes.json'), 'w') as f:
+                    json.dump(row, f)
+            else:
+                writers[kind].writerow(row)
+
+    env = {'PMS_STORAGE': storage, 'PMS_SESSIONS_CSV': sessions_path, 'PMS_ATTEMPTS_CSV': attempts_path,
+           'PMS_SQLITE_PATH': os.path.join(out_dir, 'parking.db')}
+    if storage == 'sqlite':
+        from storage_sqlite import SqliteStore
+        SqliteStore(env['PMS_SQLITE_PATH']).import_csv(sessions_path, attempts_path)
+    return env
+
+
+def open_history(env):
+    from storage import open_store
+    return open_store(env['PMS_STORAGE'], env['PMS_SESSIONS_CSV'], env['PMS_ATTEMPTS_CSV'], env['PMS_SQLITE_PATH'])
+
+
+def load_probes(out_dir):
+    with open(os.path.join(out_dir, 'probes.json')) as f:
+        return json.load(f)
+
+
+def parse_count(text):
+    """'10k' -> 10000, '1M' -> 1000000, '2500' -> 2500."""
+    text = text.strip().lower()
+    factor = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text[:-1] if factor > 1 else text) * factor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic session/attempt history.")
+    parser.add_argument('out_dir')
+    parser.add_argument('--rows', type=parse_count, default=100000, help="Sessions, e.g. 10k, 1M, 10M")
+    parser.add_argument('--per-day', type=int, default=PER_DAY, help="Mean arrivals per day")
+    parser.add_argument('--storage', choices=('csv', 'sqlite'), default='csv')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    env = write_history(args.out_dir, args.rows, args.storage, args.seed, args.per_day)
+    probes = load_probes(args.out_dir)
+    print(f"[HISTORY] {args.rows} sessions ({args.storage}) in {time.perf_counter() - started:.1f}s, "
+          f"{len(probes['parked'])} parked now, {len(probes['abandoned'])} abandoned (last 1000 kept)")
+    for name, value in env.items():
+        print(f"{name}={value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""
+Resumable plate detector training on a pre-decoded, memory-mapped dataset.
+
+    python train_detector.py                                    # dataset/, resumes an interrupted run
+    python train_detector.py --data plates/arranged_dataset --epochs 150
+    python train_detector.py --check                            # only check the labels and build the cache
+    python train_detector.py --fresh                            # start a new run even if one can be resumed
+
+Plain `yolo train` decodes every 1920x1080 JPEG again each epoch only to
+shrink it to the training size, and an interrupted run starts over. Here:
+
+- labels are read and checked once per run against classes.txt (the
+  labelImg class list next to the dataset or one level up, or
+  --classes-file): five values per line, a class id classes.txt has,
+  normalized boxes inside the image. Any error stops the run before
+  training; images without a label file train as background. Only the
+  --classes given (default: every class the labels use) are trained, renumbered
+  from 0 in classes.txt order, so a labelImg id like 15 needs no editing;
+- images are decoded and resized to --imgsz (long side, as ultralytics
+  does) once, on all CPU cores, into <cache-dir>/<split>-<imgsz>.bin, one
+  flat uint8 file the data loader workers memory-map. The cache is only
+  rebuilt for a new image size or when an image file changes;
+- the data loader runs os.cpu_count() workers;
+- ultralytics writes <run>/weights/last.pt after every epoch. A run whose
+  last.pt is not finished is resumed from it by the next start, with the
+  settings it was started with.
+
+Both layouts in the repo work: <data>/<split>/images|labels (dataset/) and
+<data>/images|labels/<split> (plates/arranged_dataset). The run's data.yaml
+(JSON, which YAML reads) holds the class names and where the caches are.
+Copy the finished <run>/weights/best.pt into MODEL_DIR and the gates swap it
+in (see model_swap.py). ultralytics is only needed to train, not for --check.
+"""
+import argparse
+import functools
+import glob
+import json
+import math
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import config
+from event_log import get_logger, setup_logging
+
+try:
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+except ImportError:  # checking labels and building the cache work without it
+    YOLODataset = DetectionTrainer = None
+
+log = get_logger('train')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+SPLITS = ('train', 'val')
+BASE_WEIGHTS = 'yolov8n.pt'  # when MODEL_PATH does not exist yet
+
+
+# --- Dataset layout and labels ---
+def find_splits(data):
+    """{split: (images dir, labels dir)} for either layout."""
+    splits = {}
+    for split in SPLITS:
+        for images, labels in ((os.path.join(data, split, 'images'), os.path.join(data, split, 'labels')),
+                               (os.path.join(data, 'images', split), os.path.join(data, 'labels', split))):
+            if os.path.isdir(images):
+                splits[split] = (os.path.abspath(images), os.path.abspath(labels))
+                break
+        else:
+            raise SystemExit(f"[TRAIN] No {split} images in {data} ({split}/images or images/{split})")
+    return splits
+
+
+def find_classes_file(data):
+    for path in (os.path.join(data, 'classes.txt'), os.path.join(os.path.dirname(os.path.abspath(data)), 'classes.txt')):
+        if os.path.exists(path):
+            return path
+    raise SystemExit(f"[TRAIN] No classes.txt in {data} or its parent; pass --classes-file")
+
+
+def load_classes(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def read_labels(label_path, classes):
+    """([(class id, x, y, w, h)], [(severity, message)]) for one label file."""
+    rows, issues, seen = [], [], set()
+    with open(label_path) as f:
+        for n, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts:
+                continue
+            if len(parts) != 5:
+                issues.append(('error', f"line {n}: {len(parts)} values, expected class x y w h"))
+                continue
+            try:
+                cls = int(parts[0])
+                x, y, w, h = (float(v) for v in parts[1:])
+            except ValueError:
+                issues.append(('error', f"line {n}: not numbers: {line.strip()!r}"))
+                continue
+            if not 0 <= cls < len(classes):
+                issues.append(('error', f"line {n}: class {cls} is not in classes.txt ({len(classes)} classes)"))
+            elif not (0 < w <= 1 and 0 < h <= 1 and 0 <= x - w / 2 + 1e-3 and x + w / 2 - 1e-3 <= 1
+                      and 0 <= y - h / 2 + 1e-3 and y + h / 2 - 1e-3 <= 1):
+                issues.append(('error', f"line {n}: box {x:g} {y:g} {w:g} {h:g} is not a normalized box in the image"))
+            elif (cls, x, y, w, h) in seen:
+                issues.append(('warning', f"line {n}: duplicate box, dropped"))
+            else:
+                seen.add((cls, x, y, w, h))
+                rows.append((cls, x, y, w, h))
+    return rows, issues
+
+
+def check_labels(splits, classes):
+    """
+    Reads every label file. Returns ({split: {image path: rows}}, issues as
+    (severity, file, message), Counter of class ids used).
+    """
+    labels, issues, used = {}, [], Counter()
+    for split, (images_dir, labels_dir) in splits.items():
+        labels[split] = {}
+        stems = set()
+        for name in sorted(os.listdir(images_dir)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            stem = os.path.splitext(name)[0]
+            stems.add(stem)
+            image_path = os.path.join(images_dir, name)
+            label_path = os.path.join(labels_dir, stem + '.txt')
+            if not os.path.exists(label_path):
+                issues.append(('warning', image_path, "no label file, trained as background"))
+                rows = []
+            else:
+                rows, file_issues = read_labels(label_path, classes)
+                issues.extend((severity, label_path, message) for severity, message in file_issues)
+            used.update(row[0] for row in rows)
+            labels[split][image_path] = rows
+        if os.path.isdir(labels_dir):
+            for name in sorted(os.listdir(labels_dir)):
+                if name.endswith('.txt') and name != 'classes.txt' and os.path.splitext(name)[0] not in stems:
+                    issues.append(('warning', os.path.join(labels_dir, name), "label file without an image"))
+    return labels, issues, used
+
+
+# --- Image cache ---
+def _decode(path, imgsz):
+    """(original (h, w), image resized so its long side is imgsz), or None if unreadable."""
+    image = cv2.imread(path)
+    if image is None:
+        return None
+    h0, w0 = image.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        size = (min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA if r < 1 else cv2.INTER_LINEAR)
+    return (h0, w0), np.ascontiguousarray(image)
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_image_cache(split, image_paths, imgsz, cache_dir, workers):
+    """
+    Decodes `image_paths` into <cache_dir>/<split>-<imgsz>.bin unless the cache
+    there already holds exactly these files. Returns (index path, unreadable paths).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, f"{split}-{imgsz}.json")
+    bin_path = os.path.join(cache_dir, f"{split}-{imgsz}.bin")
+    files = [[path, *_stat(path)] for path in image_paths]
+    if os.path.exists(index_path) and os.path.exists(bin_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index['imgsz'] == imgsz and index['files'] == files:
+            return index_path, [entry[0] for entry in index['unreadable']]
+
+    started = time.perf_counter()
+    images, unreadable, offset = [], [], 0
+    chunk = max(1, workers) * 4  # bounds how many decoded images wait to be written
+    with open(bin_path + '.tmp', 'wb') as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(files), chunk):
+            batch = files[start:start + chunk]
+            for (path, size, mtime), decoded in zip(batch, pool.map(_decode, [f[0] for f in batch],
+                                                                     [imgsz] * len(batch))):
+                if decoded is None:
+                    unreadable.append([path, size, mtime])
+                    continue
+                shape, image = decoded
+                out.write(image.tobytes())
+                images.append({'file': path, 'size': size, 'mtime': mtime, 'shape': list(shape),
+                               'resized': list(image.shape[:2]), 'offset': offset})
+                offset += image.nbytes
+    os.replace(bin_path + '.tmp', bin_path)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({'imgsz': imgsz, 'bin': os.path.basename(bin_path), 'bytes': offset, 'files': files,
+                   'images': images, 'unreadable': unreadable}, f)
+    os.replace(index_path + '.tmp', index_path)
+    log.info('TRAIN', f"Cached {len(images)} {split} images at {imgsz} px ({offset / 2**20:.0f} MB) in "
+             f"{time.perf_counter() - started:.1f}s on {workers} threads.", split=split, images=len(images),
+             bytes=offset)
+    return index_path, [entry[0] for entry in unreadable]
+
+
+def write_split_labels(path, split_labels, class_map):
+    """Writes {image path: [[train class, x, y, w, h]]}, dropping boxes of classes not trained."""
+    dropped = 0
+    out = {}
+    for image_path, rows in split_labels.items():
+        kept = [[class_map[row[0]], *row[1:]] for row in rows if row[0] in class_map]
+        dropped += len(rows) - len(kept)
+        out[image_path] = kept
+    with open(path, 'w') as f:
+        json.dump({'labels': out}, f)
+    return dropped
+
+
+# --- ultralytics ---
+if YOLODataset is not None:
+    class CachedYOLODataset(YOLODataset):
+        """YOLODataset that reads checked labels and pre-decoded images from the cache."""
+
+        def __init__(self, *args, prepared, **kwargs):
+            self.prepared = prepared  # {'images': index json, 'labels': labels json}
+            self._images = None
+            super().__init__(*args, **kwargs)
+
+        def get_labels(self):
+            with open(self.prepared['images']) as f:
+                index = json.load(f)
+            with open(self.prepared['labels']) as f:
+                rows_by_image = json.load(f)['labels']
+            self._bin = os.path.join(os.path.dirname(self.prepared['images']), index['bin'])
+            self._bytes = index['bytes']
+            # By file, not position: rect mode (val) reorders im_files and labels
+            self._slots = {e['file']: (*e['shape'], *e['resized'], e['offset']) for e in index['images']}
+            labels = []
+            for entry in index['images']:
+                rows = np.array(rows_by_image.get(entry['file'], []), dtype=np.float32).reshape(-1, 5)
+                labels.append({'im_file': entry['file'], 'shape': tuple(entry['shape']), 'cls': rows[:, :1],
+                               'bboxes': rows[:, 1:], 'segments': [], 'keypoints': None, 'normalized': True,
+                               'bbox_format': 'xywh'})
+            self.im_files = [label['im_file'] for label in labels]
+            return labels
+
+        def load_image(self, i, rect_mode=True):
+            if self._images is None:  # opened in each data loader worker
+                self._images = np.memmap(self._bin, dtype=np.uint8, mode='r', shape=(self._bytes,))
+            h0, w0, h, w, offset = self._slots[self.im_files[i]]
+            # A copy: augmentations may write into it, and the map is read-only
+            image = np.array(self._images[offset:offset + h * w * 3]).reshape(h, w, 3)
+            if not rect_mode and (h, w) != (self.imgsz, self.imgsz):
+                image = cv2.resize(image, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+            if self.augment and i not in self.buffer:
+                self.buffer.append(i)  # mosaic picks its other images from here
+                if len(self.buffer) > self.max_buffer_length:
+                    self.buffer.pop(0)
+            return image, (h0, w0), image.shape[:2]
+
+        def __getstate__(self):
+            state = self.__dict__.copy()
+            state['_images'] = None  # a memmap would be pickled as a full copy
+            return state
+
+    class CachedDetectionTrainer(DetectionTrainer):
+        """DetectionTrainer whose data loaders use CachedYOLODataset."""
+
+        def build_dataset(self, img_path, mode='train', batch=None):
+            from ultralytics.data import build
+            with open(self.args.data) as f:
+                prepared = json.load(f)['cache']['train' if mode == 'train' else 'val']
+            original = build.YOLODataset
+            build.YOLODataset = functools.partial(CachedYOLODataset, prepared=prepared)
+            try:
+                return super().build_dataset(img_path, mode, batch)
+            finally:
+                build.YOLODataset = original
+
+
+def resumable_run(project, name):
+    """last.pt of the newest run <project>/<name>* that has not finished, or None."""
+    checkpoints = sorted(glob.glob(os.path.join(project, f"{name}*", 'weights', 'last.pt')),
+                         key=os.path.getmtime, reverse=True)
+    if not checkpoints:
+        return None
+    import torch
+    try:
+        checkpoint = torch.load(checkpoints[0], map_location='cpu', weights_only=False)
+    except TypeError:  # torch < 1.13
+        checkpoint = torch.load(checkpoints[0], map_location='cpu')
+    # ultralytics sets epoch to -1 when it strips a finished run's optimizer
+    return checkpoints[0] if checkpoint.get('epoch', -1) >= 0 else None
+
+
+# --- Main ---
+def prepare(args):
+    """Checks the labels and builds the caches; returns the path of the run's data.yaml."""
+    splits = find_splits(args.data)
+    classes_file = args.classes_file or find_classes_file(args.data)
+    classes = load_classes(classes_file)
+    labels, issues, used = check_labels(splits, classes)
+
+    for split, (images_dir, _) in splits.items():
+        index_path, unreadable = build_image_cache(split, list(labels[split]), args.imgsz, args.cache_dir,
+                                                   args.workers)
+        issues.extend(('error', path, "image cannot be decoded") for path in unreadable)
+        splits[split] = (images_dir, index_path)
+
+    errors = [issue for issue in issues if issue[0] == 'error']
+    for severity, path, message in issues[:50]:
+        print(f"[TRAIN] {severity}: {os.path.relpath(path)}: {message}")
+    if len(issues) > 50:
+        print(f"[TRAIN] ... {len(issues) - 50} more")
+    counts = ", ".join(f"{classes[cls]} (id {cls}) {count}" for cls, count in sorted(used.items()))
+    log.info('TRAIN', f"Labels checked against {classes_file}: "
+             f"{', '.join(f'{split} {len(rows)} images' for split, rows in labels.items())}; boxes: {counts}; "
+             f"{len(errors)} errors, {len(issues) - len(errors)} warnings.", errors=len(errors),
+             warnings=len(issues) - len(errors))
+    if errors:
+        raise SystemExit(f"[TRAIN] {len(errors)} label errors; fix them before training")
+
+    if args.classes:
+        train = [name.strip() for name in args.classes.split(',') if name.strip()]
+        missing = [name for name in train if name not in classes]
+        if missing:
+            raise SystemExit(f"[TRAIN] Not in {classes_file}: {', '.join(missing)}")
+    else:
+        train = [name for cls, name in enumerate(classes) if cls in used]
+    if not train:
+        raise SystemExit("[TRAIN] The labels contain no boxes to train on")
+    class_map = {classes.index(name): new for new, name in enumerate(train)}
+
+    cache = {}
+    for split, (images_dir, index_path) in splits.items():
+        labels_path = os.path.join(args.cache_dir, f"{split}-labels.json")
+        dropped = write_split_labels(labels_path, labels[split], class_map)
+        if dropped:
+            log.warning('TRAIN', f"{dropped} {split} boxes of classes not trained ignored.", split=split,
+                        dropped=dropped)
+        cache[split] = {'images': os.path.abspath(index_path), 'labels': os.path.abspath(labels_path)}
+    data_yaml = os.path.join(args.cache_dir, 'data.yaml')
+    with open(data_yaml, 'w') as f:
+        json.dump({'train': splits['train'][0], 'val': splits['val'][0], 'nc': len(train),
+                   'names': dict(enumerate(train)), 'cache': cache}, f, indent=2)
+    return os.path.abspath(data_yaml)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the plate detector on a cached dataset, resuming if interrupted.")
+    parser.add_argument('--data', default='dataset', help="Dataset directory (train/ and val/ splits)")
+    parser.add_argument('--classes-file', help="labelImg classes.txt (default: in --data or its parent)")
+    parser.add_argument('--classes', help="Comma-separated class names to train (default: all the labels use)")
+    parser.add_argument('--model', help=f"Starting weights (default: {config.MODEL_PATH}, else {BASE_WEIGHTS})")
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--imgsz', type=int, default=config.DETECT_SIZE, help="Training size; the gates detect at DETECT_SIZE")
+    parser.add_argument('--batch', type=int, default=16)
+    parser.add_argument('--device', default='', help="'' = ultralytics picks, 'cpu', '0', ...")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Data loader workers and cache threads")
+    parser.add_argument('--cache-dir', help="Where the image cache goes (default: <data>/image_cache)")
+    parser.add_argument('--project', default='runs/train')
+    parser.add_argument('--name', default='detector')
+    parser.add_argument('--fresh', action='store_true', help="Start a new run even if one can be resumed")
+    parser.add_argument('--check', action='store_true', help="Only check the labels and build the cache")
+    args = parser.parse_args()
+    args.cache_dir = args.cache_dir or os.path.join(args.data, 'image_cache')
+
+    setup_logging('train')
+    data_yaml = prepare(args)
+    if args.check:
+        print(f"[TRAIN] Labels and cache ready: {data_yaml}")
+        return
+    if DetectionTrainer is None:
+        raise SystemExit("[TRAIN] ultralytics is not installed (pip install -r requirements.txt)")
+
+    from ultralytics import YOLO
+    last = None if args.fresh else resumable_run(args.project, args.name)
+    if last:
+        # ultralytics restores the run's own settings (epochs, data, ...) from the checkpoint
+        log.info('TRAIN', f"Resuming {last}.", checkpoint=last)
+        YOLO(last).train(resume=True, trainer=CachedDetectionTrainer)
+        run_dir = os.path.dirname(os.path.dirname(last))
+    else:
+        weights = args.model or (config.MODEL_PATH if os.path.exists(config.MODEL_PATH) else BASE_WEIGHTS)
+        log.info('TRAIN', f"Training from {weights} for {args.epochs} epochs at {args.imgsz} px, "
+                 f"{args.workers} workers.", weights=weights, epochs=args.epochs, imgsz=args.imgsz)
+        trainer_model = YOLO(weights)
+        trainer_model.train(data=data_yaml, epochs=args.epochs, imgsz=args.imgsz, batch=args.batch,
+                            device=args.device or None, workers=args.workers, cache=False,
+                            project=args.project, name=args.name, trainer=CachedDetectionTrainer)
+        run_dir = str(trainer_model.trainer.save_dir)
+    print(f"[TRAIN] Done: {os.path.join(run_dir, 'weights', 'best.pt')} - copy it into {config.MODEL_DIR} "
+          f"and the gates swap it in.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())